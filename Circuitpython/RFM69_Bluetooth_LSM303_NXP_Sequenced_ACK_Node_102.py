@@ -2,14 +2,43 @@ import board
 import busio
 from math import atan, atan2, cos, pi, sin
 from digitalio import DigitalInOut, Direction, Pull
-from time import sleep
 
 DEBUG = True
 
 PIN_ONBOARD_LED = board.D13
 PIN_PACKET_LED = board.D2                                                                                                                                                                                                                                                                                                                                              
 
-SEND_PACKET_INTERVAL_MIN = 2.0
+#   Sliding window ARQ settings
+ARQ_WINDOW_SIZE = 8
+
+#   The channel counts as busy above this RSSI (dBm), and we wait before talking
+MAC_BUSY_RSSI = -90
+
+#   Use the time slots of a gateway's beacons, while they are heard
+TDMA_ENABLED = True
+TDMA_JOIN_CHECK_MS = 500
+
+#   Limits for the adaptive retransmission timeout of each neighbor
+RTT_INITIAL_TIMEOUT_MS = 1000
+RTT_MIN_TIMEOUT_MS = 30
+RTT_MAX_TIMEOUT_MS = 8000
+
+#   Task periods for the scheduler
+HEARTBEAT_ON_MS = 100
+HEARTBEAT_OFF_MS = 900
+PACKET_LED_ON_MS = 100
+RADIO_POLL_INTERVAL_MS = 2
+LINK_AGE_INTERVAL_MS = 10000
+
+#   Data received is acknowledged by the next packet we send its sender within
+#       this long, or else by an ACK packet of its own
+ACK_DELAY_MS = 20
+SENSOR_SAMPLE_INTERVAL_MS = 20
+SENSOR_RECORD_INTERVAL_MS = 200
+DEBUG_PRINT_INTERVAL_MS = 2000
+
+#   Sensor records are sent in batches, at the latest this long after the first one
+BATCH_MAX_LATENCY_MS = 2000
 
 SPI_SCK = board.SCK
 SPI_MISO = board.MISO
@@ -27,9 +56,27 @@ SCRIPT_VERSION = 0.0
 RFM69_CS = DigitalInOut(board.D10)
 RFM69_RST = DigitalInOut(board.D11)
 
+#   The radio's DIO0 (G0) pin, high while a received packet is waiting
+RFM69_DIO0 = board.D6
+
 #   Change this to your node's network address
 RFM69_NETWORK_NODE = 102
 
+#   Discovered routes, how many to keep and for how long
+ROUTE_CACHE_SIZE = 8
+ROUTE_LIFETIME_MS = 120000
+
+#   Static routes to nodes that are out of radio range, as
+#       (destination, next hop) pairs, e.g. ((1, 103),)
+RFM69_STATIC_ROUTES = ()
+
+#   Multicast groups to receive, from mesh_header.MULTICAST_FIRST (0xFF00) up,
+#       e.g. (0xFF01,). Broadcasts are always received.
+RFM69_GROUPS = ()
+
+#   Node our packets are sent to
+RFM69_DESTINATION_NODE = 103
+
 #   Frequency of the radio in Mhz. Must match your
 #       module! Can be a value like 915.0, 433.0, etc.
 RFM69_RADIO_FREQ_MHZ = 915.0
@@ -46,45 +93,24 @@ import adafruit_lsm303dlh_mag
 
 import adafruit_rfm69
 
-def millis():
-	return time() * 1000
-
-def minutes(start, decimal=0):
-	#	60 seconds * 1000 ms = 1 minute
-	return round((millis() - start) / 60000, decimal)
-
-def blinkLED(led, wait=0.2, cycles=1):
-	for cy in range(cycles):
-		led.value = True
-		sleep(wait)
-		led.value = False
-		sleep(wait)
-
-def pack(number, length=4):
-	n = number
-	g = []
-
-	while n > 0:
-		g.append(n & 0xFF)
-		n = n >> 8
-
-	t = ""
-
-	for index in range(len(g)):
-		t = chr(g[index]) + t
-
-	while len(t) < length:
-		t = chr(0) + t
-
-	return t
-
-def unpack(st):
-	n = 0
-
-	for index in range(len(st)):
-		n = n + (ord(st[index]) << (8 * (len(st) - index - 1)))
-
-	return n
+import mesh_arq
+import mesh_batch
+import mesh_clock
+import mesh_compress
+import mesh_dedup
+import mesh_discovery
+import mesh_fragment
+import mesh_header
+import mesh_link
+import mesh_mac
+import mesh_neighbor
+import mesh_radio
+import mesh_routing
+import mesh_rtt
+import mesh_scheduler
+import mesh_tdma
+import mesh_timesync
+import mesh_sensor
 
 #	Convert anglular data to degrees
 def angleToDegrees(angle, p):
@@ -137,7 +163,7 @@ def simpleOrientation(acc_x, acc_y, acc_z, mag_x, mag_y, mag_z, p):
 	pitch = angleToDegrees(pitch, pi)
 	heading = angleToDegrees(heading, pi) + 180
 
- 	return roll, pitch, heading
+	return roll, pitch, heading
 
 #   Initialize the onboard LED
 heartBeatLED = DigitalInOut(PIN_ONBOARD_LED)
@@ -182,6 +208,9 @@ rfm69 = adafruit_rfm69.RFM69(spi, RFM69_CS, RFM69_RST, RFM69_RADIO_FREQ_MHZ)
 # on the transmitter and receiver (or be set to None to disable/the default).
 rfm69.encryption_key = b'\x01\x02\x03\x04\x05\x06\x07\x08\x01\x02\x03\x04\x05\x06\x07\x08'
 
+#   Received packets are moved from the radio into this ring as soon as DIO0 goes high
+radioReceiver = mesh_radio.RadioReceiver(rfm69, RFM69_DIO0)
+
 rfm69Celsius = rfm69.temperature
 rfm69Fahrenheit = round(rfm69Celsius * 1.8 + 32, 1)
 
@@ -200,135 +229,367 @@ lsmAcc = adafruit_lsm303_accel.LSM303_Accel(i2c)
 nxpAcc = adafruit_fxos8700.FXOS8700(i2c)
 nxpGyro = adafruit_fxas21002c.FXAS21002C(i2c)
 
-loopCount = 0
-receivedPacket = True
 packetReceivedCount = 0
+packetRejectedCount = 0
 packetSentCount = 0
-resendMessage = False
-sequenceNumber = 0
 ackPacketsReceived = 0
-acknowledged = True
+ackPacketsSent = 0
+acksPiggybacked = 0
 
-startSendMillis = millis()
+#   RSSI and delivery ratio of every neighbor
+links = mesh_link.LinkEstimator()
 
-print()
+#   Next hops for destinations we can not reach directly
+router = mesh_routing.Router(RFM69_NETWORK_NODE, cache=mesh_routing.RouteCache(ROUTE_CACHE_SIZE, ROUTE_LIFETIME_MS), links=links)
 
-while True:
-    blinkLED(heartBeatLED)
-    loopCount += 1
+for destination, nextHop in RFM69_STATIC_ROUTES:
+    router.table.addRoute(destination, nextHop)
 
-    if DEBUG:
-        print("Loop #{0:6d}".format(loopCount))
-        print()
+for group in RFM69_GROUPS:
+    router.join(group)
+
+#   Round trip time estimates for each neighbor. Under TDMA a packet can wait
+#       a whole superframe for our slot before it even goes out, so the first
+#       timeout allows for that on top of the round trip.
+rttInitialTimeout = RTT_INITIAL_TIMEOUT_MS
+
+if TDMA_ENABLED:
+    rttInitialTimeout += mesh_tdma.DEFAULT_SUPERFRAME_MS
+
+rttTable = mesh_rtt.RttTable(rttInitialTimeout, RTT_MIN_TIMEOUT_MS, RTT_MAX_TIMEOUT_MS)
+
+#   One sender for our destination, and a receiver per node that sends to us
+arqSender = mesh_arq.ArqSender(ARQ_WINDOW_SIZE, firstSequence=mesh_arq.initialSequence(), rttEstimator=rttTable.estimatorFor(RFM69_DESTINATION_NODE))
+arqReceivers = {}
+
+#   Nodes whose data we have not acknowledged yet
+acksOwed = set()
+
+#   Messages too big for one packet go out, and come back together, in fragments
+fragmenter = mesh_fragment.Fragmenter()
+reassembler = mesh_fragment.Reassembler()
+
+#   Tell the receiving end the units and scales of our sensor records first
+fragmenter.start(mesh_sensor.describe("IMU_V1", mesh_sensor.IMU_V1_CHANNELS))
 
-    currentSendMinutes = minutes(startSendMillis, 1)
+#   (from node, sequence) of every data packet seen recently
+duplicates = mesh_dedup.DuplicateFilter()
 
-    #   Put RFM69 radio stuff here
-    if acknowledged or currentSendMinutes >= SEND_PACKET_INTERVAL_MIN:
-        startSendMillis = millis()
+#   NXP IMU records waiting to be sent, with the network time of each, delta
+#       compressed into as many as fit in one packet with an ACK in it
+batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, len(mesh_sensor.IMU_V1_CHANNELS), maxPayload=mesh_header.MAX_ACKED_PAYLOAD_SIZE, maxLatency=BATCH_MAX_LATENCY_MS, timed=True, interval=SENSOR_RECORD_INTERVAL_MS)
+
+#   Preallocated packet buffers, reused for every packet
+outPacket = mesh_header.newPacketBuffer()
+ackPacket = mesh_header.newPacketBuffer()
+
+#   Latest sensor readings
+lsm_acc_x, lsm_acc_y, lsm_acc_z = 0.0, 0.0, 0.0
+lsm_mag_x, lsm_mag_y, lsm_mag_z = 0.0, 0.0, 0.0
+nxp_acc_x, nxp_acc_y, nxp_acc_z = 0.0, 0.0, 0.0
+nxp_mag_x, nxp_mag_y, nxp_mag_z = 0.0, 0.0, 0.0
+nxp_gyro_x, nxp_gyro_y, nxp_gyro_z = 0.0, 0.0, 0.0
+roll, pitch, heading = 0.0, 0.0, 0.0
+
+def radioTransmit(frame):
+    #   A time sync packet gets our network time as late as possible
+    timeSync.stamp(frame)
+    rfm69.send(frame, keep_listening=True)
+
+#   Listens before talking, and backs off while the channel is busy
+mac = mesh_mac.ListenBeforeTalk(rfm69, radioTransmit, busyRssi=MAC_BUSY_RSSI)
+
+def radioSend(frame):
+    #   Goes out as soon as the channel is clear, or in our time slot
+    mac.queue(frame)
+    scheduler.wake(macTaskHandle)
+
+def macTask():
+    return mac.run()
+
+#   Our time slot, from the gateway's beacons
+tdma = mesh_tdma.TdmaSchedule(RFM69_NETWORK_NODE, radioSend)
+
+if TDMA_ENABLED:
+    mac.schedule = tdma
+
+def tdmaJoinTask():
+    #   Ask the gateway for a slot while we hear beacons but have none
+    tdma.join()
+
+#   Network time, from the gateway's time sync rounds
+timeSync = mesh_timesync.TimeSync(RFM69_NETWORK_NODE, radioSend)
+
+#   Nodes in radio range, from their HELLO beacons and anything else we hear
+neighbors = mesh_neighbor.NeighborDiscovery(RFM69_NETWORK_NODE, radioSend)
+
+def helloTask():
+    return neighbors.run()
+
+#   Finds routes to destinations that are not in the routing table
+discovery = mesh_discovery.RouteDiscovery(router, radioSend)
+
+def heartBeatTask():
+    heartBeatLED.value = not heartBeatLED.value
+
+    if heartBeatLED.value:
+        return HEARTBEAT_ON_MS
+
+    return HEARTBEAT_OFF_MS
+
+def packetLEDOffTask():
+    packetReceivedLED.value = False
+
+def ackFor(toNode, payloadLength, routed):
+    #   The cumulative ACK a packet to toNode should carry, or None
+    if toNode not in acksOwed or mesh_header.packetSize(payloadLength, routed, True) > mesh_header.MAX_PACKET_SIZE:
+        return None
+
+    acksOwed.discard(toNode)
+
+    return arqReceivers[toNode].ackState()
+
+def radioSendTask():
+    global packetSentCount, acksPiggybacked
+
+    #   A message in fragments goes first, its fragments need consecutive sequence numbers
+    fragmenter.pump(arqSender)
+
+    #   Send the batch of sensor records once it is full, or has waited long enough
+    if not fragmenter.busy() and batcher.isDue(mesh_clock.ticksMs()) and arqSender.canQueue():
         packetSentCount += 1
-        toNodeAddress = 103
-
-        #   Pack the packet
-        packedSequence = pack(packetSentCount, 4)
-        packedFromNode = pack(RFM69_NETWORK_NODE, 2)
-        packedToNode = pack(toNodeAddress, 2)
-        packedTotalPackets = pack(25, 1)
-        packedSubPacketNumber = pack(12, 1)
-        payload = "Hello node {0}".format(toNodeAddress)
-        packedPacketLength = pack(len(packedSequence) + len(packedFromNode) + len(packedToNode) + len(packedTotalPackets) + len(packedSubPacketNumber) + len(payload) + 1, 1)
-
-        packetHeader = packedSequence + packedFromNode + packedToNode + packedPacketLength + packedTotalPackets + packedSubPacketNumber
-
-        outPacket = packetHeader + payload
-        
-        print('Sending {0:4d} "Hello Node 103" message!'.format(packetSentCount))
-        ##("Sending" if receivedPacket else "ReSending"), packetSentCount))
-        #rfm69.send(bytes("Hello World #{0}\r\n".format(packetSentCount), "utf-8"))
-        rfm69.send(bytes(outPacket, "utf-8"))
-        acknowledged = False
-
-    resendMessage = False
-    receivedPacket = False
-    print()
+        arqSender.queue(batcher.flush())
+
+    #   Look for a route unless the destination is a neighbor, sending straight to it meanwhile
+    if not router.hasRoute(RFM69_DESTINATION_NODE) and not neighbors.isNeighbor(RFM69_DESTINATION_NODE):
+        discovery.request(RFM69_DESTINATION_NODE)
+
+    #   Send new packets, and resend the ones whose ACK has not arrived in time
+    now = mesh_clock.ticksMs()
+    timedOut = False
+
+    for sequence in arqSender.due(now):
+        if arqSender.isRetransmission(sequence):
+            #   The last copy never got through. The whole window timing out
+            #       at once is one loss for the link, not one per packet.
+            if not timedOut:
+                timedOut = True
+                links.lost(router.nextHopFor(RFM69_DESTINATION_NODE))
+
+            mac.lost()
+
+        totalPackets, subPacketNumber = arqSender.fragmentOf(sequence)
+        payload = arqSender.payloadOf(sequence)
+        route = router.routeTo(RFM69_DESTINATION_NODE)
+
+        #   Acknowledge what the destination sent us on the way
+        ack = ackFor(RFM69_DESTINATION_NODE, len(payload), route is not None)
+
+        if ack is not None:
+            acksPiggybacked += 1
+
+        outPacketLength = mesh_header.packPacket(outPacket, sequence, RFM69_NETWORK_NODE, RFM69_DESTINATION_NODE, mesh_header.PACKET_TYPE_DATA, payload, totalPackets, subPacketNumber, route=route, ack=ack)
 
-    if not receivedPacket:
-        sleep(0.2)
+        if DEBUG:
+            print("Sending packet {0:4d} to node {1}".format(sequence, RFM69_DESTINATION_NODE))
 
-    print('Waiting for packets...')
+        radioSend(memoryview(outPacket)[:outPacketLength])
+        arqSender.sent(sequence, now)
 
-    if resendMessage:
-        windowSize = 2.0
+    #   Run again when the next retransmission, or the batch, is due
+    now = mesh_clock.ticksMs()
+    wait = arqSender.timeUntilDue(now)
+    batchWait = batcher.timeUntilDue(now)
+
+    if batchWait is not None and arqSender.canQueue():
+        wait = min(wait, batchWait)
+
+    return wait
+
+def ackTask():
+    #   Send an ACK packet to every node whose data no outgoing packet has acknowledged
+    global ackPacketsSent
+
+    while acksOwed:
+        toNode = acksOwed.pop()
+        ackSequence, bitmap = arqReceivers[toNode].ackState()
+
+        ackPacketLength = mesh_header.packPacket(ackPacket, ackSequence - 1, RFM69_NETWORK_NODE, toNode, mesh_header.PACKET_TYPE_ACK, route=router.routeTo(toNode), ack=(ackSequence, bitmap))
+        radioSend(memoryview(ackPacket)[:ackPacketLength])
+        ackPacketsSent += 1
+
+def oweAck(toNode):
+    if toNode not in acksOwed:
+        acksOwed.add(toNode)
+        scheduler.after(ACK_DELAY_MS, ackTask)
+
+def handleAck(sequence, fromNode, ack):
+    global ackPacketsReceived
+
+    ackPacketsReceived += 1
+
+    if fromNode != RFM69_DESTINATION_NODE:
+        return
+
+    if ack is None:
+        #   A plain ACK, of its own sequence number only
+        acked = arqSender.acknowledge(sequence, mesh_clock.ticksMs())
     else:
-        windowSize = 1.5
+        acked = arqSender.acknowledgeRange(ack[0], ack[1], mesh_clock.ticksMs())
 
-    packet = rfm69.receive(timeout=windowSize)
+    if acked:
+        #   The route to whoever ACKed, and the link to its first hop, are evidently still good
+        router.cache.refresh(fromNode)
+        links.delivered(router.nextHopFor(fromNode))
 
-    if packet is None:
-        # Packet has not been received
-        resendMessage = True
-        receivedPacket = False
-        packetReceivedLED.value = False
-        print('Received nothing! Listening again...')
-        print()
+        #   The window may have room for a new packet now
+        scheduler.wake(radioSendTaskHandle)
+
+    if DEBUG:
+        print("Received ACK of {0} packets from node {1}".format(int(acked), fromNode))
+
+def deliverPayload(sequenceIn, fromNodeAddress, toNodeAddress, totalPacketsIn, subPacketNumberIn, payloadIn):
+    if totalPacketsIn > 1:
+        payloadIn = reassembler.add(fromNodeAddress, sequenceIn, totalPacketsIn, subPacketNumberIn, payloadIn)
+
+        if payloadIn is None:
+            #   Still waiting for the rest of the message
+            return
+
+    # Note that you always receive raw bytes and need to convert to
+    # a text format like ASCII if you intend to do string processing
+    # on your data.
+    if mesh_batch.isBatch(payloadIn):
+        for record in mesh_batch.decodeBatch(payloadIn):
+            print("Delivered record from node {0}: {1}".format(fromNodeAddress, record))
+    elif mesh_header.isGroupAddress(toNodeAddress):
+        print("Delivered packet #{0} from node {1} to group {2:#06x} (ASCII): '{3}'".format(sequenceIn, fromNodeAddress, toNodeAddress, str(payloadIn, 'ASCII')))
     else:
-        # Received a new packet!
-        receivedPacket = True
-        packetReceivedCount += 1
-        packetReceivedLED.value = True
-
-        packetNumberIn = unpack(packet[0:4])
-        fromNodeAddress = unpack(outPacket[4:6])
-        typeIn = unpack(outPacket[8:9])
-        
-        if typeIn == 1:
-            #   Standard Packet
-            payloadIn = packet[12:]
-        elif typeIn == 2:
-            #   Acknowledgement Packet
-            payloadIn = packet[9:]
-
-        payloadInText = str(payloadIn, 'ASCII')
-
-        if payloadInText == "ACK":
-            #   Acknowledgement Packet
-            acknowledged = True
-            print("Received ACK of packet {0} from node {1}".format(packetNumberIn, fromNodeAddress))
-        else:
-            #   New Packet
-            print("Received new packet #{0} (raw bytes): '{1}', from node {2}".format(packetNumberIn, packet, fromNodeAddress))
-            # And decode to ASCII text and print it too.  Note that you always
-            # receive raw bytes and need to convert to a text format like ASCII
-            # if you intend to do string processing on your data.  Make sure the
-            # sending side is sending ASCII data before you try to decode!
-
-            #
-            #   Add packet validation here
-            #
-
-            #   Finish unpacking the packet
-            if typeIn == 1:
-                toNodeAddress = unpack(outPacket[6:8])
-                packetLenthIn = unpack(outPacket[9:10])
-                totalPacketsIn = unpack(outPacket[10:11])
-                subPacketNumberIn = unpack(outPacket[11:12])
-                print("Received (ASCII): '{0}'".format(payloadITtext))
-
-            sleep(0.2)
-
-            if typeIn != 2:
-                #   ACK the packet
-                ackPacket = pack(packetNumberIn) + pack(RFM69_NETWORK_NODE, 2) + pack(fromNodeAddress, 2) + pack(2, 1) + "ACK"
-                rfm69.send(bytes(ackPacket, "utf-8"))
-    
+        print("Delivered packet #{0} from node {1} (ASCII): '{2}'".format(sequenceIn, fromNodeAddress, str(payloadIn, 'ASCII')))
+
+def handlePacket(packet):
+    packetNumberIn, fromNodeAddress, toNodeAddress, typeIn, packetLengthIn, totalPacketsIn, subPacketNumberIn = mesh_header.unpackHeader(packet)
+
+    if mesh_header.isGroupAddress(toNodeAddress):
+        #   Group traffic is never acknowledged and carries no ACKs, so one
+        #       transmission reaches every member without an ACK from each
+        if typeIn == mesh_header.PACKET_TYPE_DATA:
+            deliverPayload(packetNumberIn, fromNodeAddress, toNodeAddress, totalPacketsIn, subPacketNumberIn, mesh_header.payloadOf(packet))
+
+        return
+
+    #   Any packet can carry an ACK of the data we sent
+    ackIn = mesh_header.unpackAck(packet)
+
+    if ackIn is not None or typeIn == mesh_header.PACKET_TYPE_ACK:
+        handleAck(packetNumberIn, fromNodeAddress, ackIn)
+
+    if typeIn == mesh_header.PACKET_TYPE_DATA and duplicates.isDuplicate(fromNodeAddress, packetNumberIn, False):
+        #   Seen it already, so our ACK must have been lost. ACK it again, and that is all.
+        #       The ACK says what the ARQ receiver has, never more.
+        if fromNodeAddress in arqReceivers:
+            oweAck(fromNodeAddress)
+
+        if DEBUG:
+            print("Received duplicate of packet #{0} from node {1}".format(packetNumberIn, fromNodeAddress))
+
+        return
+
+    payloadIn = mesh_header.payloadOf(packet)
+
+    if typeIn == mesh_header.PACKET_TYPE_DATA:
+        #   New Packet
+        if DEBUG:
+            print("Received new packet #{0} (raw bytes): '{1}', from node {2}".format(packetNumberIn, bytes(packet), fromNodeAddress))
+
+        arqReceiver = arqReceivers.get(fromNodeAddress)
+
+        if arqReceiver is None:
+            arqReceiver = mesh_arq.ArqReceiver(ARQ_WINDOW_SIZE)
+            arqReceivers[fromNodeAddress] = arqReceiver
+
+        if arqReceiver.receive(packetNumberIn, payloadIn, totalPacketsIn, subPacketNumberIn):
+            #   Only now seen, a packet turned away comes again
+            duplicates.mark(fromNodeAddress, packetNumberIn)
+            #   ACK the packet, along with anything else that arrives before we send
+            oweAck(fromNodeAddress)
+
+        #   Hand packets to the application in sequence order
+        for sequenceIn, payloadIn in arqReceiver.deliver():
+            totalPacketsIn, subPacketNumberIn = arqReceiver.fragmentOf(sequenceIn)
+            deliverPayload(sequenceIn, fromNodeAddress, toNodeAddress, totalPacketsIn, subPacketNumberIn, payloadIn)
+
+def radioReceiveTask():
+    global packetReceivedCount, packetRejectedCount
+
+    #   Empty the radio's FIFO into the ring, never blocks
+    radioReceiver.drain()
+
+    packet, rssiIn = radioReceiver.next()
+
+    if packet is None:
+        return
+
+    #   Check the length and CRC before anything else is read from the packet
+    if not mesh_header.isValidPacket(packet):
+        packetRejectedCount += 1
+        radioReceiver.release()
+
+        if DEBUG:
+            print("Rejected a corrupt packet of {0} bytes ({1} so far)".format(len(packet), packetRejectedCount))
+
+        return 0
+
+    # Received a new packet!
+    packetReceivedCount += 1
+    packetReceivedLED.value = True
+    scheduler.after(PACKET_LED_ON_MS, packetLEDOffTask)
+
+    links.heard(mesh_header.transmitterOf(packet), rssiIn)
+
+    if neighbors.heard(mesh_header.transmitterOf(packet)):
+        #   A new neighbor, beacon fast again
+        scheduler.wake(helloTaskHandle)
+
+    #   Beacons, time sync, HELLOs, route requests and route replies stop here, everything else is routed
+    if tdma.handle(packet, radioReceiver.receivedAt()):
+        if DEBUG:
+            print("Beacon from gateway {0}, our slot is {1}".format(tdma.gateway, tdma.slot))
+    elif timeSync.handle(packet, radioReceiver.receivedAt()):
+        if DEBUG:
+            print("Time sync round {0} from root {1}, level {2}, network time {3}".format(timeSync.round, timeSync.root, timeSync.level, timeSync.now()))
+    elif neighbors.handle(packet):
+        scheduler.wake(helloTaskHandle)
+
+        if DEBUG:
+            print("HELLO from node {0}, {1} neighbors, beacon interval {2} ms".format(mesh_header.fromNodeOf(packet), neighbors.table.count, neighbors.interval))
+    elif not discovery.handle(packet):
+        action = router.inspect(packet)
+
+        if action & mesh_routing.ACTION_DELIVER:
+            handlePacket(packet)
+
+        if action & mesh_routing.ACTION_FORWARD:
+            #   Not for us, or flooded to a group, pass it on to the next hop
+            nextHop = router.forward(packet)
+            radioSend(packet)
+
+            if DEBUG:
+                print("Forwarded packet #{0} from node {1} to node {2} via node {3}".format(mesh_header.sequenceOf(packet), mesh_header.fromNodeOf(packet), mesh_header.toNodeOf(packet), nextHop))
+
+    radioReceiver.release()
+
+    #   There may be another packet waiting already
+    return 0
+
+def sensorTask():
+    global lsm_acc_x, lsm_acc_y, lsm_acc_z, lsm_mag_x, lsm_mag_y, lsm_mag_z
+    global nxp_acc_x, nxp_acc_y, nxp_acc_z, nxp_mag_x, nxp_mag_y, nxp_mag_z, nxp_gyro_x, nxp_gyro_y, nxp_gyro_z
+    global roll, pitch, heading
+
     lsm_acc_x, lsm_acc_y, lsm_acc_z = lsmAcc.acceleration
     lsm_mag_x, lsm_mag_y, lsm_mag_z = lsmMag.magnetic
 
-    if DEBUG:
-        print("LSM Acc (m/s^2):      x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(lsm_acc_x, lsm_acc_y, lsm_acc_z))
-        print("LSM Mag (uTeslas):    x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(lsm_mag_x, lsm_mag_y, lsm_mag_z))
-        print()
-
     #	Read data from the NXP IMU, accelerometer, magnetometer, and gyroscope
     nxp_acc_x, nxp_acc_y, nxp_acc_z = nxpAcc.accelerometer
     nxp_mag_x, nxp_mag_y, nxp_mag_z = nxpAcc.magnetometer
@@ -337,13 +598,47 @@ while True:
     #	Calculate simple roll, pitch, and heading from accelerometer and magnetometer readings
     roll, pitch, heading = simpleOrientation(nxp_acc_x, nxp_acc_y, nxp_acc_z, nxp_mag_x, nxp_mag_y, nxp_mag_z, pi)
 
-    if DEBUG:
-        print("NXP Acc (m/s^2):      x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_acc_x, nxp_acc_y, nxp_acc_z))
-        #print("NXP Mag (gauss):      x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_mag_x, nxp_mag_y, nxp_mag_z))
-        print("NXP Mag (uTeslas):    x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_mag_x / 10.0, nxp_mag_y / 10.0, nxp_mag_z / 10.0))
-        print("NXP Gyro (radians/s): x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_gyro_x, nxp_gyro_y, nxp_gyro_z))
-        print()
-        print("Roll = {0:5.2f}, Pitch = {1:5.2f}, Heading = {2:5.2f}".format(roll, pitch, heading))
-        print()
-
-    #sleep(0.2)
+def sensorRecordTask():
+    #   Until the first time sync round network time is our own ticks
+    batcher.add(timeSync.now(), *mesh_sensor.encodeImu(nxp_acc_x, nxp_acc_y, nxp_acc_z, nxp_mag_x, nxp_mag_y, nxp_mag_z, nxp_gyro_x, nxp_gyro_y, nxp_gyro_z))
+
+    if batcher.isFull():
+        scheduler.wake(radioSendTaskHandle)
+
+def debugPrintTask():
+    print("LSM Acc (m/s^2):      x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(lsm_acc_x, lsm_acc_y, lsm_acc_z))
+    print("LSM Mag (uTeslas):    x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(lsm_mag_x, lsm_mag_y, lsm_mag_z))
+    print()
+    print("NXP Acc (m/s^2):      x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_acc_x, nxp_acc_y, nxp_acc_z))
+    #print("NXP Mag (gauss):      x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_mag_x, nxp_mag_y, nxp_mag_z))
+    print("NXP Mag (uTeslas):    x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_mag_x / 10.0, nxp_mag_y / 10.0, nxp_mag_z / 10.0))
+    print("NXP Gyro (radians/s): x = {0:11.5f},    y = {1:11.5f},   z = {2:11.5f}".format(nxp_gyro_x, nxp_gyro_y, nxp_gyro_z))
+    print()
+    print("Roll = {0:5.2f}, Pitch = {1:5.2f}, Heading = {2:5.2f}".format(roll, pitch, heading))
+    print()
+    print("Time sync: root = {0}, level = {1}, synchronized = {2}, skew = {3:.6f}".format(timeSync.root, timeSync.level, timeSync.isSynchronized(), timeSync.clock.skew))
+    print("Neighbors: {0}, HELLOs sent = {1}, suppressed = {2}, interval = {3} ms".format(list(neighbors.table.neighbors()), neighbors.helloCount, neighbors.suppressedCount, neighbors.interval))
+    print("MAC: sent = {0}, busy = {1}, backoffs = {2} ({3} ms), dropped = {4}, lost = {5}".format(mac.sentCount, mac.busyCount, mac.backoffCount, mac.backoffMs, mac.droppedCount + mac.overflowCount, mac.lostCount))
+    print()
+
+#   Each job runs on its own deadline instead of one blocking loop
+scheduler = mesh_scheduler.Scheduler()
+
+scheduler.every(HEARTBEAT_OFF_MS, heartBeatTask)
+scheduler.every(RADIO_POLL_INTERVAL_MS, radioReceiveTask)
+macTaskHandle = scheduler.every(mesh_mac.IDLE_MS, macTask)
+helloTaskHandle = scheduler.every(mesh_neighbor.DEFAULT_MIN_INTERVAL_MS, helloTask)
+scheduler.every(LINK_AGE_INTERVAL_MS, links.age)
+
+if TDMA_ENABLED:
+    scheduler.every(TDMA_JOIN_CHECK_MS, tdmaJoinTask)
+radioSendTaskHandle = scheduler.every(RTT_INITIAL_TIMEOUT_MS, radioSendTask)
+scheduler.every(SENSOR_SAMPLE_INTERVAL_MS, sensorTask)
+scheduler.every(SENSOR_RECORD_INTERVAL_MS, sensorRecordTask, delay=SENSOR_SAMPLE_INTERVAL_MS)
+
+if DEBUG:
+    scheduler.every(DEBUG_PRINT_INTERVAL_MS, debugPrintTask)
+
+print()
+
+scheduler.run()
@@ -0,0 +1,388 @@
+#
+#   Sliding window, selective repeat ARQ on top of the header sequence numbers
+#
+#   The sender keeps up to windowSize packets outstanding and retransmits only
+#       the ones that have not been acknowledged when their timer runs out. The
+#       receiver buffers packets that arrive out of order and hands them to the
+#       application in sequence order.
+#
+#   Payloads are copied into preallocated slots, one per window position
+#       (sequence % windowSize), so nothing is allocated per packet.
+#
+#   Sequence numbers are 32 bits and wrap around. Times are mesh_clock ticks
+#       and are passed in by the caller. A node starts sending from a random
+#       sequence (initialSequence()), so after a reboot its packets land far
+#       from where it was before and the receiver starts over, instead of
+#       taking them for ones it already has. For the same reason the sender
+#       ignores an ACK of sequences it has not sent yet.
+#
+#   A sender gives up on a packet after maxRetries. The receiver learns of it
+#       from the first packet that arrives beyond its window: it hands over
+#       everything it has buffered, in order, skipping only the sequences that
+#       will never come.
+#
+#   Both sides also keep the total packets and sub packet number of each
+#       sequence, for messages split into fragments (see mesh_fragment).
+#
+#   When the sender is given an RttEstimator, its adaptive timeout replaces the
+#       fixed retransmitTimeout, and every ACK of a packet sent only once feeds
+#       it a round trip sample.
+#
+import random
+
+from mesh_clock import ticksDiff
+from mesh_header import ACK_BITMAP_BITS, MAX_PAYLOAD_SIZE
+
+SEQUENCE_MODULO = 1 << 32
+SEQUENCE_HALF = 1 << 31
+
+DEFAULT_WINDOW_SIZE = 8
+DEFAULT_RETRANSMIT_TIMEOUT_MS = 1500
+DEFAULT_MAX_RETRIES = 8
+
+#   A receiver takes a jump further ahead than this for a sender that
+#       restarted, not one that gave up on the packets in between
+MAX_SKIP = 1 << 16
+
+def nextSequence(sequence):
+    return (sequence + 1) % SEQUENCE_MODULO
+
+def sequenceDiff(a, b):
+    #   Signed distance from b to a, correct across wrap around
+    return ((a - b + SEQUENCE_HALF) % SEQUENCE_MODULO) - SEQUENCE_HALF
+
+def initialSequence():
+    #   The first sequence for a sender that has just booted
+    return random.getrandbits(32) or 1
+
+class ArqSender:
+    def __init__(self, windowSize=DEFAULT_WINDOW_SIZE, retransmitTimeout=DEFAULT_RETRANSMIT_TIMEOUT_MS, maxRetries=DEFAULT_MAX_RETRIES, firstSequence=1, rttEstimator=None):
+        self.windowSize = windowSize
+        self.retransmitTimeout = retransmitTimeout
+        self.maxRetries = maxRetries
+        self.rttEstimator = rttEstimator
+
+        #   Oldest unacknowledged sequence, and the sequence the next packet gets
+        self.base = firstSequence
+        self.next = firstSequence
+
+        self._slots = [bytearray(MAX_PAYLOAD_SIZE) for _ in range(windowSize)]
+        self._lengths = bytearray(windowSize)
+        self._totals = bytearray(windowSize)
+        self._subs = bytearray(windowSize)
+        self._acked = bytearray(windowSize)
+        self._retries = bytearray(windowSize)
+        self._sentAt = [0] * windowSize
+
+        self.sentCount = 0
+        self.retransmitCount = 0
+        self.droppedCount = 0
+        self.staleAckCount = 0
+
+    def outstanding(self):
+        return sequenceDiff(self.next, self.base)
+
+    def canQueue(self):
+        return self.outstanding() < self.windowSize
+
+    def queue(self, payload, totalPackets=1, subPacketNumber=0):
+        #   Returns the sequence number given to payload, or None if the window is full
+        if not self.canQueue():
+            return None
+
+        if len(payload) > MAX_PAYLOAD_SIZE:
+            raise ValueError("Payload of {0} bytes does not fit in a packet".format(len(payload)))
+
+        sequence = self.next
+        slot = sequence % self.windowSize
+
+        self._slots[slot][:len(payload)] = payload
+        self._lengths[slot] = len(payload)
+        self._totals[slot] = totalPackets
+        self._subs[slot] = subPacketNumber
+        self._acked[slot] = 0
+        self._retries[slot] = 0
+        self._sentAt[slot] = None
+
+        self.next = nextSequence(sequence)
+
+        return sequence
+
+    def payloadOf(self, sequence):
+        slot = sequence % self.windowSize
+
+        return memoryview(self._slots[slot])[:self._lengths[slot]]
+
+    def fragmentOf(self, sequence):
+        #   (totalPackets, subPacketNumber) the sequence was queued with
+        slot = sequence % self.windowSize
+
+        return self._totals[slot], self._subs[slot]
+
+    def isRetransmission(self, sequence):
+        #   True if sending sequence now would be a retransmission
+        return self._sentAt[sequence % self.windowSize] is not None
+
+    def isOutstanding(self, sequence):
+        return 0 <= sequenceDiff(sequence, self.base) < self.outstanding()
+
+    def timeout(self):
+        if self.rttEstimator is None:
+            return self.retransmitTimeout
+
+        return self.rttEstimator.timeout
+
+    def timeUntilDue(self, now):
+        #   Milliseconds until the next packet has to be (re)sent, which is also
+        #       how long it is worth listening for ACKs. The timeout when idle.
+        timeout = self.timeout()
+        wait = timeout
+        sequence = self.base
+
+        while sequence != self.next:
+            slot = sequence % self.windowSize
+
+            if not self._acked[slot]:
+                sentAt = self._sentAt[slot]
+
+                if sentAt is None:
+                    return 0
+
+                wait = min(wait, timeout - ticksDiff(now, sentAt))
+
+            sequence = nextSequence(sequence)
+
+        return max(0, wait)
+
+    def due(self, now):
+        #   Sequences to (re)send now, oldest first. The caller must send each one
+        #       and then call sent() for it.
+        timeout = self.timeout()
+        sequence = self.base
+
+        while sequence != self.next:
+            slot = sequence % self.windowSize
+
+            if not self._acked[slot]:
+                sentAt = self._sentAt[slot]
+
+                if sentAt is None or ticksDiff(now, sentAt) >= timeout:
+                    yield sequence
+
+            sequence = nextSequence(sequence)
+
+    def sent(self, sequence, now):
+        slot = sequence % self.windowSize
+
+        if self._sentAt[slot] is None:
+            self.sentCount += 1
+        else:
+            self.retransmitCount += 1
+            self._retries[slot] += 1
+
+            #   Back off once per timeout, not once for every packet in the window
+            if self.rttEstimator is not None and sequence == self.base:
+                self.rttEstimator.backoff()
+
+            if self._retries[slot] >= self.maxRetries:
+                #   Give up on this one so it can not stall the window forever
+                self.droppedCount += 1
+                self._acked[slot] = 1
+                self._slide()
+                return
+
+        self._sentAt[slot] = now
+
+    def acknowledge(self, sequence, now=None):
+        #   Returns True if this ACK covered an outstanding packet
+        if not self.isOutstanding(sequence):
+            return False
+
+        slot = sequence % self.windowSize
+
+        if self._acked[slot]:
+            return False
+
+        self._acked[slot] = 1
+
+        if now is not None and self.rttEstimator is not None and self._retries[slot] == 0 and self._sentAt[slot] is not None:
+            self.rttEstimator.sample(ticksDiff(now, self._sentAt[slot]))
+
+        self._slide()
+
+        return True
+
+    def acknowledgeRange(self, ackSequence, bitmap, now=None):
+        #   A cumulative ACK: every sequence before ackSequence, and ackSequence + 1 + i
+        #       for each bit i set in bitmap. Returns how many outstanding packets
+        #       it covered. Only the newest packet below ackSequence gives an RTT
+        #       sample, the older ones may have waited for it.
+        count = 0
+
+        if sequenceDiff(ackSequence, self.next) > 0:
+            #   An ACK from before we restarted, of sequences we never sent
+            self.staleAckCount += 1
+            return count
+
+        sequence = self.base
+
+        while sequence != self.next and sequenceDiff(sequence, ackSequence) < 0:
+            newest = sequenceDiff(nextSequence(sequence), ackSequence) == 0
+
+            if self.acknowledge(sequence, now if newest else None):
+                count += 1
+
+            sequence = nextSequence(sequence)
+
+        bit = 0
+
+        while bitmap >> bit:
+            if bitmap >> bit & 1 and self.acknowledge((ackSequence + 1 + bit) % SEQUENCE_MODULO):
+                count += 1
+
+            bit += 1
+
+        return count
+
+    def _slide(self):
+        while self.base != self.next and self._acked[self.base % self.windowSize]:
+            self.base = nextSequence(self.base)
+
+class ArqReceiver:
+    def __init__(self, windowSize=DEFAULT_WINDOW_SIZE, firstSequence=1):
+        self.windowSize = windowSize
+
+        #   Next sequence to be delivered to the application
+        self.expected = firstSequence
+
+        self._slots = [bytearray(MAX_PAYLOAD_SIZE) for _ in range(windowSize)]
+        self._lengths = bytearray(windowSize)
+        self._totals = bytearray(windowSize)
+        self._subs = bytearray(windowSize)
+        self._present = bytearray(windowSize)
+        self._sequences = [0] * windowSize
+
+        #   Where deliver() moves on to once it has handed over what is buffered
+        #       in front of it, over the sequences that never arrived, and
+        #       whether that is because the sender restarted
+        self._skipTo = None
+        self._restarted = False
+
+        self.duplicateCount = 0
+        self.resyncCount = 0
+        self.skippedCount = 0
+
+    def receive(self, sequence, payload, totalPackets=1, subPacketNumber=0):
+        #   Buffers the payload and returns True if the packet should be ACKed
+        offset = sequenceDiff(sequence, self.expected)
+
+        if -self.windowSize <= offset < 0:
+            #   Already delivered, our ACK must have been lost
+            self.duplicateCount += 1
+            return True
+
+        if offset < 0 or offset > MAX_SKIP:
+            #   Far from the window, the sender has restarted its sequence.
+            #       What is buffered is still handed over first.
+            if not self._restarted:
+                self.resyncCount += 1
+                self._skipTo = sequence
+                self._restarted = True
+        elif offset >= self.windowSize and not self._restarted:
+            #   Ahead of the window, the sender gave up on what we are waiting
+            #       for. Its window ends with sequence, so everything before
+            #       that window has been ACKed or given up on.
+            self.resyncCount += 1
+            self._skipTo = (sequence - self.windowSize + 1) % SEQUENCE_MODULO
+
+        slot = sequence % self.windowSize
+
+        if self._present[slot]:
+            if self._sequences[slot] == sequence:
+                self.duplicateCount += 1
+                return True
+
+            #   The slot still holds an older packet deliver() has to hand
+            #       over first, the retransmission will find it free
+            return False
+
+        self._slots[slot][:len(payload)] = payload
+        self._lengths[slot] = len(payload)
+        self._totals[slot] = totalPackets
+        self._subs[slot] = subPacketNumber
+        self._sequences[slot] = sequence
+        self._present[slot] = 1
+
+        return True
+
+    def _nextBuffered(self):
+        #   The nearest buffered sequence after expected and before _skipTo, or
+        #       _skipTo when there is none
+        nearest = None
+        limit = self.windowSize if self._restarted else sequenceDiff(self._skipTo, self.expected)
+
+        for slot in range(self.windowSize):
+            if self._present[slot]:
+                offset = sequenceDiff(self._sequences[slot], self.expected)
+
+                if 0 < offset < limit and (nearest is None or offset < nearest):
+                    nearest = offset
+
+        if nearest is None:
+            return self._skipTo
+
+        return (self.expected + nearest) % SEQUENCE_MODULO
+
+    def deliver(self):
+        #   Yields in order payloads. Each one is a view into a receive slot that
+        #       is only valid until the next call to receive().
+        while True:
+            slot = self.expected % self.windowSize
+
+            if not self._present[slot] or self._sequences[slot] != self.expected:
+                if self._skipTo is None:
+                    return
+
+                if not self._restarted and sequenceDiff(self._skipTo, self.expected) <= 0:
+                    self._skipTo = None
+                    return
+
+                #   Over a hole the sender gave up on, or on to where it restarted
+                target = self._nextBuffered()
+
+                if not self._restarted or target != self._skipTo:
+                    self.skippedCount += sequenceDiff(target, self.expected)
+
+                if target == self._skipTo:
+                    self._skipTo = None
+                    self._restarted = False
+
+                self.expected = target
+                continue
+
+            self._present[slot] = 0
+            sequence = self.expected
+            self.expected = nextSequence(sequence)
+
+            yield sequence, memoryview(self._slots[slot])[:self._lengths[slot]]
+
+    def ackState(self):
+        #   (ackSequence, bitmap) for a cumulative ACK of everything received so
+        #       far: every sequence before ackSequence, and ackSequence + 1 + i for
+        #       each bit i set in bitmap
+        bitmap = 0
+
+        for bit in range(min(self.windowSize - 1, ACK_BITMAP_BITS)):
+            sequence = (self.expected + 1 + bit) % SEQUENCE_MODULO
+            slot = sequence % self.windowSize
+
+            if self._present[slot] and self._sequences[slot] == sequence:
+                bitmap |= 1 << bit
+
+        return self.expected, bitmap
+
+    def fragmentOf(self, sequence):
+        #   (totalPackets, subPacketNumber) of a sequence just delivered
+        slot = sequence % self.windowSize
+
+        return self._totals[slot], self._subs[slot]
@@ -0,0 +1,158 @@
+#
+#   Sample batching, many fixed size sensor records in one packet
+#
+#   Sending one sample per packet spends most of the airtime on headers. The
+#       batcher packs records straight into a preallocated payload buffer and
+#       hands the payload over when no more records fit, or when the oldest
+#       record has waited maxLatency milliseconds.
+#
+#   Batch payload layout:
+#
+#       Offset  Size    Field
+#       ------  ----    -----
+#            0     1    Record format and version, a key of RECORD_FORMATS
+#            1     1    Record count
+#            2     n    count records, each struct.calcsize(format) bytes
+#
+#   Compressed formats (COMPRESSED_FORMATS) share the first two bytes, and are
+#       followed by a mesh_compress block instead of fixed size records. The
+#       records of a timed one start with the sample's network time (ms, see
+#       mesh_timesync).
+#
+import struct
+
+from mesh_clock import ticksDiff, ticksMs
+from mesh_header import MAX_ROUTED_PAYLOAD_SIZE
+import mesh_compress
+import mesh_sensor
+
+BATCH_HEADER_SIZE = 2
+
+DEFAULT_MAX_LATENCY_MS = 2000
+
+#   Record formats, by the ID sent in the first byte of the payload. An ID is
+#       never reused for a different layout.
+RECORD_ORIENTATION = 1
+RECORD_IMU_V1 = 2
+RECORD_IMU_V1_DELTA = 3
+RECORD_IMU_V1_TIMED_DELTA = 4
+
+RECORD_FORMATS = {
+    #   roll, pitch, heading in degrees
+    RECORD_ORIENTATION: ">fff",
+    #   9 axis IMU sample in fixed point, see mesh_sensor
+    RECORD_IMU_V1: mesh_sensor.IMU_V1_FORMAT,
+}
+
+#   Delta compressed int16 records: (channel count, timed)
+COMPRESSED_FORMATS = {
+    #   RECORD_IMU_V1 samples, see mesh_compress
+    RECORD_IMU_V1_DELTA: (len(mesh_sensor.IMU_V1_CHANNELS), False),
+    #   RECORD_IMU_V1 samples with the time of each
+    RECORD_IMU_V1_TIMED_DELTA: (len(mesh_sensor.IMU_V1_CHANNELS), True),
+}
+
+#   Turn the raw record of a fixed point format back into readings
+RECORD_DECODERS = {
+    RECORD_IMU_V1: mesh_sensor.decodeImu,
+    RECORD_IMU_V1_DELTA: mesh_sensor.decodeImu,
+    RECORD_IMU_V1_TIMED_DELTA: mesh_sensor.decodeTimedImu,
+}
+
+class SampleBatcher:
+    def __init__(self, recordFormat, maxPayload=MAX_ROUTED_PAYLOAD_SIZE, maxLatency=DEFAULT_MAX_LATENCY_MS):
+        self.recordFormat = recordFormat
+        self.structFormat = RECORD_FORMATS[recordFormat]
+        self.recordSize = struct.calcsize(self.structFormat)
+        self.capacity = (maxPayload - BATCH_HEADER_SIZE) // self.recordSize
+        self.maxLatency = maxLatency
+
+        if self.capacity < 1:
+            raise ValueError("Records of {0} bytes do not fit in a payload of {1}".format(self.recordSize, maxPayload))
+
+        self._buffer = bytearray(BATCH_HEADER_SIZE + self.capacity * self.recordSize)
+        self._buffer[0] = recordFormat
+
+        self.count = 0
+        self._firstAt = 0
+
+        self.batchCount = 0
+        self.droppedCount = 0
+
+    def isFull(self):
+        return self.count == self.capacity
+
+    def add(self, *values):
+        #   Returns False, and drops the record, if the batch is full
+        if self.isFull():
+            self.droppedCount += 1
+            return False
+
+        if self.count == 0:
+            self._firstAt = ticksMs()
+
+        struct.pack_into(self.structFormat, self._buffer, BATCH_HEADER_SIZE + self.count * self.recordSize, *values)
+        self.count += 1
+
+        return True
+
+    def timeUntilDue(self, now):
+        #   Milliseconds until the batch has to go, None while it is empty
+        if self.count == 0:
+            return None
+
+        if self.isFull():
+            return 0
+
+        return max(0, self.maxLatency - ticksDiff(now, self._firstAt))
+
+    def isDue(self, now):
+        return self.count > 0 and self.timeUntilDue(now) == 0
+
+    def flush(self):
+        #   The finished payload, a view into the batch buffer that is only valid
+        #       until the next add(). Starts a new batch.
+        length = BATCH_HEADER_SIZE + self.count * self.recordSize
+        self._buffer[1] = self.count
+
+        self.count = 0
+        self.batchCount += 1
+
+        return memoryview(self._buffer)[:length]
+
+def isBatch(payload):
+    if len(payload) < BATCH_HEADER_SIZE:
+        return False
+
+    compressed = COMPRESSED_FORMATS.get(payload[0])
+
+    if compressed is not None:
+        return mesh_compress.isBlock(payload, *compressed)
+
+    structFormat = RECORD_FORMATS.get(payload[0])
+
+    return structFormat is not None and len(payload) == BATCH_HEADER_SIZE + payload[1] * struct.calcsize(structFormat)
+
+def unpackBatch(payload):
+    #   Yields each record of a batch payload as a tuple
+    compressed = COMPRESSED_FORMATS.get(payload[0])
+
+    if compressed is not None:
+        yield from mesh_compress.unpackBlock(payload, *compressed)
+        return
+
+    structFormat = RECORD_FORMATS[payload[0]]
+    recordSize = struct.calcsize(structFormat)
+
+    for index in range(payload[1]):
+        yield struct.unpack_from(structFormat, payload, BATCH_HEADER_SIZE + index * recordSize)
+
+def decodeBatch(payload):
+    #   Yields each record of a batch payload as readings in their units
+    decoder = RECORD_DECODERS.get(payload[0])
+
+    for record in unpackBatch(payload):
+        if decoder is None:
+            yield record
+        else:
+            yield decoder(record)
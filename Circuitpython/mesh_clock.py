@@ -0,0 +1,32 @@
+#
+#   Integer millisecond clock
+#
+#   supervisor.ticks_ms() never allocates and keeps full resolution for as long
+#       as the board runs, unlike time.monotonic() whose float loses precision
+#       after a few hours of uptime. Ticks wrap around, so always compare them
+#       with ticksDiff(), never with plain subtraction.
+#
+#   Boards (and the gateway) without supervisor.ticks_ms() fall back to
+#       time.monotonic(), wrapped to the same period.
+#
+try:
+    from supervisor import ticks_ms as _ticksMs
+except ImportError:
+    from time import monotonic
+
+    def _ticksMs():
+        return int(monotonic() * 1000) & TICKS_MAX
+
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+def ticksMs():
+    return _ticksMs()
+
+def ticksAdd(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+def ticksDiff(end, start):
+    #   Signed number of milliseconds from start to end
+    return ((end - start + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
@@ -0,0 +1,132 @@
+#
+#   Duplicate suppression keyed on (from node, sequence number)
+#
+#   For each source node the filter remembers the highest sequence number seen
+#       and a WINDOW_BITS wide bitmap of which of the sequence numbers just
+#       below it have been seen. The bitmap is circular, the bit for sequence s
+#       lives at s % WINDOW_BITS, so moving the window forward only clears the
+#       bits that come into it. Every check is O(1) and every source costs the
+#       same few bytes.
+#
+#   A sequence number a whole window or more behind belongs to a sender that
+#       restarted, and starts the source afresh. An ARQ sender never has more
+#       than its window outstanding, far less than WINDOW_BITS, so a real
+#       retransmission is never that far behind. Dropping it as a duplicate
+#       instead would lose every packet after the reboot until the sequence
+#       caught up, while still ACKing them.
+#
+#   A unicast receiver checks with mark=False and only marks a packet once its
+#       ARQ receiver has taken it. A packet the receiver turns away, its window
+#       slot still taken, must not count as seen, or every retransmission of it
+#       would be dropped unACKed.
+#
+#   The table holds a fixed number of sources. A new source replaces the one
+#       heard from least recently.
+#
+from array import array
+
+from mesh_arq import sequenceDiff
+
+DEFAULT_CAPACITY = 16
+
+WINDOW_BITS = 32
+WINDOW_BYTES = WINDOW_BITS // 8
+
+class DuplicateFilter:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+
+        #   Source address to slot
+        self._slots = {}
+        self._sources = array("H", [0] * capacity)
+        self._highest = [0] * capacity
+        self._bitmaps = bytearray(capacity * WINDOW_BYTES)
+        self._used = [0] * capacity
+        self._useCount = 0
+
+        self.duplicateCount = 0
+        self.restartCount = 0
+
+    def _slotFor(self, source, sequence):
+        slot = self._slots.get(source)
+
+        if slot is not None:
+            return slot
+
+        if len(self._slots) < self.capacity:
+            slot = len(self._slots)
+        else:
+            slot = 0
+
+            for other in range(1, self.capacity):
+                if self._used[other] < self._used[slot]:
+                    slot = other
+
+            del self._slots[self._sources[slot]]
+
+        self._slots[source] = slot
+        self._sources[slot] = source
+        self._reset(slot, sequence)
+
+        return slot
+
+    def _reset(self, slot, sequence):
+        base = slot * WINDOW_BYTES
+
+        for index in range(base, base + WINDOW_BYTES):
+            self._bitmaps[index] = 0
+
+        #   Everything before sequence counts as unseen
+        self._highest[slot] = (sequence - 1) & 0xFFFFFFFF
+
+    def _bit(self, slot, sequence):
+        bit = sequence % WINDOW_BITS
+
+        return slot * WINDOW_BYTES + (bit >> 3), 1 << (bit & 7)
+
+    def isDuplicate(self, source, sequence, mark=True):
+        #   Tells whether sequence from source has been seen already, and marks
+        #       it seen unless mark is False
+        slot = self._slots.get(source)
+
+        if slot is not None:
+            offset = sequenceDiff(sequence, self._highest[slot])
+
+            if -WINDOW_BITS < offset <= 0:
+                index, mask = self._bit(slot, sequence)
+
+                if self._bitmaps[index] & mask:
+                    self.duplicateCount += 1
+                    return True
+
+        if mark:
+            self.mark(source, sequence)
+
+        return False
+
+    def mark(self, source, sequence):
+        #   Records sequence as seen from source
+        slot = self._slotFor(source, sequence)
+
+        self._useCount += 1
+        self._used[slot] = self._useCount
+
+        offset = sequenceDiff(sequence, self._highest[slot])
+
+        if offset <= -WINDOW_BITS:
+            self.restartCount += 1
+            self._reset(slot, sequence)
+            offset = 1
+
+        if offset > 0:
+            #   Clear the bits of the sequence numbers the window moves over
+            highest = self._highest[slot]
+
+            for step in range(1, min(offset, WINDOW_BITS) + 1):
+                index, mask = self._bit(slot, highest + step)
+                self._bitmaps[index] &= ~mask & 0xFF
+
+            self._highest[slot] = sequence
+
+        index, mask = self._bit(slot, sequence)
+        self._bitmaps[index] |= mask
@@ -0,0 +1,229 @@
+#
+#   On-demand route discovery
+#
+#   A node that needs a route floods a route request. Every node that hears it
+#       for the first time learns the way back to the originator (through the
+#       node it heard the request from) and broadcasts it again with one hop
+#       more, until the TTL runs out. The target answers with a route reply,
+#       which travels back along those reverse routes. Each node it passes
+#       learns the way to the target, so the originator ends up with a route.
+#
+#       Route request, broadcast, routed:
+#           Sequence        request ID, per originator
+#           From            originator
+#           To              BROADCAST_ADDRESS
+#           Payload         target (2), hop count (1)
+#
+#       Route reply, unicast, routed back toward the originator:
+#           Sequence        request ID being answered
+#           From            target
+#           To              originator
+#           Payload         target (2), hop count (1)
+#
+#   Routes are not learned through a neighbor whose link the router considers
+#       unusable (see mesh_link), so discovery steers around lossy links.
+#
+#   Flooding is what fills a channel, so it is rate limited twice: a token
+#       bucket caps all requests this node sends or passes on, and repeated
+#       requests for the same destination back off exponentially. Requests
+#       already seen are recognized by (originator, request ID) in a small ring.
+#
+from array import array
+import struct
+
+from mesh_clock import ticksAdd, ticksDiff, ticksMs
+import mesh_header
+
+DISCOVERY_FORMAT = ">HB"
+DISCOVERY_SIZE = 3
+
+DEFAULT_TTL = 6
+
+#   Token bucket shared by every request this node transmits
+DEFAULT_BURST = 3
+DEFAULT_TOKEN_INTERVAL_MS = 2000
+
+#   Back off between requests for the same destination
+DEFAULT_RETRY_INTERVAL_MS = 2000
+MAX_RETRY_INTERVAL_MS = 60000
+
+SEEN_CAPACITY = 16
+PENDING_CAPACITY = 4
+
+class RouteDiscovery:
+    def __init__(self, router, send, ttl=DEFAULT_TTL, burst=DEFAULT_BURST, tokenInterval=DEFAULT_TOKEN_INTERVAL_MS, retryInterval=DEFAULT_RETRY_INTERVAL_MS):
+        #   send(frame) transmits a finished frame
+        self.router = router
+        self.address = router.address
+        self.send = send
+        self.ttl = ttl
+
+        self.burst = burst
+        self.tokenInterval = tokenInterval
+        self.retryInterval = retryInterval
+
+        self._tokens = burst
+        self._tokensAt = ticksMs()
+
+        self._requestId = 0
+        self._buffer = mesh_header.newPacketBuffer()
+        self._payload = bytearray(DISCOVERY_SIZE)
+
+        #   (originator, request ID) of requests already handled
+        self._seenOrigins = array("H", [mesh_header.BROADCAST_ADDRESS] * SEEN_CAPACITY)
+        self._seenIds = [0] * SEEN_CAPACITY
+        self._seenNext = 0
+
+        #   Destinations being looked for, when the next request may go and the
+        #       current back off
+        self._pendingTargets = array("H", [mesh_header.BROADCAST_ADDRESS] * PENDING_CAPACITY)
+        self._pendingNext = [0] * PENDING_CAPACITY
+        self._pendingInterval = [0] * PENDING_CAPACITY
+
+        self.requestsSent = 0
+        self.requestsForwarded = 0
+        self.repliesSent = 0
+        self.repliesReceived = 0
+        self.rateLimitedCount = 0
+
+    def _takeToken(self):
+        now = ticksMs()
+        elapsed = ticksDiff(now, self._tokensAt)
+
+        if elapsed >= self.tokenInterval:
+            earned = elapsed // self.tokenInterval
+            self._tokens = min(self.burst, self._tokens + earned)
+            self._tokensAt = ticksAdd(self._tokensAt, earned * self.tokenInterval)
+
+        if self._tokens == 0:
+            self.rateLimitedCount += 1
+            return False
+
+        self._tokens -= 1
+
+        return True
+
+    def _seen(self, origin, requestId):
+        #   Remembers the request, and tells whether it was already known
+        for index in range(SEEN_CAPACITY):
+            if self._seenOrigins[index] == origin and self._seenIds[index] == requestId:
+                return True
+
+        self._seenOrigins[self._seenNext] = origin
+        self._seenIds[self._seenNext] = requestId
+        self._seenNext = (self._seenNext + 1) % SEEN_CAPACITY
+
+        return False
+
+    def _pendingIndex(self, target):
+        for index in range(PENDING_CAPACITY):
+            if self._pendingTargets[index] == target:
+                return index
+
+        return -1
+
+    def _transmit(self, sequence, fromNode, toNode, packetType, target, hopCount, nextHop, ttl):
+        struct.pack_into(DISCOVERY_FORMAT, self._payload, 0, target, min(hopCount, 255))
+        length = mesh_header.packPacket(self._buffer, sequence, fromNode, toNode, packetType, self._payload, route=(self.address, nextHop, ttl))
+        self.send(memoryview(self._buffer)[:length])
+
+    def request(self, target):
+        #   Look for a route to target, unless that was done too recently.
+        #       Returns True if a request went out.
+        if self.router.hasRoute(target):
+            return False
+
+        now = ticksMs()
+        index = self._pendingIndex(target)
+
+        if index < 0:
+            #   Reuse the slot whose next attempt is the oldest
+            index = 0
+
+            for other in range(1, PENDING_CAPACITY):
+                if ticksDiff(self._pendingNext[other], self._pendingNext[index]) < 0:
+                    index = other
+
+            self._pendingTargets[index] = target
+            self._pendingNext[index] = now
+            self._pendingInterval[index] = self.retryInterval
+        elif ticksDiff(now, self._pendingNext[index]) < 0:
+            return False
+
+        if not self._takeToken():
+            return False
+
+        self._pendingNext[index] = ticksAdd(now, self._pendingInterval[index])
+        self._pendingInterval[index] = min(self._pendingInterval[index] * 2, MAX_RETRY_INTERVAL_MS)
+
+        self._requestId = (self._requestId + 1) & 0xFFFFFFFF
+        self._seen(self.address, self._requestId)
+
+        self._transmit(self._requestId, self.address, mesh_header.BROADCAST_ADDRESS, mesh_header.PACKET_TYPE_ROUTE_REQUEST, target, 0, mesh_header.BROADCAST_ADDRESS, self.ttl)
+        self.requestsSent += 1
+
+        return True
+
+    def handle(self, packet):
+        #   Handles a route request or reply. Returns True if the packet was one.
+        packetType = mesh_header.typeOf(packet)
+
+        if packetType != mesh_header.PACKET_TYPE_ROUTE_REQUEST and packetType != mesh_header.PACKET_TYPE_ROUTE_REPLY:
+            return False
+
+        route = mesh_header.unpackRoute(packet)
+
+        if route is None or len(mesh_header.payloadOf(packet)) < DISCOVERY_SIZE:
+            return True
+
+        hopFrom, nextHop, ttl = route
+        sequence = mesh_header.sequenceOf(packet)
+        fromNode = mesh_header.fromNodeOf(packet)
+        target, hopCount = struct.unpack_from(DISCOVERY_FORMAT, packet, mesh_header.payloadOffset(packet))
+
+        if packetType == mesh_header.PACKET_TYPE_ROUTE_REQUEST:
+            self._handleRequest(sequence, fromNode, hopFrom, ttl, target, hopCount)
+        elif nextHop == self.address:
+            self._handleReply(sequence, fromNode, mesh_header.toNodeOf(packet), hopFrom, ttl, target, hopCount)
+
+        return True
+
+    def _handleRequest(self, requestId, origin, hopFrom, ttl, target, hopCount):
+        if origin == self.address or self._seen(origin, requestId):
+            return
+
+        if not self.router.isUsableLink(hopFrom):
+            return
+
+        #   The way back to the originator is through whoever we heard this from
+        if self.router.cache is not None:
+            self.router.cache.addRoute(origin, hopFrom, hopCount + 1)
+
+        if target == self.address:
+            self._transmit(requestId, self.address, origin, mesh_header.PACKET_TYPE_ROUTE_REPLY, self.address, 0, hopFrom, self.router.ttl)
+            self.repliesSent += 1
+        elif ttl > 1 and self._takeToken():
+            self._transmit(requestId, origin, mesh_header.BROADCAST_ADDRESS, mesh_header.PACKET_TYPE_ROUTE_REQUEST, target, hopCount + 1, mesh_header.BROADCAST_ADDRESS, ttl - 1)
+            self.requestsForwarded += 1
+
+    def _handleReply(self, requestId, fromNode, toNode, hopFrom, ttl, target, hopCount):
+        if not self.router.isUsableLink(hopFrom):
+            return
+
+        #   The way to the target is through whoever passed the reply to us
+        if self.router.cache is not None:
+            self.router.cache.addRoute(target, hopFrom, hopCount + 1)
+
+        if toNode == self.address:
+            self.repliesReceived += 1
+
+            index = self._pendingIndex(target)
+
+            if index >= 0:
+                self._pendingTargets[index] = mesh_header.BROADCAST_ADDRESS
+
+            return
+
+        if ttl > 1:
+            #   Pass it on toward the originator
+            self._transmit(requestId, fromNode, toNode, mesh_header.PACKET_TYPE_ROUTE_REPLY, target, hopCount + 1, self.router.nextHopFor(toNode), ttl - 1)
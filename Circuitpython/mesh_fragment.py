@@ -0,0 +1,197 @@
+#
+#   Fragmentation and reassembly of messages larger than one packet
+#
+#   A message is split into fragments of FRAGMENT_SIZE bytes (the last one may
+#       be shorter), each sent as its own sequence numbered packet. The header
+#       carries the fragment count in Total packets and the fragment's index,
+#       from 0, in Sub packet number. Fragments of one message get consecutive
+#       sequence numbers, so (from node, sequence - sub packet number) names the
+#       message on the receiving side.
+#
+#   FRAGMENT_SIZE is the routed payload size whether or not a fragment is
+#       routed, so the receiver can place every fragment at sub * FRAGMENT_SIZE
+#       as it arrives, in any order.
+#
+#   The reassembler has a fixed number of message buffers of a fixed size. A
+#       message that stops getting fragments is dropped after a timeout, and
+#       when all buffers are busy a new message takes the one that has waited
+#       longest.
+#
+from mesh_arq import SEQUENCE_MODULO
+from mesh_clock import ticksDiff, ticksMs
+from mesh_header import MAX_ROUTED_PAYLOAD_SIZE
+
+FRAGMENT_SIZE = MAX_ROUTED_PAYLOAD_SIZE
+
+#   Total packets is one byte
+MAX_FRAGMENTS = 255
+
+DEFAULT_MESSAGE_SLOTS = 2
+DEFAULT_MAX_MESSAGE_SIZE = 1024
+DEFAULT_TIMEOUT_MS = 30000
+
+def fragmentCount(length, fragmentSize=FRAGMENT_SIZE):
+    return max(1, (length + fragmentSize - 1) // fragmentSize)
+
+class Fragmenter:
+    #   Queues the fragments of one message at a time into an ArqSender, as its
+    #       window allows. Nothing else may be queued until the message is done,
+    #       so the fragments get consecutive sequence numbers.
+    def __init__(self, fragmentSize=FRAGMENT_SIZE):
+        self.fragmentSize = fragmentSize
+
+        self._message = None
+        self._total = 0
+        self._sub = 0
+
+        self.messageCount = 0
+
+    def busy(self):
+        return self._message is not None
+
+    def start(self, message):
+        #   Returns False if the previous message is still being queued. message
+        #       must not change until it has been queued.
+        if self.busy():
+            return False
+
+        total = fragmentCount(len(message), self.fragmentSize)
+
+        if total > MAX_FRAGMENTS:
+            raise ValueError("Message of {0} bytes needs more than {1} fragments".format(len(message), MAX_FRAGMENTS))
+
+        self._message = memoryview(message)
+        self._total = total
+        self._sub = 0
+        self.messageCount += 1
+
+        return True
+
+    def pump(self, arqSender):
+        #   Queues as many fragments as the window has room for, returns how many
+        count = 0
+
+        while self._message is not None and arqSender.canQueue():
+            offset = self._sub * self.fragmentSize
+            arqSender.queue(self._message[offset:offset + self.fragmentSize], self._total, self._sub)
+
+            count += 1
+            self._sub += 1
+
+            if self._sub == self._total:
+                self._message = None
+
+        return count
+
+class Reassembler:
+    def __init__(self, slots=DEFAULT_MESSAGE_SLOTS, maxMessageSize=DEFAULT_MAX_MESSAGE_SIZE, timeout=DEFAULT_TIMEOUT_MS, fragmentSize=FRAGMENT_SIZE):
+        self.slotCount = slots
+        self.maxMessageSize = maxMessageSize
+        self.timeout = timeout
+        self.fragmentSize = fragmentSize
+        self.maxFragments = min(MAX_FRAGMENTS, fragmentCount(maxMessageSize, fragmentSize))
+
+        self._buffers = [bytearray(self.maxFragments * fragmentSize) for _ in range(slots)]
+        self._bitmaps = [bytearray((self.maxFragments + 7) // 8) for _ in range(slots)]
+
+        #   Message of each slot, None when the slot is free
+        self._keys = [None] * slots
+        self._totals = bytearray(slots)
+        self._received = bytearray(slots)
+        self._lengths = [0] * slots
+        self._updatedAt = [0] * slots
+
+        self.completedCount = 0
+        self.expiredCount = 0
+        self.evictedCount = 0
+        self.droppedCount = 0
+
+    def _slotFor(self, key, totalPackets):
+        oldest = None
+
+        for slot in range(self.slotCount):
+            if self._keys[slot] == key:
+                return slot
+
+        for slot in range(self.slotCount):
+            if self._keys[slot] is None:
+                oldest = slot
+                break
+
+            if oldest is None or ticksDiff(self._updatedAt[oldest], self._updatedAt[slot]) > 0:
+                oldest = slot
+
+        if self._keys[oldest] is not None:
+            self.evictedCount += 1
+
+        bitmap = self._bitmaps[oldest]
+
+        for index in range(len(bitmap)):
+            bitmap[index] = 0
+
+        self._keys[oldest] = key
+        self._totals[oldest] = totalPackets
+        self._received[oldest] = 0
+        self._lengths[oldest] = totalPackets * self.fragmentSize
+        self._updatedAt[oldest] = ticksMs()
+
+        return oldest
+
+    def expire(self, now=None):
+        #   Drops the messages that have not had a fragment within the timeout
+        if now is None:
+            now = ticksMs()
+
+        for slot in range(self.slotCount):
+            if self._keys[slot] is not None and ticksDiff(now, self._updatedAt[slot]) >= self.timeout:
+                self._keys[slot] = None
+                self.expiredCount += 1
+
+    def add(self, fromNode, sequence, totalPackets, subPacketNumber, fragment, now=None):
+        #   Returns the whole message once its last missing fragment arrives, as a
+        #       view that is only valid until the next add(), otherwise None
+        if now is None:
+            now = ticksMs()
+
+        self.expire(now)
+
+        if totalPackets > self.maxFragments or subPacketNumber >= totalPackets or len(fragment) > self.fragmentSize:
+            self.droppedCount += 1
+            return None
+
+        if subPacketNumber < totalPackets - 1 and len(fragment) != self.fragmentSize:
+            #   Only the last fragment may be short
+            self.droppedCount += 1
+            return None
+
+        key = (fromNode, (sequence - subPacketNumber) % SEQUENCE_MODULO)
+        slot = self._slotFor(key, totalPackets)
+
+        if self._totals[slot] != totalPackets:
+            self.droppedCount += 1
+            return None
+
+        self._updatedAt[slot] = now
+
+        bitmap = self._bitmaps[slot]
+        mask = 1 << (subPacketNumber & 7)
+
+        if bitmap[subPacketNumber >> 3] & mask:
+            return None
+
+        bitmap[subPacketNumber >> 3] |= mask
+
+        offset = subPacketNumber * self.fragmentSize
+        self._buffers[slot][offset:offset + len(fragment)] = fragment
+        self._received[slot] += 1
+
+        if subPacketNumber == totalPackets - 1:
+            self._lengths[slot] = offset + len(fragment)
+
+        if self._received[slot] < totalPackets:
+            return None
+
+        self._keys[slot] = None
+        self.completedCount += 1
+
+        return memoryview(self._buffers[slot])[:self._lengths[slot]]
@@ -0,0 +1,290 @@
+#
+#   Packet header codec shared by the Circuitpython nodes and the gateway
+#
+#   Every frame starts with the same fixed 12 byte header. All multi-byte
+#       fields are big endian (network byte order):
+#
+#       Offset  Size    Field
+#       ------  ----    -----
+#            0     4    Sequence number
+#            4     2    From node address
+#            6     2    To node address
+#            8     1    Packet type
+#            9     1    Packet length (the whole packet)
+#           10     1    Total packets in the message
+#           11     1    Sub packet number
+#
+#   The high bits of the packet type byte are flags. FLAG_ROUTED means a 5 byte
+#       routing extension follows the header, ahead of the payload:
+#
+#           12     2    Hop from, the node that transmitted this copy
+#           14     2    Next hop, the node that should pick it up
+#           16     1    Time to live, hops left before it is dropped
+#
+#   From and To always stay the original source and the final destination.
+#
+#   To may also be BROADCAST_ADDRESS, for every node, or a multicast group from
+#       MULTICAST_FIRST to MULTICAST_LAST, for the nodes that joined it. Group
+#       packets are never acknowledged.
+#
+#   FLAG_ACK means a 5 byte acknowledgement extension follows, after the
+#       routing extension if there is one. It lets any packet, data included,
+#       acknowledge the data its sender has received from the To node:
+#
+#            +0     4    ACK sequence, every sequence before it has been received
+#            +4     1    Bitmap, bit i set means ACK sequence + 1 + i has too
+#
+#   The last 2 bytes of every packet are a CRC-16/CCITT (polynomial 0x1021,
+#       initial value 0xFFFF) of everything before them, big endian. It is
+#       written by packPacket() and packRoute(), and a received packet should
+#       pass isValidPacket() before any other field of it is read. The CRC is
+#       table driven, one lookup per byte.
+#
+#   Frames are encoded straight into a preallocated bytearray so the main
+#       loop never builds intermediate strings, and fields are decoded in place
+#       from the received buffer (bytes, bytearray or memoryview) without
+#       slicing copies.
+#
+import struct
+from array import array
+
+HEADER_FORMAT = ">IHHBBBB"
+HEADER_SIZE = 12
+
+#   Field offsets inside the header
+OFFSET_SEQUENCE = 0
+OFFSET_FROM_NODE = 4
+OFFSET_TO_NODE = 6
+OFFSET_TYPE = 8
+OFFSET_LENGTH = 9
+OFFSET_TOTAL_PACKETS = 10
+OFFSET_SUB_PACKET = 11
+
+CRC_SIZE = 2
+CRC_INITIAL = 0xFFFF
+CRC_POLYNOMIAL = 0x1021
+
+#   The RFM69 FIFO holds 66 bytes, of which the driver lets us use 60
+MAX_PACKET_SIZE = 60
+MAX_PAYLOAD_SIZE = MAX_PACKET_SIZE - HEADER_SIZE - CRC_SIZE
+
+#   Packet types, in the low bits of the type byte
+PACKET_TYPE_DATA = 1
+PACKET_TYPE_ACK = 2
+PACKET_TYPE_ROUTE_REQUEST = 3
+PACKET_TYPE_ROUTE_REPLY = 4
+PACKET_TYPE_BEACON = 5
+PACKET_TYPE_JOIN = 6
+PACKET_TYPE_TIME_SYNC = 7
+PACKET_TYPE_HELLO = 8
+
+TYPE_MASK = 0x0F
+
+#   Flags, in the high bits of the type byte
+FLAG_ROUTED = 0x80
+FLAG_ACK = 0x40
+
+ROUTE_FORMAT = ">HHB"
+ROUTE_SIZE = 5
+
+OFFSET_HOP_FROM = HEADER_SIZE
+OFFSET_NEXT_HOP = HEADER_SIZE + 2
+OFFSET_TTL = HEADER_SIZE + 4
+
+MAX_ROUTED_PAYLOAD_SIZE = MAX_PAYLOAD_SIZE - ROUTE_SIZE
+
+ACK_FORMAT = ">IB"
+ACK_SIZE = 5
+ACK_BITMAP_BITS = 8
+
+#   A payload this long still has room for both extensions, so an ACK owed to
+#       the destination can always ride along instead of going out on its own
+MAX_ACKED_PAYLOAD_SIZE = MAX_ROUTED_PAYLOAD_SIZE - ACK_SIZE
+
+#   To address (and next hop) that every node picks up
+BROADCAST_ADDRESS = 0xFFFF
+
+#   To addresses of multicast groups, picked up by the nodes that joined them.
+#       Node addresses stay below MULTICAST_FIRST.
+MULTICAST_FIRST = 0xFF00
+MULTICAST_LAST = 0xFFFE
+
+def _crcTable():
+    table = array("H", [0] * 256)
+
+    for index in range(256):
+        crc = index << 8
+
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ CRC_POLYNOMIAL) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+
+        table[index] = crc
+
+    return table
+
+CRC_TABLE = _crcTable()
+
+def crc16(data, length=None, crc=CRC_INITIAL):
+    #   CRC of the first length bytes of data
+    table = CRC_TABLE
+
+    if length is None:
+        length = len(data)
+
+    for index in range(length):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ data[index]]
+
+    return crc
+
+def packCrc(packet, length):
+    #   Write the CRC of a packet of length bytes (CRC included) into its last 2 bytes
+    crc = crc16(packet, length - CRC_SIZE)
+
+    packet[length - 2] = crc >> 8
+    packet[length - 1] = crc & 0xFF
+
+def newPacketBuffer():
+    #   One buffer per node is enough, it is reused for every packet sent
+    return bytearray(MAX_PACKET_SIZE)
+
+def packHeader(buffer, sequence, fromNode, toNode, packetType, length, totalPackets=1, subPacketNumber=0):
+    struct.pack_into(HEADER_FORMAT, buffer, 0, sequence & 0xFFFFFFFF, fromNode, toNode, packetType, length, totalPackets, subPacketNumber)
+
+def packetSize(payloadLength, routed=False, acked=False):
+    #   Bytes taken by a packet with this payload and these extensions
+    size = HEADER_SIZE + payloadLength + CRC_SIZE
+
+    if routed:
+        size += ROUTE_SIZE
+
+    if acked:
+        size += ACK_SIZE
+
+    return size
+
+def packPacket(buffer, sequence, fromNode, toNode, packetType, payload=b"", totalPackets=1, subPacketNumber=0, route=None, ack=None):
+    #   Returns the number of bytes of buffer that make up the packet. route is
+    #       an optional (hopFrom, nextHop, ttl) tuple, ack an optional
+    #       (ackSequence, bitmap) tuple.
+    offset = HEADER_SIZE
+
+    if route is not None:
+        packetType |= FLAG_ROUTED
+        offset += ROUTE_SIZE
+
+    if ack is not None:
+        packetType |= FLAG_ACK
+        offset += ACK_SIZE
+
+    length = offset + len(payload) + CRC_SIZE
+
+    if length > len(buffer) or length > MAX_PACKET_SIZE:
+        raise ValueError("Payload of {0} bytes does not fit in a packet".format(len(payload)))
+
+    packHeader(buffer, sequence, fromNode, toNode, packetType, length, totalPackets, subPacketNumber)
+
+    if route is not None:
+        struct.pack_into(ROUTE_FORMAT, buffer, OFFSET_HOP_FROM, route[0], route[1], route[2])
+
+    if ack is not None:
+        struct.pack_into(ACK_FORMAT, buffer, offset - ACK_SIZE, ack[0] & 0xFFFFFFFF, ack[1])
+
+    buffer[offset:length - CRC_SIZE] = payload
+    packCrc(buffer, length)
+
+    return length
+
+def unpackHeader(packet):
+    #   (sequence, fromNode, toNode, packetType, length, totalPackets, subPacketNumber),
+    #       with the flags masked off the packet type
+    sequence, fromNode, toNode, packetType, length, totalPackets, subPacketNumber = struct.unpack_from(HEADER_FORMAT, packet, 0)
+
+    return sequence, fromNode, toNode, packetType & TYPE_MASK, length, totalPackets, subPacketNumber
+
+def unpackRoute(packet):
+    #   (hopFrom, nextHop, ttl), or None for a packet without a routing extension
+    if not packet[OFFSET_TYPE] & FLAG_ROUTED:
+        return None
+
+    return struct.unpack_from(ROUTE_FORMAT, packet, OFFSET_HOP_FROM)
+
+def unpackAck(packet):
+    #   (ackSequence, bitmap), or None for a packet without an acknowledgement extension
+    if not packet[OFFSET_TYPE] & FLAG_ACK:
+        return None
+
+    return struct.unpack_from(ACK_FORMAT, packet, payloadOffset(packet) - ACK_SIZE)
+
+def packRoute(packet, hopFrom, nextHop, ttl):
+    #   Rewrite the routing extension of a received packet in place, to forward it
+    struct.pack_into(ROUTE_FORMAT, packet, OFFSET_HOP_FROM, hopFrom, nextHop, ttl)
+    packCrc(packet, packet[OFFSET_LENGTH])
+
+#   Single field accessors, for when only one or two fields are needed
+def sequenceOf(packet):
+    return (packet[0] << 24) | (packet[1] << 16) | (packet[2] << 8) | packet[3]
+
+def fromNodeOf(packet):
+    return (packet[OFFSET_FROM_NODE] << 8) | packet[OFFSET_FROM_NODE + 1]
+
+def toNodeOf(packet):
+    return (packet[OFFSET_TO_NODE] << 8) | packet[OFFSET_TO_NODE + 1]
+
+def isMulticast(address):
+    return MULTICAST_FIRST <= address <= MULTICAST_LAST
+
+def isGroupAddress(address):
+    #   Broadcast or multicast, a To address that is not a single node
+    return address >= MULTICAST_FIRST
+
+def typeOf(packet):
+    return packet[OFFSET_TYPE] & TYPE_MASK
+
+def flagsOf(packet):
+    return packet[OFFSET_TYPE] & ~TYPE_MASK
+
+def isRouted(packet):
+    return packet[OFFSET_TYPE] & FLAG_ROUTED != 0
+
+def nextHopOf(packet):
+    return (packet[OFFSET_NEXT_HOP] << 8) | packet[OFFSET_NEXT_HOP + 1]
+
+def hopFromOf(packet):
+    return (packet[OFFSET_HOP_FROM] << 8) | packet[OFFSET_HOP_FROM + 1]
+
+def transmitterOf(packet):
+    #   The node that sent this copy: the last hop, or the source if not routed
+    if packet[OFFSET_TYPE] & FLAG_ROUTED:
+        return hopFromOf(packet)
+
+    return fromNodeOf(packet)
+
+def payloadOffset(packet):
+    offset = HEADER_SIZE
+
+    if packet[OFFSET_TYPE] & FLAG_ROUTED:
+        offset += ROUTE_SIZE
+
+    if packet[OFFSET_TYPE] & FLAG_ACK:
+        offset += ACK_SIZE
+
+    return offset
+
+def lengthOf(packet):
+    return packet[OFFSET_LENGTH]
+
+def payloadOf(packet):
+    #   A view of the payload, nothing is copied
+    return memoryview(packet)[payloadOffset(packet):packet[OFFSET_LENGTH] - CRC_SIZE]
+
+def isValidPacket(packet):
+    #   Length and CRC check, for a received packet before it is parsed
+    length = len(packet)
+
+    if length < HEADER_SIZE + CRC_SIZE or packet[OFFSET_LENGTH] != length:
+        return False
+
+    return crc16(packet, length - CRC_SIZE) == (packet[length - 2] << 8) | packet[length - 1] and length >= payloadOffset(packet) + CRC_SIZE
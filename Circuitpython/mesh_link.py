@@ -0,0 +1,191 @@
+#
+#   Link quality estimation for each neighbor
+#
+#   Two things are tracked per neighbor, both as exponential averages in
+#       integer fixed point:
+#
+#       RSSI            of every packet heard from it (dBm * RSSI_SCALE)
+#       Delivery ratio  of the packets sent through it, from ACKs and
+#                       retransmissions (0..RATIO_ONE)
+#
+#   They are combined into an ETX style metric, the expected number of
+#       transmissions for one packet to get through (ETX_SCALE = 1.0). Weak
+#       links get a small penalty on top, because their delivery ratio
+#       collapses quickly once the noise floor moves. It only tips the choice
+#       between two otherwise equal links, a weak link that delivers is still
+#       usable. The metric is recomputed whenever something changes, so etx()
+#       is only a dictionary and array lookup.
+#
+#   A link that stops being used gets no more ACKs to raise its delivery ratio,
+#       so a few losses would keep it unusable for good. Every call to age(),
+#       every few seconds, moves the ratio of each link that sent nothing since
+#       the last call a little back towards INITIAL_RATIO, and the link gets
+#       tried again. A link in use is left alone, so its ratio is only what it
+#       delivers: one that loses 40% of its packets averages ETX 1.7, well
+#       over the limit.
+#
+#   The table holds a fixed number of neighbors. A new neighbor replaces the
+#       one heard from least recently.
+#
+from array import array
+
+DEFAULT_CAPACITY = 16
+
+RSSI_SCALE = 4
+RATIO_ONE = 256
+ETX_SCALE = 16
+
+#   Exponential averaging weights, as right shifts (1/8, 1/4 and 1/32)
+RATIO_SHIFT = 3
+RSSI_SHIFT = 2
+AGE_SHIFT = 5
+
+#   A new neighbor gets the benefit of the doubt
+INITIAL_RATIO = RATIO_ONE * 7 // 8
+UNKNOWN_ETX = ETX_SCALE * RATIO_ONE // INITIAL_RATIO
+UNKNOWN_RSSI = -100
+
+#   Below this (dBm) a link counts as weak, and gets WEAK_PENALTY added to its ETX.
+#       0.25, well inside the margin between a perfect link and an unusable one.
+DEFAULT_WEAK_RSSI = -85
+WEAK_PENALTY = ETX_SCALE // 4
+
+#   The worst ETX we report, and the one above which a link is not worth using.
+#       1.5 means a delivery ratio below two thirds.
+MAX_ETX = 255
+DEFAULT_MAX_USABLE_ETX = 3 * ETX_SCALE // 2
+
+class LinkEstimator:
+    def __init__(self, capacity=DEFAULT_CAPACITY, weakRssi=DEFAULT_WEAK_RSSI, maxUsableEtx=DEFAULT_MAX_USABLE_ETX):
+        self.capacity = capacity
+        self.weakRssi = weakRssi
+        self.maxUsableEtx = maxUsableEtx
+
+        #   Neighbor address to slot
+        self._slots = {}
+        self._nodes = array("H", [0] * capacity)
+
+        self._rssi = array("h", [UNKNOWN_RSSI * RSSI_SCALE] * capacity)
+        self._ratio = array("H", [INITIAL_RATIO] * capacity)
+        self._etx = bytearray([UNKNOWN_ETX] * capacity)
+        self._heard = [0] * capacity
+        self._heardCount = 0
+
+        #   Whether anything was sent through each link since the last age()
+        self._active = bytearray(capacity)
+
+        self.evictedCount = 0
+
+    def _slotFor(self, node):
+        slot = self._slots.get(node)
+
+        if slot is not None:
+            return slot
+
+        if len(self._slots) < self.capacity:
+            slot = len(self._slots)
+        else:
+            #   Replace the neighbor heard from least recently
+            slot = 0
+
+            for other in range(1, self.capacity):
+                if self._heard[other] < self._heard[slot]:
+                    slot = other
+
+            del self._slots[self._nodes[slot]]
+            self.evictedCount += 1
+
+        self._slots[node] = slot
+        self._nodes[slot] = node
+        self._rssi[slot] = UNKNOWN_RSSI * RSSI_SCALE
+        self._ratio[slot] = INITIAL_RATIO
+        self._heard[slot] = 0
+        self._active[slot] = 0
+        self._update(slot)
+
+        return slot
+
+    def _update(self, slot):
+        ratio = max(1, self._ratio[slot])
+        etx = (ETX_SCALE * RATIO_ONE) // ratio
+
+        if self._heard[slot] and self._rssi[slot] < self.weakRssi * RSSI_SCALE:
+            etx += WEAK_PENALTY
+
+        self._etx[slot] = min(etx, MAX_ETX)
+
+    def heard(self, node, rssi):
+        #   A packet came in from neighbor node with this RSSI (dBm)
+        slot = self._slotFor(node)
+        value = int(rssi * RSSI_SCALE)
+
+        if self._heard[slot] == 0:
+            self._rssi[slot] = value
+        else:
+            self._rssi[slot] += (value - self._rssi[slot]) >> RSSI_SHIFT
+
+        self._heardCount += 1
+        self._heard[slot] = self._heardCount
+        self._update(slot)
+
+    def _age(self, slot):
+        ratio = self._ratio[slot]
+
+        if ratio < INITIAL_RATIO:
+            self._ratio[slot] = ratio + ((INITIAL_RATIO - ratio + (1 << AGE_SHIFT) - 1) >> AGE_SHIFT)
+
+    def age(self):
+        #   Call every few seconds, lets links that lost packets and have not
+        #       been used since be tried again
+        for slot in self._slots.values():
+            if self._active[slot]:
+                self._active[slot] = 0
+                continue
+
+            self._age(slot)
+            self._update(slot)
+
+    def delivered(self, node):
+        #   A packet sent through node was acknowledged
+        slot = self._slotFor(node)
+        self._ratio[slot] += (RATIO_ONE - self._ratio[slot]) >> RATIO_SHIFT
+        self._active[slot] = 1
+        self._update(slot)
+
+    def lost(self, node):
+        #   A packet sent through node had to be sent again
+        slot = self._slotFor(node)
+        self._ratio[slot] -= self._ratio[slot] >> RATIO_SHIFT
+        self._active[slot] = 1
+        self._update(slot)
+
+    def etx(self, node):
+        slot = self._slots.get(node)
+
+        if slot is None:
+            return UNKNOWN_ETX
+
+        return self._etx[slot]
+
+    def isUsable(self, node):
+        return self.etx(node) <= self.maxUsableEtx
+
+    def rssi(self, node):
+        slot = self._slots.get(node)
+
+        if slot is None:
+            return UNKNOWN_RSSI
+
+        return self._rssi[slot] / RSSI_SCALE
+
+    def deliveryRatio(self, node):
+        slot = self._slots.get(node)
+
+        if slot is None:
+            return INITIAL_RATIO / RATIO_ONE
+
+        return self._ratio[slot] / RATIO_ONE
+
+    def neighbors(self):
+        for node, slot in self._slots.items():
+            yield node, self._etx[slot], self._rssi[slot] / RSSI_SCALE
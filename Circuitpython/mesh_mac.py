@@ -0,0 +1,187 @@
+#
+#   Listen before talk channel access with randomized exponential backoff
+#
+#   Frames are not handed to the radio straight away. They wait in a small
+#       queue of preallocated buffers, and before each transmission the radio
+#       measures the RSSI of the channel. If it is above busyRssi somebody else
+#       is talking, so the frame waits a random number of backoff slots, from 0
+#       to 2 ** exponent - 1, and the exponent goes up by one for every busy
+#       channel up to maxExponent. After maxAttempts busy channels the frame is
+#       dropped, the ARQ above will send it again.
+#
+#   Every frame starts with a random backoff at minExponent too, so two nodes
+#       running the same timing do not keep starting to talk at the same moment.
+#
+#   Given a mesh_tdma.TdmaSchedule that is hearing beacons, frames wait for the
+#       node's own slot instead, and go out without listening or backing off,
+#       since nobody else talks in it. A node without a slot yet uses the
+#       contention slot, with listen before talk as usual.
+#
+#   run() never blocks. It returns the milliseconds until it next has something
+#       to do, to be used as a scheduler task.
+#
+from random import getrandbits
+
+from mesh_clock import ticksAdd, ticksDiff, ticksMs
+from mesh_header import MAX_PACKET_SIZE
+
+DEFAULT_QUEUE_SIZE = 8
+
+#   Channel busy above this (dBm)
+DEFAULT_BUSY_RSSI = -90
+
+#   About the airtime of a full packet at the driver's default 250 kbit/s
+DEFAULT_SLOT_MS = 4
+
+DEFAULT_MIN_EXPONENT = 2
+DEFAULT_MAX_EXPONENT = 5
+DEFAULT_MAX_ATTEMPTS = 6
+
+#   How long run() may wait when there is nothing to send
+IDLE_MS = 1000
+
+_REG_RSSI_CONFIG = 0x23
+_REG_RSSI_VALUE = 0x24
+
+_RSSI_START = 0x01
+_RSSI_DONE = 0x02
+
+#   How many times to check for the end of an RSSI measurement, it takes a few
+#       microseconds
+_RSSI_POLLS = 20
+
+class ListenBeforeTalk:
+    def __init__(self, rfm69, send, queueSize=DEFAULT_QUEUE_SIZE, busyRssi=DEFAULT_BUSY_RSSI, slot=DEFAULT_SLOT_MS, minExponent=DEFAULT_MIN_EXPONENT, maxExponent=DEFAULT_MAX_EXPONENT, maxAttempts=DEFAULT_MAX_ATTEMPTS, schedule=None):
+        self.rfm69 = rfm69
+        self.send = send
+        self.schedule = schedule
+        self.busyRssi = busyRssi
+        self.slot = slot
+        self.minExponent = minExponent
+        self.maxExponent = maxExponent
+        self.maxAttempts = maxAttempts
+
+        self.queueSize = queueSize
+        self._frames = [bytearray(MAX_PACKET_SIZE) for _ in range(queueSize)]
+        self._lengths = bytearray(queueSize)
+        self._head = 0
+        self._tail = 0
+        self.count = 0
+
+        #   Of the frame at the head of the queue
+        self._exponent = minExponent
+        self._attempts = 0
+        self._due = ticksMs()
+
+        self.sentCount = 0
+        self.busyCount = 0
+        self.backoffCount = 0
+        self.backoffMs = 0
+        self.droppedCount = 0
+        self.overflowCount = 0
+        self.lostCount = 0
+
+    def queue(self, frame):
+        #   Returns False, and drops the frame, if the queue is full
+        if self.count == self.queueSize:
+            self.overflowCount += 1
+            return False
+
+        tail = self._tail
+        self._frames[tail][:len(frame)] = frame
+        self._lengths[tail] = len(frame)
+
+        self._tail = (tail + 1) % self.queueSize
+        self.count += 1
+
+        if self.count == 1:
+            self._start(ticksMs())
+
+        return True
+
+    def lost(self):
+        #   A frame sent earlier never got through, most often a collision
+        self.lostCount += 1
+
+    def _start(self, now):
+        #   The frame at the head of the queue begins its channel access
+        self._exponent = self.minExponent
+        self._attempts = 0
+        self._backoff(now)
+
+    def _backoff(self, now):
+        wait = getrandbits(self._exponent) * self.slot
+
+        self.backoffCount += 1
+        self.backoffMs += wait
+        self._due = ticksAdd(now, wait)
+
+    def channelRssi(self):
+        #   Measure the RSSI of the channel now (dBm)
+        rfm69 = self.rfm69
+        rfm69._write_u8(_REG_RSSI_CONFIG, _RSSI_START)
+
+        for _ in range(_RSSI_POLLS):
+            if rfm69._read_u8(_REG_RSSI_CONFIG) & _RSSI_DONE:
+                break
+
+        return -rfm69._read_u8(_REG_RSSI_VALUE) / 2
+
+    def isChannelBusy(self):
+        return self.channelRssi() > self.busyRssi
+
+    def run(self, now=None):
+        #   Sends the frame at the head of the queue if its backoff is over and the
+        #       channel is clear. Returns the milliseconds until the next attempt.
+        if now is None:
+            now = ticksMs()
+
+        while self.count > 0:
+            if self.schedule is not None and self.schedule.isActive(now):
+                wait = self.schedule.timeUntilTransmit(now)
+
+                if wait > 0:
+                    return wait
+
+                if self.schedule.hasSlot():
+                    #   Our own slot, the channel is ours
+                    self._transmit()
+                    now = ticksMs()
+                    continue
+
+            wait = ticksDiff(self._due, now)
+
+            if wait > 0:
+                return wait
+
+            if self.isChannelBusy():
+                self.busyCount += 1
+                self._attempts += 1
+
+                if self._attempts >= self.maxAttempts:
+                    self.droppedCount += 1
+                    self._pop(now)
+                    continue
+
+                self._exponent = min(self._exponent + 1, self.maxExponent)
+                self._backoff(now)
+                continue
+
+            self._transmit()
+            now = ticksMs()
+
+        return IDLE_MS
+
+    def _transmit(self):
+        head = self._head
+        self.send(memoryview(self._frames[head])[:self._lengths[head]])
+        self.sentCount += 1
+
+        self._pop(ticksMs())
+
+    def _pop(self, now):
+        self._head = (self._head + 1) % self.queueSize
+        self.count -= 1
+
+        if self.count > 0:
+            self._start(now)
@@ -0,0 +1,268 @@
+#
+#   Neighbor discovery with Trickle timed HELLO beacons
+#
+#   Every node broadcasts HELLO beacons, and keeps the nodes it hears, through
+#       their beacons or any other packet, in a small neighbor table. A
+#       neighbor not heard from for the lifetime is dropped.
+#
+#       HELLO, broadcast, not routed:
+#           Sequence        beacon number
+#           From            node sending it
+#           To              BROADCAST_ADDRESS
+#           Payload         neighbor count (1), digest of the neighbor addresses (2)
+#
+#   The beacons follow a Trickle timer (RFC 6206). Each interval, from
+#       minInterval up to maxInterval, the beacon goes out at a random moment in
+#       its second half, unless redundancy beacons that changed nothing have
+#       been heard already that interval. After every interval the next one is
+#       twice as long, so a quiet neighborhood costs a beacon every maxInterval
+#       or so. A change, a new neighbor, a neighbor lost, or a neighbor whose
+#       digest changed because its own neighborhood did, goes straight back to
+#       minInterval, so the news spreads within a second or two.
+#
+#   run() never blocks. It returns the milliseconds until it next has something
+#       to do, to be used as a scheduler task, which should be woken after a
+#       reset.
+#
+#   A node never skips two beacons in a row, so every neighbor hears it at
+#       least every 2 * maxInterval even in a crowd, well within the lifetime.
+#
+from array import array
+from random import randint
+import struct
+
+from mesh_clock import ticksAdd, ticksDiff, ticksMs
+import mesh_header
+
+HELLO_FORMAT = ">BH"
+HELLO_SIZE = 3
+
+DEFAULT_CAPACITY = 16
+
+#   Trickle interval limits (ms), and beacons heard that make ours redundant
+DEFAULT_MIN_INTERVAL_MS = 1000
+DEFAULT_MAX_INTERVAL_MS = 64000
+DEFAULT_REDUNDANCY = 2
+
+#   How long a neighbor is kept without hearing from it (ms)
+DEFAULT_LIFETIME_MS = 4 * DEFAULT_MAX_INTERVAL_MS
+
+class NeighborTable:
+    def __init__(self, capacity=DEFAULT_CAPACITY, lifetime=DEFAULT_LIFETIME_MS):
+        self.capacity = capacity
+        self.lifetime = lifetime
+
+        self._nodes = array("H", [0] * capacity)
+        self._digests = array("H", [0] * capacity)
+        self._hasDigest = bytearray(capacity)
+        self._heardAt = [0] * capacity
+        self.count = 0
+
+        #   Digest of our own neighbor addresses, kept up to date on every change
+        self.digest = mesh_header.crc16(b"")
+        self._sorted = bytearray(2 * capacity)
+
+        self.fullCount = 0
+
+    def _indexOf(self, node):
+        for index in range(self.count):
+            if self._nodes[index] == node:
+                return index
+
+        return -1
+
+    def isNeighbor(self, node):
+        return self._indexOf(node) >= 0
+
+    def heard(self, node, now=None):
+        #   Any packet from node. Returns True if it is a new neighbor.
+        if now is None:
+            now = ticksMs()
+
+        index = self._indexOf(node)
+
+        if index >= 0:
+            self._heardAt[index] = now
+            return False
+
+        if self.count == self.capacity:
+            self.fullCount += 1
+            return False
+
+        index = self.count
+        self._nodes[index] = node
+        self._hasDigest[index] = 0
+        self._heardAt[index] = now
+        self.count += 1
+
+        self._updateDigest()
+
+        return True
+
+    def update(self, node, digest, now=None):
+        #   A HELLO from node. Returns True if it told us something new: a new
+        #       neighbor, its first HELLO, or a change in its own neighborhood.
+        isNew = self.heard(node, now)
+        index = self._indexOf(node)
+
+        if index < 0:
+            return False
+
+        changed = not self._hasDigest[index] or self._digests[index] != digest
+        self._digests[index] = digest
+        self._hasDigest[index] = 1
+
+        return isNew or changed
+
+    def expire(self, now=None):
+        #   Drops the neighbors not heard from for the lifetime, returns how many
+        if now is None:
+            now = ticksMs()
+
+        count = 0
+        index = 0
+
+        while index < self.count:
+            if ticksDiff(now, self._heardAt[index]) >= self.lifetime:
+                #   Move the last entry into the hole
+                last = self.count - 1
+                self._nodes[index] = self._nodes[last]
+                self._digests[index] = self._digests[last]
+                self._hasDigest[index] = self._hasDigest[last]
+                self._heardAt[index] = self._heardAt[last]
+                self.count = last
+                count += 1
+            else:
+                index += 1
+
+        if count:
+            self._updateDigest()
+
+        return count
+
+    def _updateDigest(self):
+        #   CRC of the addresses in ascending order, so it does not depend on the
+        #       order they were heard in
+        sortedNodes = sorted(self._nodes[index] for index in range(self.count))
+
+        for index, node in enumerate(sortedNodes):
+            struct.pack_into(">H", self._sorted, 2 * index, node)
+
+        self.digest = mesh_header.crc16(self._sorted, 2 * self.count)
+
+    def neighbors(self):
+        for index in range(self.count):
+            yield self._nodes[index]
+
+class NeighborDiscovery:
+    def __init__(self, address, send, table=None, minInterval=DEFAULT_MIN_INTERVAL_MS, maxInterval=DEFAULT_MAX_INTERVAL_MS, redundancy=DEFAULT_REDUNDANCY):
+        #   send(frame) transmits a finished frame
+        self.address = address
+        self.send = send
+        self.table = table if table is not None else NeighborTable()
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.redundancy = redundancy
+
+        self._buffer = mesh_header.newPacketBuffer()
+        self._payload = bytearray(HELLO_SIZE)
+        self._sequence = 0
+
+        #   The current Trickle interval
+        self.interval = minInterval
+        self._intervalEnd = 0
+        self._fireAt = 0
+        self._fired = False
+        self._consistent = 0
+        self._skipped = False
+
+        self.helloCount = 0
+        self.suppressedCount = 0
+        self.resetCount = 0
+
+        self._begin(ticksMs())
+
+    def _begin(self, now):
+        #   Start an interval, with the beacon somewhere in its second half
+        half = self.interval // 2
+
+        self._intervalEnd = ticksAdd(now, self.interval)
+        self._fireAt = ticksAdd(now, half + randint(0, self.interval - half - 1))
+        self._fired = False
+        self._consistent = 0
+
+    def reset(self, now=None):
+        #   Something changed, beacon fast again
+        if now is None:
+            now = ticksMs()
+
+        self.resetCount += 1
+
+        if self.interval > self.minInterval:
+            self.interval = self.minInterval
+            self._begin(now)
+
+    def isNeighbor(self, node):
+        return self.table.isNeighbor(node)
+
+    def heard(self, node, now=None):
+        #   Any packet from node. Returns True if it is a new neighbor, and the
+        #       beacon timer was reset.
+        if not self.table.heard(node, now):
+            return False
+
+        self.reset(now)
+
+        return True
+
+    def handle(self, packet, now=None):
+        #   Handles a HELLO. Returns True if the packet was one.
+        if mesh_header.typeOf(packet) != mesh_header.PACKET_TYPE_HELLO:
+            return False
+
+        payload = mesh_header.payloadOf(packet)
+
+        if len(payload) < HELLO_SIZE:
+            return True
+
+        count, digest = struct.unpack_from(HELLO_FORMAT, payload, 0)
+
+        if self.table.update(mesh_header.fromNodeOf(packet), digest, now):
+            self.reset(now)
+        else:
+            self._consistent += 1
+
+        return True
+
+    def _transmit(self):
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        struct.pack_into(HELLO_FORMAT, self._payload, 0, self.table.count, self.table.digest)
+
+        length = mesh_header.packPacket(self._buffer, self._sequence, self.address, mesh_header.BROADCAST_ADDRESS, mesh_header.PACKET_TYPE_HELLO, self._payload)
+        self.send(memoryview(self._buffer)[:length])
+        self.helloCount += 1
+
+    def run(self, now=None):
+        #   Sends the beacon when it is due, returns the milliseconds until there
+        #       is something to do again
+        if now is None:
+            now = ticksMs()
+
+        if self.table.expire(now):
+            self.reset(now)
+
+        if not self._fired and ticksDiff(now, self._fireAt) >= 0:
+            self._fired = True
+
+            if self._consistent < self.redundancy or self._skipped:
+                self._transmit()
+                self._skipped = False
+            else:
+                self.suppressedCount += 1
+                self._skipped = True
+
+        if ticksDiff(now, self._intervalEnd) >= 0:
+            self.interval = min(2 * self.interval, self.maxInterval)
+            self._begin(now)
+
+        return max(0, ticksDiff(self._intervalEnd if self._fired else self._fireAt, now))
@@ -0,0 +1,164 @@
+#
+#   Non-blocking RFM69 receive path driven by the DIO0 PayloadReady line
+#
+#   In receive mode the RFM69 raises DIO0 as soon as a complete packet is in
+#       its FIFO, and keeps it high until the FIFO has been read. Checking that
+#       pin is a single GPIO read, so it can be done on every pass of the
+#       scheduler, where asking the radio over SPI (or blocking in
+#       rfm69.receive()) can not.
+#
+#   CircuitPython has no user pin interrupts, so the pin is checked instead of
+#       attaching a handler to it. Nothing is lost that way: the radio holds the
+#       packet and DIO0 stays up until drain() empties the FIFO.
+#
+#   drain() copies each waiting packet, with its RSSI, into the next free slot
+#       of a ring of preallocated frame buffers and returns at once. The main
+#       loop takes frames from the ring with next() and gives the slot back with
+#       release(), so nothing is allocated per packet.
+#
+#   Each frame also keeps the ticks when it left the FIFO, for mesh_timesync,
+#       since the main loop may get to it a good while later.
+#
+from digitalio import DigitalInOut, Direction
+
+from mesh_clock import ticksMs
+
+#   The RFM69 FIFO is 66 bytes, including the length byte
+FIFO_SIZE = 66
+
+#   adafruit_rfm69 puts a 4 byte RadioHead header (to, from, id, flags) in
+#       front of the data given to send()
+DRIVER_HEADER_SIZE = 4
+
+DEFAULT_SLOT_COUNT = 8
+
+_REG_FIFO = 0x00
+
+class FrameRing:
+    def __init__(self, slotCount=DEFAULT_SLOT_COUNT, slotSize=FIFO_SIZE):
+        self.slotCount = slotCount
+
+        self._slots = [bytearray(slotSize) for _ in range(slotCount)]
+        self._views = [memoryview(slot) for slot in self._slots]
+        self._starts = bytearray(slotCount)
+        self._ends = bytearray(slotCount)
+        self._rssi = [0] * slotCount
+        self._receivedAt = [0] * slotCount
+
+        self._head = 0
+        self._tail = 0
+        self.count = 0
+
+        self.overflowCount = 0
+
+    def isFull(self):
+        return self.count == self.slotCount
+
+    def reserve(self):
+        #   The buffer of the next free slot, or None if the ring is full
+        if self.isFull():
+            return None
+
+        return self._slots[self._head]
+
+    def commit(self, start, end, rssi, receivedAt=0):
+        #   Publish the slot returned by reserve()
+        head = self._head
+
+        self._starts[head] = start
+        self._ends[head] = end
+        self._rssi[head] = rssi
+        self._receivedAt[head] = receivedAt
+
+        self._head = (head + 1) % self.slotCount
+        self.count += 1
+
+    def next(self):
+        #   (frame, rssi) of the oldest frame, or (None, 0) when empty. The frame
+        #       is a view into its slot and is only valid until release().
+        if self.count == 0:
+            return None, 0
+
+        tail = self._tail
+
+        return self._views[tail][self._starts[tail]:self._ends[tail]], self._rssi[tail]
+
+    def receivedAt(self):
+        #   Ticks when the oldest frame was received
+        return self._receivedAt[self._tail]
+
+    def release(self):
+        if self.count > 0:
+            self._tail = (self._tail + 1) % self.slotCount
+            self.count -= 1
+
+class RadioReceiver:
+    def __init__(self, rfm69, dio0Pin, slotCount=DEFAULT_SLOT_COUNT, driverHeaderSize=DRIVER_HEADER_SIZE):
+        self.rfm69 = rfm69
+        self.driverHeaderSize = driverHeaderSize
+        self.ring = FrameRing(slotCount)
+
+        self._dio0 = DigitalInOut(dio0Pin)
+        self._dio0.direction = Direction.INPUT
+
+        #   Where a frame goes when the ring is full, so the FIFO still gets emptied
+        self._scratch = bytearray(FIFO_SIZE)
+
+        self.receivedCount = 0
+        self.errorCount = 0
+
+        rfm69.listen()
+
+    def payloadReady(self):
+        return self._dio0.value
+
+    def drain(self):
+        #   Moves every packet waiting in the radio into the ring, returns how many
+        count = 0
+
+        while self._dio0.value:
+            self._readFifo()
+            count += 1
+
+        return count
+
+    def _readFifo(self):
+        rfm69 = self.rfm69
+        receivedAt = ticksMs()
+
+        #   Read the RSSI first, the radio starts measuring again once the FIFO is empty
+        rssi = rfm69.rssi
+        length = rfm69._read_u8(_REG_FIFO)
+
+        buffer = self.ring.reserve()
+
+        if buffer is None:
+            self.ring.overflowCount += 1
+            buffer = self._scratch
+
+        if length == 0 or length >= len(buffer):
+            #   Not a packet we could have sent, flush it
+            self.errorCount += 1
+            rfm69._read_into(_REG_FIFO, self._scratch, FIFO_SIZE - 1)
+            return
+
+        rfm69._read_into(_REG_FIFO, buffer, length)
+
+        if buffer is self._scratch:
+            return
+
+        if length <= self.driverHeaderSize:
+            self.errorCount += 1
+            return
+
+        self.receivedCount += 1
+        self.ring.commit(self.driverHeaderSize, length, rssi, receivedAt)
+
+    def next(self):
+        return self.ring.next()
+
+    def receivedAt(self):
+        return self.ring.receivedAt()
+
+    def release(self):
+        self.ring.release()
@@ -0,0 +1,374 @@
+#
+#   Multi-hop routing with next-hop forwarding
+#
+#   Every routed packet keeps its original From and To addresses, and carries a
+#       routing extension (see mesh_header) with the node that transmitted this
+#       copy, the node that should pick it up next and a time to live. A node
+#       only looks at packets whose next hop is itself. If it is also the final
+#       destination the packet is delivered, otherwise the routing extension is
+#       rewritten in place and the same buffer is sent on to the next hop.
+#
+#   The routing table is a fixed size pair of arrays, so it costs a few bytes
+#       per route and never grows. It holds static routes. Routes found by
+#       mesh_discovery go in a RouteCache, which is also array backed and
+#       bounded, and whose entries expire. When the cache is full the least
+#       recently used route makes room. A destination without any route is
+#       assumed to be in radio range, and packets to it go without a routing
+#       extension, 5 bytes more for the payload.
+#
+#   Given a mesh_link LinkEstimator, the router drops a discovered route as soon
+#       as the link to its next hop stops being usable, so traffic does not keep
+#       going through a neighbor that only looks alive.
+#
+#   Packets to a group address (broadcast or a multicast group) are delivered
+#       only if this node is a member of the group, so everything else is
+#       filtered out before the payload is looked at. Sent without a routing
+#       extension they reach the nodes in radio range with one transmission.
+#       Routed, with BROADCAST_ADDRESS as next hop, they are flooded: every node
+#       passes each one on once, until the TTL runs out. Flooded copies are
+#       recognized by (from node, sequence).
+#
+from array import array
+
+from mesh_clock import ticksAdd, ticksDiff, ticksMs
+from mesh_dedup import DuplicateFilter
+import mesh_header
+
+DEFAULT_CAPACITY = 16
+DEFAULT_TTL = 8
+
+DEFAULT_CACHE_CAPACITY = 8
+DEFAULT_ROUTE_LIFETIME_MS = 120000
+
+NO_ROUTE = 0xFFFF
+
+#   What to do with a received packet. A flooded group packet may be both
+#       delivered and forwarded.
+ACTION_DROP = 0
+ACTION_DELIVER = 1
+ACTION_FORWARD = 2
+ACTION_DELIVER_AND_FORWARD = ACTION_DELIVER | ACTION_FORWARD
+
+class RoutingTable:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+
+        self._destinations = array("H", [NO_ROUTE] * capacity)
+        self._nextHops = array("H", [NO_ROUTE] * capacity)
+        self._metrics = bytearray(capacity)
+
+    def _indexOf(self, destination):
+        destinations = self._destinations
+
+        for index in range(self.count):
+            if destinations[index] == destination:
+                return index
+
+        return -1
+
+    def addRoute(self, destination, nextHop, metric=1):
+        #   Returns False if the table is full
+        index = self._indexOf(destination)
+
+        if index < 0:
+            if self.count == self.capacity:
+                return False
+
+            index = self.count
+            self.count += 1
+            self._destinations[index] = destination
+
+        self._nextHops[index] = nextHop
+        self._metrics[index] = min(metric, 255)
+
+        return True
+
+    def removeRoute(self, destination):
+        index = self._indexOf(destination)
+
+        if index < 0:
+            return False
+
+        #   Move the last route into the hole to keep the arrays packed
+        last = self.count - 1
+        self._destinations[index] = self._destinations[last]
+        self._nextHops[index] = self._nextHops[last]
+        self._metrics[index] = self._metrics[last]
+        self._destinations[last] = NO_ROUTE
+        self.count = last
+
+        return True
+
+    def nextHopFor(self, destination):
+        index = self._indexOf(destination)
+
+        if index < 0:
+            return NO_ROUTE
+
+        return self._nextHops[index]
+
+    def metricFor(self, destination):
+        index = self._indexOf(destination)
+
+        if index < 0:
+            return 0
+
+        return self._metrics[index]
+
+    def routes(self):
+        for index in range(self.count):
+            yield self._destinations[index], self._nextHops[index], self._metrics[index]
+
+class RouteCache:
+    def __init__(self, capacity=DEFAULT_CACHE_CAPACITY, lifetime=DEFAULT_ROUTE_LIFETIME_MS):
+        self.capacity = capacity
+        self.lifetime = lifetime
+        self.count = 0
+
+        self._destinations = array("H", [NO_ROUTE] * capacity)
+        self._nextHops = array("H", [NO_ROUTE] * capacity)
+        self._metrics = bytearray(capacity)
+        self._expires = [0] * capacity
+
+        #   When each route was last used, as a count of lookups
+        self._used = [0] * capacity
+        self._useCount = 0
+
+        self.evictedCount = 0
+        self.expiredCount = 0
+
+    def _indexOf(self, destination, now):
+        destinations = self._destinations
+
+        for index in range(self.count):
+            if destinations[index] == destination:
+                if ticksDiff(self._expires[index], now) <= 0:
+                    self.expiredCount += 1
+                    self._remove(index)
+                    return -1
+
+                return index
+
+        return -1
+
+    def _remove(self, index):
+        last = self.count - 1
+        self._destinations[index] = self._destinations[last]
+        self._nextHops[index] = self._nextHops[last]
+        self._metrics[index] = self._metrics[last]
+        self._expires[index] = self._expires[last]
+        self._used[index] = self._used[last]
+        self._destinations[last] = NO_ROUTE
+        self.count = last
+
+    def _leastRecentlyUsed(self):
+        oldest = 0
+
+        for index in range(1, self.count):
+            if self._used[index] < self._used[oldest]:
+                oldest = index
+
+        return oldest
+
+    def addRoute(self, destination, nextHop, metric=1):
+        #   A route that is already known is only replaced by one with no more
+        #       hops, or by a fresher one through the same next hop, which may
+        #       have grown longer since. An expired route is forgotten first, so
+        #       any route replaces it
+        now = ticksMs()
+        index = self._indexOf(destination, now)
+
+        if index >= 0:
+            if metric > self._metrics[index] and nextHop != self._nextHops[index]:
+                return False
+        else:
+            if self.count == self.capacity:
+                self.evictedCount += 1
+                self._remove(self._leastRecentlyUsed())
+
+            index = self.count
+            self.count += 1
+            self._destinations[index] = destination
+
+        self._nextHops[index] = nextHop
+        self._metrics[index] = min(metric, 255)
+        self._expires[index] = ticksAdd(now, self.lifetime)
+        self._useCount += 1
+        self._used[index] = self._useCount
+
+        return True
+
+    def refresh(self, destination):
+        #   The route just carried traffic, keep it alive
+        now = ticksMs()
+        index = self._indexOf(destination, now)
+
+        if index >= 0:
+            self._expires[index] = ticksAdd(now, self.lifetime)
+
+    def removeRoute(self, destination):
+        index = self._indexOf(destination, ticksMs())
+
+        if index < 0:
+            return False
+
+        self._remove(index)
+
+        return True
+
+    def nextHopFor(self, destination):
+        now = ticksMs()
+        index = self._indexOf(destination, now)
+
+        if index < 0:
+            return NO_ROUTE
+
+        self._useCount += 1
+        self._used[index] = self._useCount
+
+        return self._nextHops[index]
+
+    def metricFor(self, destination):
+        index = self._indexOf(destination, ticksMs())
+
+        if index < 0:
+            return 0
+
+        return self._metrics[index]
+
+    def routes(self):
+        for index in range(self.count):
+            yield self._destinations[index], self._nextHops[index], self._metrics[index]
+
+class Router:
+    def __init__(self, address, table=None, ttl=DEFAULT_TTL, cache=None, links=None):
+        self.address = address
+        self.table = table if table is not None else RoutingTable()
+        self.cache = cache
+        self.links = links
+        self.ttl = ttl
+
+        #   Multicast groups this node has joined, and the flooded group packets seen
+        self.groups = set()
+        self.groupDuplicates = DuplicateFilter()
+
+        self.forwardedCount = 0
+        self.droppedCount = 0
+        self.filteredCount = 0
+
+    def knownNextHop(self, destination):
+        #   Static routes win over discovered ones. NO_ROUTE if neither knows it.
+        nextHop = self.table.nextHopFor(destination)
+
+        if nextHop == NO_ROUTE and self.cache is not None:
+            nextHop = self.cache.nextHopFor(destination)
+
+            if nextHop != NO_ROUTE and not self.isUsableLink(nextHop):
+                self.cache.removeRoute(destination)
+                nextHop = NO_ROUTE
+
+        return nextHop
+
+    def join(self, group):
+        if not mesh_header.isMulticast(group):
+            raise ValueError("{0:#06x} is not a multicast group".format(group))
+
+        self.groups.add(group)
+
+    def leave(self, group):
+        self.groups.discard(group)
+
+    def isMember(self, address):
+        #   True if packets to address are for this node
+        return address == self.address or address == mesh_header.BROADCAST_ADDRESS or address in self.groups
+
+    def isUsableLink(self, neighbor):
+        return self.links is None or self.links.isUsable(neighbor)
+
+    def hasRoute(self, destination):
+        return self.knownNextHop(destination) != NO_ROUTE
+
+    def nextHopFor(self, destination):
+        if mesh_header.isGroupAddress(destination):
+            #   Flooded to every neighbor
+            return mesh_header.BROADCAST_ADDRESS
+
+        nextHop = self.knownNextHop(destination)
+
+        if nextHop == NO_ROUTE:
+            #   No route, so it had better be in range
+            return destination
+
+        return nextHop
+
+    def routeTo(self, destination):
+        #   The routing extension for a packet we originate, None for a unicast
+        #       destination without a route, which is sent to straight
+        if not mesh_header.isGroupAddress(destination) and self.knownNextHop(destination) == NO_ROUTE:
+            return None
+
+        return (self.address, self.nextHopFor(destination), self.ttl)
+
+    def inspect(self, packet):
+        #   Decide what to do with a received packet
+        toNode = mesh_header.toNodeOf(packet)
+
+        if mesh_header.isGroupAddress(toNode):
+            return self._inspectGroup(packet, toNode)
+
+        if not mesh_header.isRouted(packet):
+            #   Single hop packet
+            if toNode == self.address:
+                return ACTION_DELIVER
+
+            self.droppedCount += 1
+            return ACTION_DROP
+
+        if mesh_header.nextHopOf(packet) != self.address:
+            #   Overheard a packet meant for another hop
+            return ACTION_DROP
+
+        if toNode == self.address:
+            return ACTION_DELIVER
+
+        if packet[mesh_header.OFFSET_TTL] <= 1 or mesh_header.fromNodeOf(packet) == self.address:
+            #   Out of hops, or looped back to where it came from
+            self.droppedCount += 1
+            return ACTION_DROP
+
+        return ACTION_FORWARD
+
+    def _inspectGroup(self, packet, toNode):
+        fromNode = mesh_header.fromNodeOf(packet)
+        routed = mesh_header.isRouted(packet)
+
+        if routed:
+            if mesh_header.nextHopOf(packet) != mesh_header.BROADCAST_ADDRESS or fromNode == self.address:
+                #   Not flooded, or our own coming back
+                return ACTION_DROP
+
+            if self.groupDuplicates.isDuplicate(fromNode, mesh_header.sequenceOf(packet)):
+                return ACTION_DROP
+
+        action = ACTION_DROP
+
+        if self.isMember(toNode):
+            action = ACTION_DELIVER
+        else:
+            self.filteredCount += 1
+
+        if routed and packet[mesh_header.OFFSET_TTL] > 1:
+            action |= ACTION_FORWARD
+
+        return action
+
+    def forward(self, packet):
+        #   Rewrite the routing extension in place for the next hop, returns the
+        #       next hop's address
+        nextHop = self.nextHopFor(mesh_header.toNodeOf(packet))
+
+        mesh_header.packRoute(packet, self.address, nextHop, packet[mesh_header.OFFSET_TTL] - 1)
+        self.forwardedCount += 1
+
+        return nextHop
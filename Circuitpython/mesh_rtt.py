@@ -0,0 +1,94 @@
+#
+#   Adaptive retransmission timeout from measured round trip times
+#
+#   Each neighbor gets its own estimator, which keeps a smoothed round trip time
+#       and its mean deviation the way TCP does (RFC 6298), in scaled integer
+#       milliseconds so no floats are involved:
+#
+#           srtt    = 7/8 srtt + 1/8 rtt
+#           rttvar  = 3/4 rttvar + 1/4 |srtt - rtt|
+#           timeout = srtt + 4 rttvar
+#
+#   Every retransmission doubles the timeout until a fresh sample arrives. Only
+#       packets that were sent once may be sampled (Karn's algorithm), since the
+#       ACK of a retransmitted packet can belong to either copy.
+#
+DEFAULT_INITIAL_TIMEOUT_MS = 1000
+DEFAULT_MIN_TIMEOUT_MS = 30
+DEFAULT_MAX_TIMEOUT_MS = 8000
+
+#   Doubling the timeout more than this many times can only hit the maximum
+MAX_BACKOFF = 8
+
+class RttEstimator:
+    def __init__(self, initialTimeout=DEFAULT_INITIAL_TIMEOUT_MS, minTimeout=DEFAULT_MIN_TIMEOUT_MS, maxTimeout=DEFAULT_MAX_TIMEOUT_MS):
+        self.minTimeout = minTimeout
+        self.maxTimeout = maxTimeout
+
+        #   srtt scaled by 8 and rttvar scaled by 4
+        self._srtt8 = 0
+        self._rttvar4 = 0
+        self._backoff = 0
+
+        self.sampleCount = 0
+        self.timeout = initialTimeout
+
+    def smoothedRtt(self):
+        return self._srtt8 >> 3
+
+    def rttVariance(self):
+        return self._rttvar4 >> 2
+
+    def sample(self, rtt):
+        if rtt < 0:
+            return
+
+        if self.sampleCount == 0:
+            self._srtt8 = rtt << 3
+            self._rttvar4 = rtt << 1
+        else:
+            delta = rtt - (self._srtt8 >> 3)
+            self._srtt8 += delta
+
+            if delta < 0:
+                delta = -delta
+
+            self._rttvar4 += delta - (self._rttvar4 >> 2)
+
+        self.sampleCount += 1
+        self._backoff = 0
+        self._update()
+
+    def backoff(self):
+        #   A packet was lost, back off until the link proves itself again
+        if self._backoff < MAX_BACKOFF:
+            self._backoff += 1
+
+        if self.sampleCount == 0:
+            self.timeout = min(self.timeout * 2, self.maxTimeout)
+        else:
+            self._update()
+
+    def _update(self):
+        timeout = ((self._srtt8 >> 3) + max(1, self._rttvar4)) << self._backoff
+        self.timeout = max(self.minTimeout, min(timeout, self.maxTimeout))
+
+class RttTable:
+    #   One estimator per neighbor node address, created the first time it is needed
+    def __init__(self, initialTimeout=DEFAULT_INITIAL_TIMEOUT_MS, minTimeout=DEFAULT_MIN_TIMEOUT_MS, maxTimeout=DEFAULT_MAX_TIMEOUT_MS):
+        self.initialTimeout = initialTimeout
+        self.minTimeout = minTimeout
+        self.maxTimeout = maxTimeout
+        self._estimators = {}
+
+    def estimatorFor(self, node):
+        estimator = self._estimators.get(node)
+
+        if estimator is None:
+            estimator = RttEstimator(self.initialTimeout, self.minTimeout, self.maxTimeout)
+            self._estimators[node] = estimator
+
+        return estimator
+
+    def timeoutFor(self, node):
+        return self.estimatorFor(node).timeout
@@ -0,0 +1,116 @@
+#
+#   Small deadline based cooperative scheduler
+#
+#   Replaces one big blocking while True loop with independent tasks, each with
+#       its own deadline. A task is a plain function that must return quickly.
+#       It returns how many milliseconds until it wants to run again, or None to
+#       keep its fixed interval. One shot tasks run once and are removed.
+#
+#   run() sleeps only until the earliest deadline, so an idle node wakes up
+#       exactly when the next task is due. runAsync() does the same with
+#       asyncio.sleep(), so the scheduler can share a board with asyncio tasks
+#       on CircuitPython builds that have asyncio.
+#
+from time import sleep
+
+from mesh_clock import ticksAdd, ticksDiff, ticksMs
+
+#   Never sleep longer than this, so a task whose deadline was moved from
+#       outside the scheduler (by wake()) is not kept waiting
+DEFAULT_MAX_IDLE_MS = 100
+
+class Task:
+    def __init__(self, name, function, interval, deadline, oneShot=False):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.deadline = deadline
+        self.oneShot = oneShot
+        self.enabled = True
+
+        self.runCount = 0
+        self.overrunCount = 0
+
+class Scheduler:
+    def __init__(self, maxIdle=DEFAULT_MAX_IDLE_MS):
+        self.maxIdle = maxIdle
+        self.tasks = []
+
+    def every(self, interval, function, name=None, delay=0):
+        task = Task(name or function.__name__, function, interval, ticksAdd(ticksMs(), delay))
+        self.tasks.append(task)
+
+        return task
+
+    def after(self, delay, function, name=None):
+        task = Task(name or function.__name__, function, 0, ticksAdd(ticksMs(), delay), oneShot=True)
+        self.tasks.append(task)
+
+        return task
+
+    def wake(self, task, delay=0):
+        #   Move a task's deadline forward, e.g. when there is new work for it
+        deadline = ticksAdd(ticksMs(), delay)
+
+        if ticksDiff(deadline, task.deadline) < 0:
+            task.deadline = deadline
+
+    def cancel(self, task):
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    def runOnce(self):
+        #   Runs every task that is due, and returns the milliseconds until the
+        #       next deadline
+        now = ticksMs()
+        index = 0
+
+        while index < len(self.tasks):
+            task = self.tasks[index]
+
+            if task.enabled and ticksDiff(now, task.deadline) >= 0:
+                wait = task.function()
+                task.runCount += 1
+
+                if task.oneShot:
+                    self.tasks.pop(index)
+                    continue
+
+                if wait is None:
+                    wait = task.interval
+
+                finished = ticksMs()
+
+                #   Late by more than a whole interval, do not try to catch up
+                if ticksDiff(finished, ticksAdd(task.deadline, wait)) > 0:
+                    task.overrunCount += 1
+                    task.deadline = ticksAdd(finished, wait)
+                elif wait == task.interval:
+                    task.deadline = ticksAdd(task.deadline, wait)
+                else:
+                    task.deadline = ticksAdd(finished, wait)
+
+                now = finished
+
+            index += 1
+
+        wait = self.maxIdle
+
+        for task in self.tasks:
+            if task.enabled:
+                wait = min(wait, ticksDiff(task.deadline, now))
+
+        return max(0, wait)
+
+    def run(self):
+        while True:
+            wait = self.runOnce()
+
+            if wait > 0:
+                sleep(wait / 1000)
+
+    async def runAsync(self):
+        import asyncio
+
+        while True:
+            await asyncio.sleep(self.runOnce() / 1000)
@@ -0,0 +1,71 @@
+#
+#   Fixed point encoding of sensor readings
+#
+#   The sensor drivers return floats. On air every channel is a signed 16 bit
+#       integer instead, the reading multiplied by the channel's scale and
+#       rounded, so a 9 axis IMU sample is 18 bytes. Readings outside the int16
+#       range are clamped to it.
+#
+#   Every channel declares its unit and scale, the resolution is 1 / scale:
+#
+#       Channel         Unit        Scale   Resolution      Range
+#       -------         ----        -----   ----------      -----
+#       Acceleration    m/s^2         100   0.01 m/s^2      +-327 m/s^2
+#       Magnetic field  uTesla         10   0.1 uTesla      +-3276 uTesla
+#       Angular rate    radians/s    1000   0.001 rad/s     +-32.7 rad/s
+#
+#   A record layout never changes once it has been sent. Changing the channels
+#       or scales means a new record format ID (see mesh_batch), which is the
+#       version byte at the start of every batch, so a gateway can decode old and
+#       new nodes side by side.
+#
+INT16_MIN = -32768
+INT16_MAX = 32767
+
+ACCELERATION_SCALE = 100
+MAGNETIC_SCALE = 10
+ANGULAR_RATE_SCALE = 1000
+
+#   9 axis IMU record, version 1
+IMU_V1_FORMAT = ">9h"
+
+#   (name, unit, scale) of each channel, in record order
+IMU_V1_CHANNELS = (
+    ("acc_x", "m/s^2", ACCELERATION_SCALE),
+    ("acc_y", "m/s^2", ACCELERATION_SCALE),
+    ("acc_z", "m/s^2", ACCELERATION_SCALE),
+    ("mag_x", "uTesla", MAGNETIC_SCALE),
+    ("mag_y", "uTesla", MAGNETIC_SCALE),
+    ("mag_z", "uTesla", MAGNETIC_SCALE),
+    ("gyro_x", "radians/s", ANGULAR_RATE_SCALE),
+    ("gyro_y", "radians/s", ANGULAR_RATE_SCALE),
+    ("gyro_z", "radians/s", ANGULAR_RATE_SCALE),
+)
+
+IMU_V1_SCALES = tuple(scale for name, unit, scale in IMU_V1_CHANNELS)
+
+def toFixed(value, scale):
+    return max(INT16_MIN, min(INT16_MAX, round(value * scale)))
+
+def fromFixed(value, scale):
+    return value / scale
+
+def encodeImu(acc_x, acc_y, acc_z, mag_x, mag_y, mag_z, gyro_x, gyro_y, gyro_z):
+    #   Driver readings to the int16 values of an IMU_V1 record
+    return (
+        toFixed(acc_x, ACCELERATION_SCALE), toFixed(acc_y, ACCELERATION_SCALE), toFixed(acc_z, ACCELERATION_SCALE),
+        toFixed(mag_x, MAGNETIC_SCALE), toFixed(mag_y, MAGNETIC_SCALE), toFixed(mag_z, MAGNETIC_SCALE),
+        toFixed(gyro_x, ANGULAR_RATE_SCALE), toFixed(gyro_y, ANGULAR_RATE_SCALE), toFixed(gyro_z, ANGULAR_RATE_SCALE),
+    )
+
+def decodeImu(record):
+    #   The int16 values of an IMU_V1 record back to readings in their units
+    return tuple(fromFixed(value, scale) for value, scale in zip(record, IMU_V1_SCALES))
+
+def decodeTimedImu(record):
+    #   The same, for a record that starts with its network time, which is kept
+    return (record[0],) + decodeImu(record[1:])
+
+def describe(name, channels):
+    #   A text description of a record's channels, for the receiving end to log
+    return bytes(name + "".join(" {0}:{1}/{2}".format(*channel) for channel in channels), "utf-8")
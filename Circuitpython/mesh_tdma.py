@@ -0,0 +1,300 @@
+#
+#   Optional time slotted channel access, coordinated by the gateway
+#
+#   The gateway divides time into superframes of slotCount slots of slotMs
+#       each, and broadcasts a beacon at the start of every superframe, in slot
+#       BEACON_SLOT. Slot CONTENTION_SLOT is open to every node, with listen
+#       before talk, for nodes that have no slot yet to ask for one. Every other
+#       slot belongs to one node, which is the only one that talks in it.
+#
+#       Beacon, broadcast, not routed:
+#           Sequence        superframe number
+#           From            gateway
+#           To              BROADCAST_ADDRESS
+#           Payload         slot length in ms (2), slots per superframe (1),
+#                           first slot in this beacon (1), entry count (1),
+#                           then the node address (2) of each slot from the
+#                           first one on, FREE_SLOT for a slot nobody has
+#
+#       Join, unicast to the gateway, not routed:
+#           Sequence        join attempt
+#           From            node asking for a slot
+#           To              gateway
+#
+#   A slot table bigger than one beacon is sent a page at a time, each beacon
+#       starting where the last one ended.
+#
+#   Nodes time their slots from the moment the beacon arrives, every beacon
+#       puts them back in step. A node that has missed lossLimit beacons in a
+#       row stops using slots and goes back to plain listen before talk.
+#
+#   TdmaSchedule is the node side, SlotTable the gateway side.
+#
+from array import array
+import struct
+
+from mesh_clock import ticksDiff, ticksMs
+import mesh_header
+
+BEACON_FORMAT = ">HBBB"
+BEACON_SIZE = 5
+
+BEACON_SLOT = 0
+CONTENTION_SLOT = 1
+FIRST_ASSIGNED_SLOT = 2
+
+FREE_SLOT = mesh_header.BROADCAST_ADDRESS
+
+#   Slot table entries that fit in one beacon
+MAX_BEACON_ENTRIES = (mesh_header.MAX_PAYLOAD_SIZE - BEACON_SIZE) // 2
+
+DEFAULT_SLOT_MS = 50
+DEFAULT_SLOT_COUNT = 32
+DEFAULT_SUPERFRAME_MS = DEFAULT_SLOT_MS * DEFAULT_SLOT_COUNT
+
+#   No transmission starts closer than this to the end of a slot (ms), it
+#       covers the airtime of a packet and the error of the beacon timing
+DEFAULT_GUARD_MS = 8
+
+DEFAULT_LOSS_LIMIT = 4
+
+#   Superframes between join attempts
+DEFAULT_JOIN_INTERVAL = 2
+
+#   How long the gateway keeps the slot of a node it has not heard from (ms)
+DEFAULT_SLOT_LIFETIME_MS = 300000
+
+def timeUntilSlot(slot, slotMs, slotCount, elapsed, guard=DEFAULT_GUARD_MS):
+    #   Milliseconds from elapsed (ms since the start of a superframe) until slot
+    #       is open for a transmission, 0 if it is open now
+    superframe = slotMs * slotCount
+    elapsed %= superframe
+    start = slot * slotMs
+
+    if elapsed < start:
+        return start - elapsed
+
+    if elapsed < start + slotMs - guard:
+        return 0
+
+    return superframe - elapsed + start
+
+class TdmaSchedule:
+    def __init__(self, address, send, guard=DEFAULT_GUARD_MS, lossLimit=DEFAULT_LOSS_LIMIT, joinInterval=DEFAULT_JOIN_INTERVAL):
+        #   send(frame) transmits a finished frame
+        self.address = address
+        self.send = send
+        self.guard = guard
+        self.lossLimit = lossLimit
+        self.joinInterval = joinInterval
+
+        self.gateway = None
+        self.slot = None
+        self.slotMs = DEFAULT_SLOT_MS
+        self.slotCount = DEFAULT_SLOT_COUNT
+
+        self._beaconAt = None
+        self._joinAt = None
+        self._buffer = mesh_header.newPacketBuffer()
+
+        self.beaconCount = 0
+        self.joinCount = 0
+
+    def superframe(self):
+        return self.slotMs * self.slotCount
+
+    def isActive(self, now=None):
+        #   True while the beacons keep coming
+        if self._beaconAt is None:
+            return False
+
+        if now is None:
+            now = ticksMs()
+
+        return ticksDiff(now, self._beaconAt) < self.lossLimit * self.superframe()
+
+    def hasSlot(self):
+        return self.slot is not None
+
+    def timeUntilTransmit(self, now=None):
+        #   Milliseconds until this node may transmit: in its own slot once it has
+        #       one, in the contention slot before that
+        if now is None:
+            now = ticksMs()
+
+        slot = self.slot if self.slot is not None else CONTENTION_SLOT
+
+        return timeUntilSlot(slot, self.slotMs, self.slotCount, ticksDiff(now, self._beaconAt), self.guard)
+
+    def handle(self, packet, now=None):
+        #   Handles a beacon. Returns True if the packet was one.
+        if mesh_header.typeOf(packet) != mesh_header.PACKET_TYPE_BEACON:
+            return False
+
+        payload = mesh_header.payloadOf(packet)
+
+        if len(payload) < BEACON_SIZE:
+            return True
+
+        slotMs, slotCount, firstSlot, count = struct.unpack_from(BEACON_FORMAT, payload, 0)
+
+        if slotMs == 0 or slotCount <= FIRST_ASSIGNED_SLOT or len(payload) < BEACON_SIZE + 2 * count:
+            return True
+
+        if now is None:
+            now = ticksMs()
+
+        gateway = mesh_header.fromNodeOf(packet)
+
+        if gateway != self.gateway or slotMs != self.slotMs or slotCount != self.slotCount:
+            #   A new gateway, or a new layout, our slot is no longer known
+            self.slot = None
+
+        self.gateway = gateway
+        self.slotMs = slotMs
+        self.slotCount = slotCount
+        self._beaconAt = now
+        self.beaconCount += 1
+
+        #   Only this page of the table is known, a slot outside it stays as it was
+        found = None
+
+        for index in range(count):
+            offset = BEACON_SIZE + 2 * index
+
+            if (payload[offset] << 8) | payload[offset + 1] == self.address:
+                found = firstSlot + index
+                break
+
+        if found is not None:
+            self.slot = found
+        elif self.slot is not None and firstSlot <= self.slot < firstSlot + count:
+            self.slot = None
+
+        return True
+
+    def join(self, now=None):
+        #   Asks the gateway for a slot, if we need one and have not asked too
+        #       recently. Returns True if a join went out.
+        if now is None:
+            now = ticksMs()
+
+        if not self.isActive(now) or self.slot is not None:
+            return False
+
+        if self._joinAt is not None and ticksDiff(now, self._joinAt) < self.joinInterval * self.superframe():
+            return False
+
+        self._joinAt = now
+        self.joinCount += 1
+
+        length = mesh_header.packPacket(self._buffer, self.joinCount, self.address, self.gateway, mesh_header.PACKET_TYPE_JOIN)
+        self.send(memoryview(self._buffer)[:length])
+
+        return True
+
+class SlotTable:
+    def __init__(self, slotMs=DEFAULT_SLOT_MS, slotCount=DEFAULT_SLOT_COUNT, lifetime=DEFAULT_SLOT_LIFETIME_MS):
+        self.slotMs = slotMs
+        self.slotCount = slotCount
+        self.lifetime = lifetime
+
+        #   Node address of each slot
+        self._nodes = array("H", [FREE_SLOT] * slotCount)
+        self._heardAt = [0] * slotCount
+
+        #   Where the next beacon's page of the table starts
+        self._nextPage = FIRST_ASSIGNED_SLOT
+        self._superframe = 0
+
+        self.joinCount = 0
+        self.fullCount = 0
+        self.expiredCount = 0
+
+    def slotOf(self, address):
+        for slot in range(FIRST_ASSIGNED_SLOT, self.slotCount):
+            if self._nodes[slot] == address:
+                return slot
+
+        return None
+
+    def join(self, address, now=None):
+        #   The slot of address, given a free one if it has none. None when full.
+        if now is None:
+            now = ticksMs()
+
+        slot = self.slotOf(address)
+
+        if slot is None:
+            for free in range(FIRST_ASSIGNED_SLOT, self.slotCount):
+                if self._nodes[free] == FREE_SLOT:
+                    slot = free
+                    break
+
+            if slot is None:
+                self.fullCount += 1
+                return None
+
+            self._nodes[slot] = address
+            self.joinCount += 1
+
+        self._heardAt[slot] = now
+
+        return slot
+
+    def leave(self, address):
+        slot = self.slotOf(address)
+
+        if slot is not None:
+            self._nodes[slot] = FREE_SLOT
+
+    def heard(self, address, now=None):
+        #   Traffic from address, its slot is still in use
+        slot = self.slotOf(address)
+
+        if slot is not None:
+            self._heardAt[slot] = ticksMs() if now is None else now
+
+    def expire(self, now=None):
+        #   Frees the slots of nodes not heard from for the lifetime
+        if now is None:
+            now = ticksMs()
+
+        for slot in range(FIRST_ASSIGNED_SLOT, self.slotCount):
+            if self._nodes[slot] != FREE_SLOT and ticksDiff(now, self._heardAt[slot]) >= self.lifetime:
+                self._nodes[slot] = FREE_SLOT
+                self.expiredCount += 1
+
+    def nodes(self):
+        for slot in range(FIRST_ASSIGNED_SLOT, self.slotCount):
+            if self._nodes[slot] != FREE_SLOT:
+                yield slot, self._nodes[slot]
+
+    def handle(self, packet, now=None):
+        #   Handles a join. Returns True if the packet was one.
+        if mesh_header.typeOf(packet) != mesh_header.PACKET_TYPE_JOIN:
+            return False
+
+        self.join(mesh_header.fromNodeOf(packet), now)
+
+        return True
+
+    def packBeacon(self, buffer, gateway):
+        #   Encodes the next beacon into buffer, returns its length
+        firstSlot = self._nextPage
+        count = min(MAX_BEACON_ENTRIES, self.slotCount - firstSlot)
+
+        payload = bytearray(BEACON_SIZE + 2 * count)
+        struct.pack_into(BEACON_FORMAT, payload, 0, self.slotMs, self.slotCount, firstSlot, count)
+
+        for index in range(count):
+            struct.pack_into(">H", payload, BEACON_SIZE + 2 * index, self._nodes[firstSlot + index])
+
+        self._nextPage = firstSlot + count
+
+        if self._nextPage >= self.slotCount:
+            self._nextPage = FIRST_ASSIGNED_SLOT
+
+        self._superframe = (self._superframe + 1) & 0xFFFFFFFF
+
+        return mesh_header.packPacket(buffer, self._superframe, gateway, mesh_header.BROADCAST_ADDRESS, mesh_header.PACKET_TYPE_BEACON, payload)
@@ -0,0 +1,266 @@
+#
+#   Network time, synchronized from the gateway over any number of hops
+#
+#   The gateway is the root and its clock is network time, in milliseconds,
+#       32 bits wrapping around. Every SYNC_INTERVAL_MS it broadcasts a time
+#       sync packet, a new round, with its time in it. A node that hears a round
+#       for the first time keeps the pair (its own ticks when the packet
+#       arrived, the network time in the packet), and passes the round on with
+#       its own estimate of network time and its level, one more than the
+#       sender's, so the round spreads away from the gateway hop by hop.
+#
+#       Time sync, broadcast, not routed:
+#           Sequence        round, counted by the root
+#           From            node passing the round on (the root first)
+#           To              BROADCAST_ADDRESS
+#           Payload         root (2), network time (4), level (1)
+#
+#   The network time in a packet is written by stamp() just before it goes to
+#       the radio, after any MAC backoff, and the receive time is taken when the
+#       packet leaves the radio's FIFO, so queueing on either side does not
+#       count as clock offset.
+#
+#   A root that restarts counts its rounds from 1 again. A round LOSS_LIMIT or
+#       more behind the last one, or any round after the root was lost, is
+#       taken as such a restart: the pairs of the old rounds are dropped and the
+#       node follows the new ones.
+#
+#   From the last POINTS pairs a least squares line gives the offset between
+#       network time and local ticks, and how fast it drifts. All the arithmetic
+#       is done relative to the newest pair, so the numbers stay small enough
+#       for CircuitPython's single precision floats.
+#
+from array import array
+import struct
+
+from mesh_arq import sequenceDiff
+from mesh_clock import ticksDiff, ticksMs
+import mesh_header
+
+SYNC_FORMAT = ">HIB"
+SYNC_SIZE = 7
+
+OFFSET_SYNC_TIME = 2
+
+SYNC_INTERVAL_MS = 10000
+
+#   Pairs kept for the drift estimate, and needed before our time is trusted
+POINTS = 8
+MIN_POINTS = 2
+
+#   Rounds missed before the root counts as gone
+LOSS_LIMIT = 4
+
+#   A pair this far off the line means network time jumped, the root restarted
+#       say, and the old pairs are thrown away (ms)
+JUMP_LIMIT_MS = 1000
+
+NETWORK_TIME_MODULO = 1 << 32
+
+def networkDiff(a, b):
+    #   Signed distance from b to a, in network time
+    return sequenceDiff(a, b)
+
+class NetworkClock:
+    def __init__(self, points=POINTS):
+        self.points = points
+
+        #   Pairs, relative to the newest one: local ticks, and network time minus local ticks
+        self._locals = array("l", [0] * points)
+        self._offsets = array("l", [0] * points)
+        self.count = 0
+        self._next = 0
+
+        #   The newest pair
+        self._referenceLocal = 0
+        self._referenceTime = 0
+
+        #   offset = intercept + skew * local, relative to the newest pair
+        self._intercept = 0.0
+        self.skew = 0.0
+
+        self.jumpCount = 0
+
+    def reset(self):
+        self.count = 0
+        self._next = 0
+
+    def isSynchronized(self):
+        return self.count >= MIN_POINTS
+
+    def add(self, local, networkTime):
+        #   A new pair of local ticks and the network time at that moment
+        if self.count > 0 and abs(networkDiff(networkTime, self.now(local))) > JUMP_LIMIT_MS:
+            self.jumpCount += 1
+            self.reset()
+
+        if self.count > 0:
+            #   Move the kept pairs over to the new reference
+            shiftLocal = ticksDiff(local, self._referenceLocal)
+            shiftOffset = networkDiff(networkTime, self._referenceTime) - shiftLocal
+
+            for index in range(self.count):
+                self._locals[index] -= shiftLocal
+                self._offsets[index] -= shiftOffset
+
+        self._referenceLocal = local
+        self._referenceTime = networkTime & 0xFFFFFFFF
+
+        self._locals[self._next] = 0
+        self._offsets[self._next] = 0
+        self._next = (self._next + 1) % self.points
+        self.count = min(self.count + 1, self.points)
+
+        self._fit()
+
+    def _fit(self):
+        count = self.count
+        meanLocal = sum(self._locals[index] for index in range(count)) / count
+        meanOffset = sum(self._offsets[index] for index in range(count)) / count
+
+        spread = 0.0
+        covariance = 0.0
+
+        for index in range(count):
+            local = self._locals[index] - meanLocal
+            spread += local * local
+            covariance += local * (self._offsets[index] - meanOffset)
+
+        self.skew = covariance / spread if spread > 0 else 0.0
+        self._intercept = meanOffset - self.skew * meanLocal
+
+    def now(self, local=None):
+        #   Network time at local ticks (now by default). Before the first pair it
+        #       is just the local ticks.
+        if local is None:
+            local = ticksMs()
+
+        if self.count == 0:
+            return local
+
+        elapsed = ticksDiff(local, self._referenceLocal)
+
+        return (self._referenceTime + elapsed + int(self._intercept + self.skew * elapsed)) % NETWORK_TIME_MODULO
+
+class TimeSync:
+    def __init__(self, address, send, isRoot=False, rootTime=None, clock=None):
+        #   send(frame) transmits a finished frame. The root's network time is
+        #       rootTime() if given, its own ticks otherwise.
+        self.address = address
+        self.send = send
+        self.isRoot = isRoot
+        self.rootTime = rootTime
+        self.clock = clock or NetworkClock()
+
+        self.root = address if isRoot else None
+        self.level = 0 if isRoot else None
+        self.round = 0
+
+        self._roundAt = None
+        self._buffer = mesh_header.newPacketBuffer()
+        self._payload = bytearray(SYNC_SIZE)
+
+        self.roundCount = 0
+        self.relayCount = 0
+        self.restartCount = 0
+
+    def now(self):
+        if self.isRoot:
+            return self._rootNow()
+
+        return self.clock.now()
+
+    def _rootNow(self):
+        if self.rootTime is not None:
+            return self.rootTime() % NETWORK_TIME_MODULO
+
+        return ticksMs()
+
+    def isSynchronized(self):
+        if self.isRoot:
+            return True
+
+        if self._isLost(ticksMs()):
+            return False
+
+        return self.clock.isSynchronized()
+
+    def _isLost(self, now):
+        return self._roundAt is None or ticksDiff(now, self._roundAt) >= LOSS_LIMIT * SYNC_INTERVAL_MS
+
+    def _transmit(self, level):
+        struct.pack_into(SYNC_FORMAT, self._payload, 0, self.root, 0, level)
+        length = mesh_header.packPacket(self._buffer, self.round, self.address, mesh_header.BROADCAST_ADDRESS, mesh_header.PACKET_TYPE_TIME_SYNC, self._payload)
+        self.send(memoryview(self._buffer)[:length])
+
+    def startRound(self):
+        #   The root only: send a new round, every SYNC_INTERVAL_MS
+        if not self.isRoot:
+            return False
+
+        self.round = (self.round + 1) & 0xFFFFFFFF
+        self.roundCount += 1
+        self._transmit(0)
+
+        return True
+
+    def stamp(self, frame):
+        #   Write our network time into a time sync frame about to be transmitted
+        if mesh_header.typeOf(frame) != mesh_header.PACKET_TYPE_TIME_SYNC:
+            return False
+
+        offset = mesh_header.payloadOffset(frame) + OFFSET_SYNC_TIME
+        struct.pack_into(">I", frame, offset, self.now())
+        mesh_header.packCrc(frame, len(frame))
+
+        return True
+
+    def handle(self, packet, receivedAt=None):
+        #   Handles a time sync packet. Returns True if the packet was one.
+        if mesh_header.typeOf(packet) != mesh_header.PACKET_TYPE_TIME_SYNC:
+            return False
+
+        if self.isRoot:
+            return True
+
+        payload = mesh_header.payloadOf(packet)
+
+        if len(payload) < SYNC_SIZE:
+            return True
+
+        root, networkTime, level = struct.unpack_from(SYNC_FORMAT, payload, 0)
+        sequence = mesh_header.sequenceOf(packet)
+
+        if receivedAt is None:
+            receivedAt = ticksMs()
+
+        if root != self.root:
+            if self.root is not None and self.isSynchronized() and root > self.root:
+                #   Stay with the root we have while it is alive, the lowest address wins otherwise
+                return True
+
+            self.root = root
+            self.clock.reset()
+        elif sequenceDiff(sequence, self.round) <= 0:
+            if sequenceDiff(sequence, self.round) > -LOSS_LIMIT and not self._isLost(receivedAt):
+                #   Had this round already, from a neighbor nearer the root
+                return True
+
+            #   Far behind the rounds we had, or the first we hear after losing
+            #       the root: it restarted and counts its rounds from 1 again
+            self.restartCount += 1
+            self.clock.reset()
+
+        self.round = sequence
+        self.level = level + 1
+        self._roundAt = receivedAt
+        self.roundCount += 1
+
+        self.clock.add(receivedAt, networkTime)
+
+        if self.clock.isSynchronized():
+            #   Pass the round on
+            self._transmit(self.level)
+            self.relayCount += 1
+
+        return True
@@ -0,0 +1,454 @@
+#
+#   asyncio gateway for the RFM69 mesh
+#
+#   The gateway is the node the sensor nodes send their data to. It runs the
+#       same mesh_* modules they do, so it decodes the same header, keeps an ARQ
+#       receiver per node and sends back the same cumulative ACKs, answers route
+#       requests, and takes part in HELLO neighbor discovery. It is also the one
+#       node that coordinates the network:
+#
+#       - Its clock is network time. Every mesh_timesync.SYNC_INTERVAL_MS it
+#         starts a time sync round as the root, with Unix time in ms (32 bits).
+#       - It sends the TDMA beacon every superframe and hands out the slots
+#         (mesh_tdma.SlotTable), unless TDMA is turned off.
+#
+#   Everything runs on one event loop, in a few tasks that never wait on each
+#       other: one takes frames from the radio and handles them, one sends the
+#       frames queued for transmission, and the rest are timers. Data delivered
+#       in order by the ARQ is decoded into gateway_sink.Records, which go to
+#       each sink's queue without waiting. Sinks write on threads of their own
+#       (see gateway_sink).
+#
+#   ACKs wait ACK_DELAY_MS, like on the nodes, so one ACK covers everything a
+#       node sent in a burst.
+#
+#   With a gateway_capture.CaptureRing every frame received, before it is even
+#       checked, is also kept in the capture file.
+#
+#   Run it as
+#
+#       python3 gateway.py                      on a Pi with an RFM69
+#       python3 gateway.py --simulate 30        with 30 simulated nodes instead
+#
+import argparse
+import asyncio
+import sys
+import time
+
+import gateway_path
+import mesh_arq
+import mesh_batch
+from mesh_clock import ticksMs
+import mesh_dedup
+import mesh_discovery
+import mesh_fragment
+import mesh_header
+import mesh_link
+import mesh_neighbor
+import mesh_routing
+import mesh_tdma
+import mesh_timesync
+
+import gateway_capture
+import gateway_radio
+import gateway_sink
+
+DEFAULT_ADDRESS = 1
+
+#   Must match the nodes' ARQ_WINDOW_SIZE
+ARQ_WINDOW_SIZE = 8
+
+ACK_DELAY_MS = 20
+
+#   Frames waiting for the radio, beyond that new ones are dropped
+OUTGOING_QUEUE_SIZE = 64
+
+#   A sample time further than this from the time it arrived can not be right,
+#       the node was not synchronized yet, and the arrival time is used instead
+MAX_SAMPLE_AGE_MS = 600000
+
+HOUSEKEEPING_INTERVAL_MS = 1000
+
+def unixMs():
+    return int(time.time() * 1000)
+
+def networkTime():
+    #   The root's clock: Unix time in ms, 32 bits
+    return unixMs() % mesh_timesync.NETWORK_TIME_MODULO
+
+class Gateway:
+    def __init__(self, radio, address=DEFAULT_ADDRESS, sinks=(), slotTable=None, groups=(), verbose=False, capture=None):
+        #   slotTable is a mesh_tdma.SlotTable to coordinate TDMA, None to leave it off
+        self.radio = radio
+        self.address = address
+        self.verbose = verbose
+        self.capture = capture
+
+        self.links = mesh_link.LinkEstimator()
+        self.router = mesh_routing.Router(address, cache=mesh_routing.RouteCache(), links=self.links)
+
+        for group in groups:
+            self.router.join(group)
+
+        self.discovery = mesh_discovery.RouteDiscovery(self.router, self.send)
+        self.neighbors = mesh_neighbor.NeighborDiscovery(address, self.send)
+        self.timeSync = mesh_timesync.TimeSync(address, self.send, isRoot=True, rootTime=networkTime)
+        self.slotTable = slotTable
+
+        self.arqReceivers = {}
+        self.duplicates = mesh_dedup.DuplicateFilter()
+        self.reassembler = mesh_fragment.Reassembler(slots=8)
+
+        self.sinks = [gateway_sink.SinkRunner(sink) for sink in sinks]
+
+        #   Nodes whose data we have not acknowledged yet
+        self.acksOwed = set()
+        self._ackTimer = None
+        self._ackPacket = mesh_header.newPacketBuffer()
+        self._beaconPacket = mesh_header.newPacketBuffer()
+
+        #   Made by run(), on the loop that runs the gateway
+        self._outgoing = None
+        self._helloWake = None
+        self._tasks = []
+
+        self.packetReceivedCount = 0
+        self.packetRejectedCount = 0
+        self.packetSentCount = 0
+        self.ackPacketsSent = 0
+        self.recordCount = 0
+        self.untimedCount = 0
+        self.outgoingDroppedCount = 0
+
+    def send(self, frame):
+        #   Queues a finished frame for the radio, copied, never waits
+        if self._outgoing is None:
+            self.outgoingDroppedCount += 1
+            return False
+
+        try:
+            self._outgoing.put_nowait(bytearray(frame))
+        except asyncio.QueueFull:
+            self.outgoingDroppedCount += 1
+            return False
+
+        return True
+
+    async def run(self):
+        self._outgoing = asyncio.Queue(OUTGOING_QUEUE_SIZE)
+        self._helloWake = asyncio.Event()
+
+        await self.radio.start()
+
+        loops = [self._receiveLoop(), self._transmitLoop(), self._timeSyncLoop(), self._helloLoop(), self._housekeepingLoop()]
+
+        if self.slotTable is not None:
+            loops.append(self._beaconLoop())
+
+        loops.extend(runner.run() for runner in self.sinks)
+
+        self._tasks = [asyncio.ensure_future(loop) for loop in loops]
+
+        await asyncio.gather(*self._tasks)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        for runner in self.sinks:
+            await runner.close()
+
+        self.radio.close()
+
+        if self.capture is not None:
+            self.capture.close()
+
+    async def _receiveLoop(self):
+        while True:
+            frame, rssi, receivedAt = await self.radio.receive()
+
+            if self.capture is not None:
+                self.capture.append(unixMs(), receivedAt, rssi, frame)
+
+            self.handleFrame(frame, rssi, receivedAt)
+
+    async def _transmitLoop(self):
+        while True:
+            frame = await self._outgoing.get()
+
+            #   A time sync packet gets network time as late as possible
+            self.timeSync.stamp(frame)
+
+            await self.radio.send(frame)
+            self.packetSentCount += 1
+
+    async def _timeSyncLoop(self):
+        while True:
+            self.timeSync.startRound()
+            await asyncio.sleep(mesh_timesync.SYNC_INTERVAL_MS / 1000)
+
+    async def _beaconLoop(self):
+        #   One beacon at the start of every superframe, on a fixed schedule
+        superframe = self.slotTable.slotMs * self.slotTable.slotCount / 1000
+        loop = asyncio.get_running_loop()
+        due = loop.time()
+
+        while True:
+            length = self.slotTable.packBeacon(self._beaconPacket, self.address)
+            self.send(memoryview(self._beaconPacket)[:length])
+
+            due += superframe
+            await asyncio.sleep(max(0, due - loop.time()))
+
+    async def _helloLoop(self):
+        while True:
+            wait = self.neighbors.run()
+            self._helloWake.clear()
+
+            try:
+                await asyncio.wait_for(self._helloWake.wait(), wait / 1000)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _housekeepingLoop(self):
+        while True:
+            await asyncio.sleep(HOUSEKEEPING_INTERVAL_MS / 1000)
+
+            now = ticksMs()
+            self.reassembler.expire(now)
+
+            if self.slotTable is not None:
+                self.slotTable.expire(now)
+
+    def handleFrame(self, packet, rssi, receivedAt, arrivedAt=None):
+        #   arrivedAt is the Unix time (ms) the frame came in, now unless it is replayed
+        #   Check the length and CRC before anything else is read from the packet
+        if not mesh_header.isValidPacket(packet):
+            self.packetRejectedCount += 1
+            return
+
+        self.packetReceivedCount += 1
+
+        transmitter = mesh_header.transmitterOf(packet)
+        self.links.heard(transmitter, rssi)
+
+        if self.neighbors.heard(transmitter, receivedAt):
+            self._helloWake.set()
+
+        if self.slotTable is not None:
+            self.slotTable.heard(transmitter, receivedAt)
+
+        #   Joins, time sync, HELLOs, route requests and route replies stop here, everything else is routed
+        if self.slotTable is not None and self.slotTable.handle(packet, receivedAt):
+            if self.verbose:
+                print("Join from node {0}, slot {1}".format(mesh_header.fromNodeOf(packet), self.slotTable.slotOf(mesh_header.fromNodeOf(packet))))
+        elif self.timeSync.handle(packet, receivedAt):
+            pass
+        elif self.neighbors.handle(packet, receivedAt):
+            self._helloWake.set()
+        elif not self.discovery.handle(packet):
+            action = self.router.inspect(packet)
+
+            if action & mesh_routing.ACTION_DELIVER:
+                self.handlePacket(packet, arrivedAt)
+
+            if action & mesh_routing.ACTION_FORWARD:
+                self.router.forward(packet)
+                self.send(packet)
+
+    def handlePacket(self, packet, arrivedAt=None):
+        sequence, fromNode, toNode, packetType, length, totalPackets, subPacketNumber = mesh_header.unpackHeader(packet)
+
+        if packetType != mesh_header.PACKET_TYPE_DATA:
+            #   The gateway sends no data of its own, so there are no ACKs for it
+            return
+
+        if arrivedAt is None:
+            arrivedAt = unixMs()
+
+        if mesh_header.isGroupAddress(toNode):
+            #   Group traffic is never acknowledged
+            self.deliver(sequence, fromNode, totalPackets, subPacketNumber, mesh_header.payloadOf(packet), arrivedAt)
+            return
+
+        if self.duplicates.isDuplicate(fromNode, sequence, False):
+            #   Seen it already, so our ACK must have been lost. The ACK says
+            #       what the ARQ receiver has, never more.
+            if fromNode in self.arqReceivers:
+                self.oweAck(fromNode)
+
+            return
+
+        arqReceiver = self.arqReceivers.get(fromNode)
+
+        if arqReceiver is None:
+            arqReceiver = mesh_arq.ArqReceiver(ARQ_WINDOW_SIZE)
+            self.arqReceivers[fromNode] = arqReceiver
+
+        if arqReceiver.receive(sequence, mesh_header.payloadOf(packet), totalPackets, subPacketNumber):
+            #   Only now seen, a packet turned away comes again
+            self.duplicates.mark(fromNode, sequence)
+            self.oweAck(fromNode)
+
+        for sequenceIn, payload in arqReceiver.deliver():
+            totalPackets, subPacketNumber = arqReceiver.fragmentOf(sequenceIn)
+            self.deliver(sequenceIn, fromNode, totalPackets, subPacketNumber, payload, arrivedAt)
+
+    def deliver(self, sequence, fromNode, totalPackets, subPacketNumber, payload, arrivedAt):
+        if totalPackets > 1:
+            payload = self.reassembler.add(fromNode, sequence, totalPackets, subPacketNumber, payload)
+
+            if payload is None:
+                #   Still waiting for the rest of the message
+                return
+
+        for record in self.decode(fromNode, sequence, payload, arrivedAt):
+            self.recordCount += 1
+
+            for runner in self.sinks:
+                runner.put(record)
+
+    def decode(self, fromNode, sequence, payload, arrivedAt):
+        #   Yields the Records in a payload
+        if not mesh_batch.isBatch(payload):
+            yield gateway_sink.Record(arrivedAt, fromNode, sequence, None, (bytes(payload),))
+            return
+
+        recordFormat = payload[0]
+        compressed = mesh_batch.COMPRESSED_FORMATS.get(recordFormat)
+        timed = compressed is not None and compressed[1]
+
+        for values in mesh_batch.decodeBatch(payload):
+            if timed:
+                yield gateway_sink.Record(self.unixTimeOf(values[0], arrivedAt), fromNode, sequence, recordFormat, values[1:])
+            else:
+                yield gateway_sink.Record(arrivedAt, fromNode, sequence, recordFormat, values)
+
+    def unixTimeOf(self, sampleTime, arrivedAt):
+        #   The Unix time (ms) of a network time, the one nearest arrivedAt
+        offset = mesh_timesync.networkDiff(sampleTime, arrivedAt % mesh_timesync.NETWORK_TIME_MODULO)
+
+        if abs(offset) > MAX_SAMPLE_AGE_MS:
+            self.untimedCount += 1
+            return arrivedAt
+
+        return arrivedAt + offset
+
+    def oweAck(self, toNode):
+        self.acksOwed.add(toNode)
+
+        if self._ackTimer is None:
+            self._ackTimer = asyncio.get_running_loop().call_later(ACK_DELAY_MS / 1000, self.sendAcks)
+
+    def sendAcks(self):
+        #   One cumulative ACK for each node we owe one
+        self._ackTimer = None
+
+        for toNode in self.acksOwed:
+            ackSequence, bitmap = self.arqReceivers[toNode].ackState()
+            length = mesh_header.packPacket(self._ackPacket, (ackSequence - 1) % mesh_arq.SEQUENCE_MODULO, self.address, toNode, mesh_header.PACKET_TYPE_ACK, route=self.router.routeTo(toNode), ack=(ackSequence, bitmap))
+
+            if self.send(memoryview(self._ackPacket)[:length]):
+                self.ackPacketsSent += 1
+
+        self.acksOwed.clear()
+
+    def stats(self):
+        return {
+            "received": self.packetReceivedCount,
+            "rejected": self.packetRejectedCount,
+            "sent": self.packetSentCount,
+            "acks": self.ackPacketsSent,
+            "records": self.recordCount,
+            "captured": self.capture.count if self.capture is not None else 0,
+            "untimed": self.untimedCount,
+            "outgoingDropped": self.outgoingDroppedCount,
+            "backlog": self._outgoing.qsize() if self._outgoing is not None else 0,
+            "nodes": len(self.arqReceivers),
+            "sinkDropped": sum(runner.droppedCount for runner in self.sinks),
+            "sinkBacklog": sum(runner.backlog() for runner in self.sinks),
+            "sinks": {type(runner.sink).__name__: runner.sink.stats() for runner in self.sinks if hasattr(runner.sink, "stats")},
+        }
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Gateway for the RFM69 mesh network")
+    parser.add_argument("--address", type=int, default=DEFAULT_ADDRESS, help="network address of the gateway")
+    parser.add_argument("--frequency", type=float, default=gateway_radio.DEFAULT_FREQUENCY_MHZ, help="radio frequency in MHz, must match the nodes")
+    parser.add_argument("--spi-bus", type=int, default=gateway_radio.DEFAULT_SPI_BUS)
+    parser.add_argument("--spi-device", type=int, default=gateway_radio.DEFAULT_SPI_DEVICE)
+    parser.add_argument("--reset-pin", type=int, default=gateway_radio.DEFAULT_RESET_PIN, help="BCM pin wired to the radio's RST")
+    parser.add_argument("--dio0-pin", type=int, default=gateway_radio.DEFAULT_DIO0_PIN, help="BCM pin wired to the radio's DIO0")
+    parser.add_argument("--tx-power", type=int, default=gateway_radio.DEFAULT_TX_POWER, help="dBm")
+    parser.add_argument("--key", type=bytes.fromhex, default=gateway_radio.DEFAULT_ENCRYPTION_KEY, help="AES key in hex, the nodes' encryption_key")
+    parser.add_argument("--no-encryption", action="store_true", help="for nodes with encryption off")
+    parser.add_argument("--no-tdma", action="store_true", help="do not send TDMA beacons")
+    parser.add_argument("--group", type=lambda text: int(text, 0), action="append", default=[], help="multicast group to receive, e.g. 0xFF01")
+    parser.add_argument("--jsonl", help="append records to this JSON lines file")
+    parser.add_argument("--sqlite", help="write records to this SQLite database")
+    parser.add_argument("--capture", help="keep every raw frame received in this ring file")
+    parser.add_argument("--capture-records", type=int, default=gateway_capture.DEFAULT_CAPACITY, help="frames the capture file holds")
+    parser.add_argument("--quiet", action="store_true", help="do not print records")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between statistics lines, 0 for none")
+    parser.add_argument("--simulate", type=int, default=0, metavar="NODES", help="run on a simulated radio with this many simulated nodes")
+    parser.add_argument("--loss", type=float, default=0.0, help="frame loss rate of the simulated channel")
+    parser.add_argument("--verbose", action="store_true")
+
+    return parser.parse_args(argv)
+
+def makeSinks(arguments):
+    sinks = []
+
+    if not arguments.quiet:
+        sinks.append(gateway_sink.PrintSink())
+
+    if arguments.jsonl:
+        sinks.append(gateway_sink.JsonLinesSink(arguments.jsonl))
+
+    if arguments.sqlite:
+        sinks.append(gateway_sink.SqliteSink(arguments.sqlite))
+
+    return sinks
+
+async def printStats(gateway, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print("Gateway: {0}".format(gateway.stats()), file=sys.stderr)
+
+async def main(argv=None):
+    arguments = parseArguments(argv)
+    simulatedNodes = []
+
+    if arguments.simulate:
+        import gateway_sim
+
+        channel = gateway_radio.SimulatedChannel(lossRate=arguments.loss)
+        radio = gateway_radio.SimulatedRadio(channel)
+        simulatedNodes = gateway_sim.makeNodes(channel, arguments.simulate, arguments.address)
+    else:
+        radio = gateway_radio.Rfm69Radio(arguments.frequency, arguments.spi_bus, arguments.spi_device, arguments.reset_pin, arguments.dio0_pin, arguments.tx_power, encryptionKey=None if arguments.no_encryption else arguments.key)
+
+    slotTable = None if arguments.no_tdma else mesh_tdma.SlotTable()
+    capture = gateway_capture.CaptureRing(arguments.capture, arguments.capture_records) if arguments.capture else None
+    gateway = Gateway(radio, arguments.address, makeSinks(arguments), slotTable, arguments.group, arguments.verbose, capture)
+
+    tasks = [asyncio.ensure_future(gateway.run())]
+    tasks.extend(asyncio.ensure_future(node.run()) for node in simulatedNodes)
+
+    if arguments.stats_interval > 0:
+        tasks.append(asyncio.ensure_future(printStats(gateway, arguments.stats_interval)))
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await gateway.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
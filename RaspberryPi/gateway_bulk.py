@@ -0,0 +1,459 @@
+#
+#   Bulk decoding of captured frames with NumPy, for analysis off the radio path
+#
+#   Decoding a frame at a time in Python, the way the nodes and the gateway do,
+#       takes tens of microseconds per frame. For a capture of months of traffic
+#       this module decodes every frame at once instead, column by column:
+#
+#       - frameDtype() is a structured dtype over a fixed width slot holding a
+#         frame. Its big endian fields sit at the mesh_header offsets (sequence,
+#         fromNode, toNode, type, length, totalPackets, subPacket), so a buffer of
+#         frames, or a whole gateway_capture file (captureDtype()), is viewed as
+#         an array without copying anything.
+#       - validFrames() is isValidPacket() for all of them: the length checks,
+#         and the CRC, two byte positions at a time across every frame.
+#       - decodeSamples() finds the DATA frames carrying a batch of one record
+#         format, drops repeated (fromNode, sequence) pairs, and turns the fixed
+#         point records into readings, one channel column at a time.
+#
+#   Delta compressed blocks (mesh_compress), what the nodes send, are bit packed
+#       with widths that change from block to block. Every difference in every
+#       block is still decoded at once: its bit position follows from its
+#       block's widths, it is read out of the three bytes it starts in, and a
+#       running sum down each block turns the differences back into samples.
+#       Fragmented messages need reassembling, so they are not decoded here;
+#       decodeSamples() counts them, and gateway_replay decodes them the slow
+#       way.
+#
+#   NumPy is only needed for this module:
+#
+#       pip3 install numpy
+#       python3 gateway_bulk.py capture.bin --npz samples.npz
+#
+import argparse
+import struct
+import sys
+import time
+
+import gateway_path
+import mesh_batch
+import mesh_compress
+import mesh_header
+import mesh_sensor
+import mesh_timesync
+
+import gateway
+import gateway_capture
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#   Channels of the fixed size record formats: (NumPy type of a raw value,
+#       ((name, unit, scale), ...)). A value is the raw one divided by its scale.
+FIXED_FORMATS = {
+    mesh_batch.RECORD_ORIENTATION: (">f4", (("roll", "degrees", 1), ("pitch", "degrees", 1), ("heading", "degrees", 1))),
+    mesh_batch.RECORD_IMU_V1: (">i2", mesh_sensor.IMU_V1_CHANNELS),
+}
+
+#   Channels of the delta compressed formats, and whether their samples are timed
+DELTA_FORMATS = {
+    mesh_batch.RECORD_IMU_V1_DELTA: (mesh_sensor.IMU_V1_CHANNELS, False),
+    mesh_batch.RECORD_IMU_V1_TIMED_DELTA: (mesh_sensor.IMU_V1_CHANNELS, True),
+}
+
+#   Delta blocks decoded at once
+DELTA_CHUNK_BLOCKS = 65536
+
+def _requireNumpy():
+    if numpy is None:
+        raise ImportError("gateway_bulk needs NumPy: pip3 install numpy")
+
+def _headerFields(offset):
+    return [
+        ("sequence", ">u4", offset + mesh_header.OFFSET_SEQUENCE),
+        ("fromNode", ">u2", offset + mesh_header.OFFSET_FROM_NODE),
+        ("toNode", ">u2", offset + mesh_header.OFFSET_TO_NODE),
+        ("type", "u1", offset + mesh_header.OFFSET_TYPE),
+        ("length", "u1", offset + mesh_header.OFFSET_LENGTH),
+        ("totalPackets", "u1", offset + mesh_header.OFFSET_TOTAL_PACKETS),
+        ("subPacket", "u1", offset + mesh_header.OFFSET_SUB_PACKET),
+    ]
+
+def _dtype(fields, itemsize):
+    names, formats, offsets = zip(*fields)
+
+    return numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": itemsize})
+
+def frameDtype(stride=gateway_capture.MAX_FRAME_SIZE):
+    #   One frame at the start of every stride bytes
+    _requireNumpy()
+
+    return _dtype(_headerFields(0), stride)
+
+def captureDtype():
+    #   One gateway_capture record, with the header of the frame in it. The
+    #       capture's own fields are captureSequence, time, receivedAt,
+    #       rssiHalfDbm (the RSSI times 2) and frameLength.
+    _requireNumpy()
+
+    fields = [
+        ("captureSequence", ">u4", 0),
+        ("time", ">u8", 4),
+        ("receivedAt", ">u4", 12),
+        ("rssiHalfDbm", ">i2", 16),
+        ("frameLength", "u1", 18),
+    ]
+
+    return _dtype(fields + _headerFields(gateway_capture.RECORD_HEADER_SIZE), gateway_capture.RECORD_SIZE)
+
+def viewFrames(buffer, stride=gateway_capture.MAX_FRAME_SIZE):
+    #   A structured array over a buffer of frames, each in a slot of stride
+    #       bytes. Their lengths come from the header, there is no frameLength.
+    _requireNumpy()
+
+    return numpy.frombuffer(buffer, dtype=frameDtype(stride))
+
+def loadCapture(path):
+    #   A capture file's records, the oldest first. A view of the file while it
+    #       has not wrapped around, a copy after.
+    _requireNumpy()
+
+    header = numpy.fromfile(path, dtype=numpy.uint8, count=gateway_capture.HEADER_SIZE).tobytes()
+    magic, version, recordSize, capacity, count = struct.unpack_from(gateway_capture.HEADER_FORMAT, header, 0)
+
+    if magic != gateway_capture.MAGIC or version != gateway_capture.VERSION or recordSize != gateway_capture.RECORD_SIZE:
+        raise ValueError("{0} is not a version {1} capture".format(path, gateway_capture.VERSION))
+
+    records = numpy.memmap(path, dtype=captureDtype(), mode="r", offset=gateway_capture.HEADER_SIZE, shape=(capacity,))
+
+    if count <= capacity:
+        return records[:count]
+
+    #   Joined as bytes, concatenate() would pack the records' fields together
+    start = count % capacity
+    raw = records.view(numpy.uint8).reshape(capacity, gateway_capture.RECORD_SIZE)
+
+    return numpy.concatenate((raw[start:], raw[:start])).view(captureDtype()).reshape(capacity)
+
+def _frameOffset(frames):
+    #   Where the frame starts in each slot
+    return frames.dtype.fields["sequence"][1]
+
+def _bytesOf(frames):
+    #   The slots as rows of bytes, the same memory
+    return numpy.ascontiguousarray(frames).view(numpy.uint8).reshape(len(frames), frames.dtype.itemsize)
+
+_crcTables = None
+
+def _crcTablesOf():
+    #   mesh_header.CRC_TABLE, and the same for two bytes at once: for a 16 bit
+    #       CRC the next two bytes simply replace the register, so
+    #       crc = table16[crc ^ (byte0 << 8 | byte1)]. Made on first use.
+    global _crcTables
+
+    if _crcTables is None:
+        crc = numpy.arange(1 << 16, dtype=numpy.uint32)
+
+        for _ in range(16):
+            crc = numpy.where(crc & 0x8000, (crc << 1) ^ mesh_header.CRC_POLYNOMIAL, crc << 1) & 0xFFFF
+
+        _crcTables = numpy.array(mesh_header.CRC_TABLE, dtype=numpy.uint16), crc.astype(numpy.uint16)
+
+    return _crcTables
+
+def validFrames(frames):
+    #   A mask of the frames that pass mesh_header.isValidPacket()
+    _requireNumpy()
+
+    rows = _bytesOf(frames)
+    start = _frameOffset(frames)
+    room = frames.dtype.itemsize - start
+    length = frames["length"].astype(numpy.intp)
+
+    valid = (length >= mesh_header.HEADER_SIZE + mesh_header.CRC_SIZE) & (length <= room)
+
+    if "frameLength" in frames.dtype.names:
+        valid &= length == frames["frameLength"]
+
+    packetType = frames["type"]
+    payloadStart = mesh_header.HEADER_SIZE + numpy.where(packetType & mesh_header.FLAG_ROUTED, mesh_header.ROUTE_SIZE, 0) + numpy.where(packetType & mesh_header.FLAG_ACK, mesh_header.ACK_SIZE, 0)
+    valid &= length >= payloadStart + mesh_header.CRC_SIZE
+
+    #   The CRC of every frame at once, two byte positions at a time, then the
+    #       odd last byte. Longest first, so the frames still going at a
+    #       position are always the first ones.
+    table, table16 = _crcTablesOf()
+    covered = numpy.where(valid, length - mesh_header.CRC_SIZE, 0)
+    #   A stable sort of one byte keys is a radix sort
+    order = numpy.argsort((255 - covered).astype(numpy.uint8), kind="stable")
+    covered = covered[order]
+    longest = int(covered[0]) if len(frames) else 0
+
+    #   Each frame's bytes as big endian pairs, a row per pair position
+    width = 2 * ((longest + 1) // 2)
+    words = numpy.ascontiguousarray(numpy.ascontiguousarray(rows[order, start:start + width]).view(">u2").T, dtype=numpy.uint16)
+    going = numpy.searchsorted(-covered, -numpy.arange(2, longest + 1, 2), side="right")
+    crc = numpy.full(len(frames), mesh_header.CRC_INITIAL, dtype=numpy.uint16)
+
+    for pair, count in enumerate(going):
+        crc[:count] = table16[crc[:count] ^ words[pair, :count]]
+
+    odd = numpy.flatnonzero(covered & 1)
+    last = words[covered[odd] // 2, odd] >> 8
+    crc[odd] = (crc[odd] << 8) ^ table[(crc[odd] >> 8) ^ last]
+
+    #   Back in frame order
+    crc[order] = crc.copy()
+
+    index = numpy.arange(len(frames))
+    end = start + numpy.maximum(length, mesh_header.CRC_SIZE)
+    sent = (rows[index, numpy.minimum(end - 2, frames.dtype.itemsize - 1)].astype(numpy.uint16) << 8) | rows[index, numpy.minimum(end - 1, frames.dtype.itemsize - 1)]
+
+    return valid & (crc == sent)
+
+def _blockWidths(rows, members, widthOffset, channelCount):
+    #   The bit width of each channel's differences in the delta blocks of
+    #       members, a row per block
+    nibbles = rows[members[:, None], widthOffset[:, None] + numpy.arange(channelCount) // 2].astype(numpy.intp)
+    nibbles = numpy.where(numpy.arange(channelCount) & 1, nibbles & 0x0F, nibbles >> 4)
+
+    return numpy.where(nibbles == mesh_compress.WIDTH_16, 16, nibbles)
+
+def _segmentSums(values, offsets, perFrame):
+    #   The running sum of values down each frame's rows, starting over at
+    #       every frame
+    sums = numpy.cumsum(values, axis=0)
+    before = numpy.zeros((len(offsets),) + values.shape[1:], dtype=sums.dtype)
+    before[offsets > 0] = sums[offsets[offsets > 0] - 1]
+
+    return sums - numpy.repeat(before, perFrame, axis=0)
+
+def _unpackBlocks(rows, members, firstOffset, widths, perFrame, timed):
+    #   Decodes the delta blocks of members, mesh_compress.unpackBlock() for all
+    #       of them at once. Returns the raw values, a row per channel, and the
+    #       network time of every sample of a timed block (None otherwise).
+    lastByte = rows.shape[1] - 1
+    channelCount = widths.shape[1]
+    total = int(perFrame.sum())
+    offsets = numpy.cumsum(perFrame) - perFrame
+    values = numpy.empty((total, channelCount), dtype=numpy.int64)
+
+    #   The first sample in full, big endian int16
+    firstBytes = rows[members[:, None], firstOffset[:, None] + numpy.arange(2 * channelCount)].astype(numpy.int64)
+    values[offsets] = (firstBytes[:, 0::2] << 8) | firstBytes[:, 1::2]
+
+    #   Every later sample's differences, each at its own bit position: (sample
+    #       - 1) * bits per sample + the widths of the channels before it
+    steps = perFrame - 1
+    block = numpy.repeat(numpy.arange(len(members)), steps)
+    sample = numpy.arange(len(block)) - numpy.repeat(numpy.cumsum(steps) - steps, steps) + 1
+    bitsPerSample = widths.sum(axis=1)
+    bitStart = (firstOffset + 2 * channelCount + (channelCount + 1) // 2) * 8
+    bit = (bitStart[block] + (sample - 1) * bitsPerSample[block])[:, None] + (numpy.cumsum(widths, axis=1) - widths)[block]
+    width = widths[block]
+
+    #   A difference is at most 16 bits, so always within the three bytes from
+    #       where it starts. Bytes past the end of the slot are shifted out.
+    byte = bit >> 3
+    row = members[block][:, None]
+    window = (rows[row, numpy.minimum(byte, lastByte)].astype(numpy.int64) << 16) | (rows[row, numpy.minimum(byte + 1, lastByte)].astype(numpy.int64) << 8) | rows[row, numpy.minimum(byte + 2, lastByte)]
+    zigzag = (window >> (24 - (bit & 7) - width)) & ((1 << width) - 1)
+    values[offsets[block] + sample] = (zigzag >> 1) ^ -(zigzag & 1)
+
+    raw = _segmentSums(values, offsets, perFrame) & 0xFFFF
+    raw = numpy.ascontiguousarray(raw.T).astype(numpy.uint16).view(numpy.int16)
+
+    if not timed:
+        return raw, None
+
+    #   Channel 0 is the milliseconds since the sample before, from the time of
+    #       the first one
+    intervals = raw[0].astype(numpy.int64) & 0xFFFF
+    blockBytes = rows[members[:, None], firstOffset[:, None] - mesh_compress.TIMESTAMP_SIZE + numpy.arange(mesh_compress.TIMESTAMP_SIZE)].astype(numpy.int64)
+    intervals[offsets] = (blockBytes[:, 0] << 24) | (blockBytes[:, 1] << 16) | (blockBytes[:, 2] << 8) | blockBytes[:, 3]
+    networkTime = (_segmentSums(intervals, offsets, perFrame) % mesh_timesync.NETWORK_TIME_MODULO).astype(numpy.uint32)
+
+    return raw[1:], networkTime
+
+def decodeSamples(frames, recordFormat=mesh_batch.RECORD_IMU_V1_TIMED_DELTA, valid=None):
+    #   Returns (samples, counts). samples is a dict of columns, one row per
+    #       record of recordFormat in the valid, unfragmented, first copies of
+    #       DATA frames, in the order the frames came: node, sequence, index (in
+    #       the batch), time (of arrival, for a capture) and one float column per
+    #       channel, in its unit. A timed format adds networkTime, and for a
+    #       capture sampleTime, the Unix time (ms) the gateway would give it.
+    #       counts says how many frames were decoded, repeated or fragmented,
+    #       and how many batches of each record format there were.
+    _requireNumpy()
+
+    compressed = recordFormat in DELTA_FORMATS
+
+    if compressed:
+        channels, timed = DELTA_FORMATS[recordFormat]
+        rawType = numpy.dtype(numpy.int16)
+    else:
+        rawType, channels = FIXED_FORMATS[recordFormat]
+        rawType = numpy.dtype(rawType)
+        recordSize = rawType.itemsize * len(channels)
+
+    if valid is None:
+        valid = validFrames(frames)
+
+    rows = _bytesOf(frames)
+    start = _frameOffset(frames)
+    lastByte = frames.dtype.itemsize - 1
+    packetType = frames["type"]
+    length = frames["length"].astype(numpy.intp)
+
+    payloadStart = start + mesh_header.HEADER_SIZE + numpy.where(packetType & mesh_header.FLAG_ROUTED, mesh_header.ROUTE_SIZE, 0) + numpy.where(packetType & mesh_header.FLAG_ACK, mesh_header.ACK_SIZE, 0)
+    payloadLength = start + length - mesh_header.CRC_SIZE - payloadStart
+
+    data = valid & ((packetType & mesh_header.TYPE_MASK) == mesh_header.PACKET_TYPE_DATA) & (payloadLength >= mesh_batch.BATCH_HEADER_SIZE)
+    index = numpy.arange(len(frames))
+    formatId = numpy.where(data, rows[index, numpy.minimum(payloadStart, lastByte)], 0)
+    recordCount = numpy.where(data, rows[index, numpy.minimum(payloadStart + 1, lastByte)], 0).astype(numpy.intp)
+
+    fragmented = data & (frames["totalPackets"] > 1)
+    batches = data & ~fragmented & (recordCount > 0)
+    selected = batches & (formatId == recordFormat)
+
+    if compressed:
+        #   The size mesh_compress.isBlock() checks, from each block's widths
+        channelCount = len(channels) + (1 if timed else 0)
+        members = numpy.flatnonzero(selected)
+        firstOffset = payloadStart[members] + mesh_compress.BLOCK_HEADER_SIZE + (mesh_compress.TIMESTAMP_SIZE if timed else 0)
+        headerSize = firstOffset - payloadStart[members] + 2 * channelCount + (channelCount + 1) // 2
+        fits = payloadLength[members] >= headerSize
+        members, firstOffset, headerSize = members[fits], firstOffset[fits], headerSize[fits]
+        widths = _blockWidths(rows, members, firstOffset + 2 * channelCount, channelCount)
+        size = headerSize + ((recordCount[members] - 1) * widths.sum(axis=1) + 7) // 8
+
+        selected[:] = False
+        selected[members[payloadLength[members] == size]] = True
+    else:
+        selected &= payloadLength == mesh_batch.BATCH_HEADER_SIZE + recordCount * recordSize
+
+    #   The first copy of every (fromNode, sequence), in capture order
+    candidates = numpy.flatnonzero(selected)
+    nodes = frames["fromNode"][candidates]
+    sequences = frames["sequence"][candidates]
+    _, first = numpy.unique((nodes.astype(numpy.uint64) << 32) | sequences, return_index=True)
+    first.sort()
+    chosen = candidates[first]
+
+    batchFormats, batchCounts = numpy.unique(formatId[batches], return_counts=True)
+
+    counts = {
+        "frames": len(frames),
+        "valid": int(valid.sum()),
+        "decoded": len(chosen),
+        "repeated": len(candidates) - len(chosen),
+        "fragmented": int(fragmented.sum()),
+        "formats": {int(batchFormat): int(count) for batchFormat, count in zip(batchFormats, batchCounts)},
+    }
+
+    #   Where each frame's records go
+    perFrame = recordCount[chosen]
+    total = int(perFrame.sum())
+    offsets = numpy.cumsum(perFrame) - perFrame
+
+    samples = {
+        "node": numpy.repeat(nodes[first].astype(numpy.uint16), perFrame),
+        "sequence": numpy.repeat(sequences[first].astype(numpy.uint32), perFrame),
+        "index": (numpy.arange(total) - numpy.repeat(offsets, perFrame)).astype(numpy.uint8),
+    }
+
+    if "time" in frames.dtype.names:
+        samples["time"] = numpy.repeat(frames["time"][chosen].astype(numpy.uint64), perFrame)
+
+    if compressed:
+        raw = numpy.empty((len(channels), total), dtype=numpy.int16)
+        networkTime = numpy.empty(total, dtype=numpy.uint32) if timed else None
+        blockOf = numpy.searchsorted(members, chosen)
+
+        #   A bounded number of blocks at a time, the bit positions of every
+        #       difference take a lot of memory
+        for begin in range(0, len(chosen), DELTA_CHUNK_BLOCKS):
+            part = blockOf[begin:begin + DELTA_CHUNK_BLOCKS]
+            partCounts = perFrame[begin:begin + DELTA_CHUNK_BLOCKS]
+            rowsFrom = int(offsets[begin])
+            rowsTo = rowsFrom + int(partCounts.sum())
+            partRaw, partTime = _unpackBlocks(rows, members[part], firstOffset[part], widths[part], partCounts, timed)
+            raw[:, rowsFrom:rowsTo] = partRaw
+
+            if timed:
+                networkTime[rowsFrom:rowsTo] = partTime
+
+        if timed:
+            samples["networkTime"] = networkTime
+
+            if "time" in samples:
+                #   Nearest the arrival, unless that is too far off to trust
+                arrivedAt = samples["time"].astype(numpy.int64)
+                offset = (networkTime.astype(numpy.int64) - arrivedAt + mesh_timesync.NETWORK_TIME_MODULO // 2) % mesh_timesync.NETWORK_TIME_MODULO - mesh_timesync.NETWORK_TIME_MODULO // 2
+                samples["sampleTime"] = numpy.where(numpy.abs(offset) > gateway.MAX_SAMPLE_AGE_MS, arrivedAt, arrivedAt + offset).astype(numpy.uint64)
+    else:
+        #   Frames with the same payload start and record count have their
+        #       records in the same columns, so each such group is copied out as
+        #       one block
+        raw = numpy.empty((total, len(channels)), dtype=rawType)
+        groupKey = payloadStart[chosen] * 256 + perFrame
+        order = numpy.argsort(groupKey, kind="stable")
+        boundaries = numpy.flatnonzero(numpy.diff(groupKey[order])) + 1
+
+        for group in numpy.split(order, boundaries):
+            if len(group) == 0:
+                continue
+
+            members = chosen[group]
+            begin = int(payloadStart[members[0]]) + mesh_batch.BATCH_HEADER_SIZE
+            count = int(perFrame[group[0]])
+
+            block = numpy.ascontiguousarray(rows[members, begin:begin + count * recordSize])
+            targets = (offsets[group, None] + numpy.arange(count)).ravel()
+            raw[targets] = block.view(rawType).reshape(len(members) * count, len(channels))
+
+        #   A row per channel, in the machine's byte order
+        raw = numpy.ascontiguousarray(raw.T, dtype=rawType.newbyteorder("="))
+
+    for column, (name, unit, scale) in enumerate(channels):
+        samples[name] = raw[column] / scale
+
+    return samples, counts
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Decode a gateway capture in bulk with NumPy")
+    parser.add_argument("capture", help="gateway_capture file")
+    parser.add_argument("--format", type=int, default=mesh_batch.RECORD_IMU_V1_TIMED_DELTA, choices=sorted(list(FIXED_FORMATS) + list(DELTA_FORMATS)), help="record format to decode")
+    parser.add_argument("--npz", help="save the samples to this .npz file")
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parseArguments(argv)
+
+    startedAt = time.perf_counter()
+    frames = loadCapture(arguments.capture)
+    samples, counts = decodeSamples(frames, arguments.format)
+    elapsed = time.perf_counter() - startedAt
+
+    formats = counts.pop("formats")
+
+    for name, value in counts.items():
+        print("{0}: {1}".format(name, value))
+
+    for recordFormat, count in sorted(formats.items()):
+        print("format {0}: {1} batches".format(recordFormat, count))
+
+    print("samples: {0}".format(len(samples["node"])))
+    print("seconds: {0:.3f}".format(elapsed))
+
+    if arguments.npz:
+        numpy.savez(arguments.npz, **samples)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#
+#   Raw frame capture, into a fixed size memory mapped ring file
+#
+#   Every frame the radio hands the gateway, valid or not, goes into the ring
+#       with the time it arrived and its RSSI, for debugging and replay. The
+#       file is mapped once when the capture opens, and append() only packs the
+#       record into the mapping, there is no write() or any other system call
+#       per frame. The kernel writes the pages back on its own, so a gateway that
+#       crashes loses nothing, only a power cut can lose what it has not written
+#       yet (flush() forces it).
+#
+#   The file is a HEADER_SIZE header, then capacity records of RECORD_SIZE:
+#
+#       header  magic, version, record size, capacity, then the number of
+#               records ever appended (the next one goes to count % capacity)
+#       record  sequence        low 32 bits of its number, to tell a record
+#                               from an older one in the same place
+#               time            Unix time in ms
+#               receivedAt      mesh_clock ticks
+#               rssi            in half dBm, the RFM69's resolution
+#               length          of the frame, at most MAX_FRAME_SIZE
+#               frame           MAX_FRAME_SIZE bytes, the frame then padding
+#
+#   A capture opened again carries on where it stopped, unless its capacity
+#       changed, then it starts over. Read it, while the gateway runs or after,
+#       with CaptureReader, or
+#
+#       python3 gateway_capture.py capture.bin
+#
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"MESHCAP1"
+VERSION = 2
+
+HEADER_FORMAT = ">8sHHIQ"
+HEADER_SIZE = 64
+OFFSET_COUNT = 16
+
+RECORD_HEADER_FORMAT = ">IQIhB3x"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+
+#   The RFM69 FIFO, no frame is longer
+MAX_FRAME_SIZE = 66
+
+RECORD_SIZE = RECORD_HEADER_SIZE + MAX_FRAME_SIZE
+
+#   About 5.8 MB
+DEFAULT_CAPACITY = 65536
+
+SEQUENCE_MASK = 0xFFFFFFFF
+
+def _mapSize(capacity):
+    return HEADER_SIZE + capacity * RECORD_SIZE
+
+class CaptureRing:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            size = _mapSize(capacity)
+            fresh = os.fstat(fd).st_size != size
+
+            if fresh:
+                os.ftruncate(fd, size)
+
+            self._map = mmap.mmap(fd, size)
+        finally:
+            #   The mapping keeps its own reference to the file
+            os.close(fd)
+
+        magic, version, recordSize, fileCapacity, count = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+
+        if fresh or magic != MAGIC or version != VERSION or recordSize != RECORD_SIZE or fileCapacity != capacity:
+            count = 0
+            struct.pack_into(HEADER_FORMAT, self._map, 0, MAGIC, VERSION, RECORD_SIZE, capacity, count)
+
+        self.count = count
+        self.truncatedCount = 0
+
+    def append(self, time, receivedAt, rssi, frame):
+        length = len(frame)
+
+        if length > MAX_FRAME_SIZE:
+            self.truncatedCount += 1
+            length = MAX_FRAME_SIZE
+
+        offset = HEADER_SIZE + (self.count % self.capacity) * RECORD_SIZE
+        struct.pack_into(RECORD_HEADER_FORMAT, self._map, offset, self.count & SEQUENCE_MASK, time, receivedAt, int(round(rssi * 2)), length)
+
+        frameOffset = offset + RECORD_HEADER_SIZE
+        self._map[frameOffset:frameOffset + length] = frame[:length]
+
+        #   The count last, a reader never sees a record before it is whole
+        self.count += 1
+        struct.pack_into(">Q", self._map, OFFSET_COUNT, self.count)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
+
+class CaptureReader:
+    #   Reads a capture, also one a gateway is still appending to. records()
+    #       yields (time, receivedAt, rssi, frame) from the oldest to the newest,
+    #       rssi in dBm and frame a memoryview into the mapping, to be released
+    #       before close(). A record the gateway has already overwritten is
+    #       skipped (counted in skippedCount).
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._map)
+        magic, version, recordSize, self.capacity, _ = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+
+        if magic != MAGIC or version != VERSION or recordSize != RECORD_SIZE:
+            self.close()
+            raise ValueError("{0} is not a version {1} capture".format(path, VERSION))
+
+        self.skippedCount = 0
+
+    def count(self):
+        #   Records ever appended
+        return struct.unpack_from(">Q", self._map, OFFSET_COUNT)[0]
+
+    def __len__(self):
+        return min(self.count(), self.capacity)
+
+    def records(self):
+        end = self.count()
+        unpack = struct.Struct(RECORD_HEADER_FORMAT).unpack_from
+        view = self._view
+
+        for number in range(max(0, end - self.capacity), end):
+            offset = HEADER_SIZE + (number % self.capacity) * RECORD_SIZE
+            sequence, time, receivedAt, halfDbm, length = unpack(view, offset)
+
+            if sequence != number & SEQUENCE_MASK:
+                self.skippedCount += 1
+                continue
+
+            frameOffset = offset + RECORD_HEADER_SIZE
+            yield time, receivedAt, halfDbm / 2, view[frameOffset:frameOffset + length]
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if len(argv) != 1:
+        print("usage: gateway_capture.py CAPTURE", file=sys.stderr)
+        return 2
+
+    reader = CaptureReader(argv[0])
+
+    try:
+        for time, receivedAt, rssi, frame in reader.records():
+            print("{0} {1} {2} {3}".format(time, receivedAt, rssi, frame.hex()))
+            frame.release()
+    finally:
+        reader.close()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
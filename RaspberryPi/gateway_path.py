@@ -0,0 +1,14 @@
+#
+#   Makes the mesh_* modules in ../Circuitpython importable
+#
+#   The gateway speaks the same protocol as the nodes by running the very same
+#       modules, so there is one copy of the header codec, the ARQ and the rest.
+#       Import this before any of them.
+#
+import os
+import sys
+
+CIRCUITPYTHON_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Circuitpython"))
+
+if CIRCUITPYTHON_DIR not in sys.path:
+    sys.path.insert(0, CIRCUITPYTHON_DIR)
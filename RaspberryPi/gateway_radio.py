@@ -0,0 +1,435 @@
+#
+#   Radio backends for the gateway
+#
+#   Every backend has the same asyncio interface:
+#
+#       await radio.start()
+#       frame, rssi, receivedAt = await radio.receive()
+#       await radio.send(frame)
+#       radio.close()
+#
+#   Frames are mesh frames, starting with the 12 byte mesh header. receivedAt is
+#       mesh_clock ticks, taken as the frame came off the radio.
+#
+#   Rfm69Radio drives an RFM69 on the Pi's SPI bus. It is set up the way
+#       adafruit_rfm69 sets up the nodes' radios (250 kbit/s FSK, sync word
+#       0x2D 0xD4, variable length packets with the radio's own CRC, AES-128
+#       with the nodes' encryption_key) and adds and strips the same 4 byte
+#       RadioHead header, so the two interoperate. The key must be the one the
+#       nodes set, encryptionKey=None only talks to nodes with encryption off.
+#       The DIO0 pin raises an interrupt for PayloadReady while receiving and
+#       PacketSent while transmitting. The interrupt callback runs on RPi.GPIO's
+#       own thread and only sets an asyncio event, everything else happens on
+#       the event loop. spidev and RPi.GPIO are only needed for this backend.
+#
+#   SimulatedRadio is a radio on a SimulatedChannel, shared by any number of
+#       them in one process. A frame takes its airtime on the channel, one at a
+#       time, and reaches every other radio, minus a configurable loss rate. It
+#       needs nothing but the standard library.
+#
+import asyncio
+import random
+import time
+
+import gateway_path
+from mesh_clock import ticksMs
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+
+#   The RFM69 FIFO is 66 bytes, including the length byte
+FIFO_SIZE = 66
+
+#   to, from, id, flags, in front of the data on air (see adafruit_rfm69)
+RADIOHEAD_HEADER_SIZE = 4
+RADIOHEAD_BROADCAST = 0xFF
+
+#   Adafruit RFM69 Bonnet wiring: chip select on CE1, reset on GPIO 25, DIO0 on GPIO 22
+DEFAULT_SPI_BUS = 0
+DEFAULT_SPI_DEVICE = 1
+DEFAULT_RESET_PIN = 25
+DEFAULT_DIO0_PIN = 22
+DEFAULT_SPI_SPEED_HZ = 4000000
+
+DEFAULT_FREQUENCY_MHZ = 915.0
+DEFAULT_TX_POWER = 13
+
+#   The rfm69.encryption_key of the node scripts
+DEFAULT_ENCRYPTION_KEY = b"\x01\x02\x03\x04\x05\x06\x07\x08\x01\x02\x03\x04\x05\x06\x07\x08"
+ENCRYPTION_KEY_SIZE = 16
+
+#   How long a transmission may take before the radio is reset to receive (s)
+TRANSMIT_TIMEOUT_S = 0.1
+
+_REG_FIFO = 0x00
+_REG_OP_MODE = 0x01
+_REG_DATA_MOD = 0x02
+_REG_BITRATE_MSB = 0x03
+_REG_FDEV_MSB = 0x05
+_REG_FRF_MSB = 0x07
+_REG_VERSION = 0x10
+_REG_PA_LEVEL = 0x11
+_REG_RX_BW = 0x19
+_REG_RSSI_VALUE = 0x24
+_REG_DIO_MAPPING1 = 0x25
+_REG_IRQ_FLAGS1 = 0x27
+_REG_IRQ_FLAGS2 = 0x28
+_REG_PREAMBLE_MSB = 0x2C
+_REG_SYNC_CONFIG = 0x2E
+_REG_SYNC_VALUE1 = 0x2F
+_REG_PACKET_CONFIG1 = 0x37
+_REG_PAYLOAD_LENGTH = 0x38
+_REG_FIFO_THRESH = 0x3C
+_REG_PACKET_CONFIG2 = 0x3D
+_REG_AES_KEY1 = 0x3E
+_REG_TEST_DAGC = 0x6F
+
+_VERSION = 0x24
+
+_MODE_SLEEP = 0
+_MODE_STANDBY = 1
+_MODE_TX = 3
+_MODE_RX = 4
+
+_IRQ1_MODE_READY = 0x80
+_IRQ2_PACKET_SENT = 0x08
+_IRQ2_PAYLOAD_READY = 0x04
+
+#   DIO0: PacketSent in TX, PayloadReady in RX
+_DIO0_PACKET_SENT = 0x00
+_DIO0_PAYLOAD_READY = 0x40
+
+_FXOSC = 32000000
+_FSTEP = _FXOSC / (1 << 19)
+
+_BITRATE = 250000
+_FREQUENCY_DEVIATION = 250000
+
+#   Packet mode, FSK, Gaussian shaping 1.0
+_DATA_MOD = 0x01
+#   DCC 0b111, 500 kHz
+_RX_BW = 0xE0
+#   Variable length, whitening, CRC on, no address filtering
+_PACKET_CONFIG1 = 0xD0
+#   AutoRxRestartOn, and AesOn with a key
+_PACKET_CONFIG2 = 0x02
+_PACKET_CONFIG2_AES_ON = 0x01
+#   Two sync bytes
+_SYNC_CONFIG = 0x88
+_SYNC_WORD = (0x2D, 0xD4)
+_PREAMBLE_LENGTH = 4
+#   Start transmitting as soon as the FIFO is not empty
+_FIFO_THRESH = 0x8F
+_TEST_DAGC_IMPROVED_LOWBETA0 = 0x30
+
+_PA1_ON = 0x40
+_PA2_ON = 0x20
+_PA0_ON = 0x80
+
+#   SPI reads of the mode ready flag before giving up
+_MODE_READY_POLLS = 1000
+
+class Rfm69Radio:
+    def __init__(self, frequency=DEFAULT_FREQUENCY_MHZ, bus=DEFAULT_SPI_BUS, device=DEFAULT_SPI_DEVICE, resetPin=DEFAULT_RESET_PIN, dio0Pin=DEFAULT_DIO0_PIN, txPower=DEFAULT_TX_POWER, highPower=True, spiSpeed=DEFAULT_SPI_SPEED_HZ, encryptionKey=DEFAULT_ENCRYPTION_KEY):
+        if spidev is None or GPIO is None:
+            raise RuntimeError("The RFM69 backend needs the spidev and RPi.GPIO packages")
+
+        if encryptionKey is not None and len(encryptionKey) != ENCRYPTION_KEY_SIZE:
+            raise ValueError("The encryption key must be {0} bytes".format(ENCRYPTION_KEY_SIZE))
+
+        self.frequency = frequency
+        self.bus = bus
+        self.device = device
+        self.resetPin = resetPin
+        self.dio0Pin = dio0Pin
+        self.txPower = txPower
+        self.highPower = highPower
+        self.spiSpeed = spiSpeed
+        self.encryptionKey = encryptionKey
+
+        #   The asyncio objects are made by start(), on the loop that runs the radio
+        self._spi = None
+        self._loop = None
+        self._dio0 = None
+        self._frames = None
+        self._sent = None
+        self._lock = None
+        self._service = None
+
+        self.receivedCount = 0
+        self.sentCount = 0
+        self.errorCount = 0
+        self.timeoutCount = 0
+
+    def _read(self, register):
+        return self._spi.xfer2([register & 0x7F, 0])[1]
+
+    def _write(self, register, value):
+        self._spi.xfer2([register | 0x80, value & 0xFF])
+
+    def _readBurst(self, register, length):
+        return bytes(self._spi.xfer2([register & 0x7F] + [0] * length)[1:])
+
+    def _writeBurst(self, register, data):
+        self._spi.xfer2([register | 0x80] + [value & 0xFF for value in data])
+
+    def _setMode(self, mode):
+        self._write(_REG_OP_MODE, (self._read(_REG_OP_MODE) & 0xE3) | (mode << 2))
+
+        for _ in range(_MODE_READY_POLLS):
+            if self._read(_REG_IRQ_FLAGS1) & _IRQ1_MODE_READY:
+                return
+
+        raise RuntimeError("RFM69 did not reach mode {0}".format(mode))
+
+    def _listen(self):
+        self._write(_REG_DIO_MAPPING1, _DIO0_PAYLOAD_READY)
+        self._setMode(_MODE_RX)
+
+    def _reset(self):
+        GPIO.output(self.resetPin, GPIO.HIGH)
+        time.sleep(0.0001)
+        GPIO.output(self.resetPin, GPIO.LOW)
+        time.sleep(0.005)
+
+    def _configure(self):
+        if self._read(_REG_VERSION) != _VERSION:
+            raise RuntimeError("No RFM69 found on SPI bus {0} device {1}".format(self.bus, self.device))
+
+        self._setMode(_MODE_STANDBY)
+
+        self._write(_REG_DATA_MOD, _DATA_MOD)
+
+        bitrate = _FXOSC // _BITRATE
+        self._writeBurst(_REG_BITRATE_MSB, (bitrate >> 8, bitrate))
+
+        deviation = int(_FREQUENCY_DEVIATION / _FSTEP)
+        self._writeBurst(_REG_FDEV_MSB, (deviation >> 8, deviation))
+
+        carrier = int(self.frequency * 1000000 / _FSTEP)
+        self._writeBurst(_REG_FRF_MSB, (carrier >> 16, carrier >> 8, carrier))
+
+        self._write(_REG_RX_BW, _RX_BW)
+        self._writeBurst(_REG_PREAMBLE_MSB, (_PREAMBLE_LENGTH >> 8, _PREAMBLE_LENGTH))
+        self._write(_REG_SYNC_CONFIG, _SYNC_CONFIG)
+        self._writeBurst(_REG_SYNC_VALUE1, _SYNC_WORD)
+        self._write(_REG_PACKET_CONFIG1, _PACKET_CONFIG1)
+        self._write(_REG_PAYLOAD_LENGTH, FIFO_SIZE)
+        self._write(_REG_FIFO_THRESH, _FIFO_THRESH)
+
+        if self.encryptionKey is None:
+            self._write(_REG_PACKET_CONFIG2, _PACKET_CONFIG2)
+        else:
+            self._writeBurst(_REG_AES_KEY1, self.encryptionKey)
+            self._write(_REG_PACKET_CONFIG2, _PACKET_CONFIG2 | _PACKET_CONFIG2_AES_ON)
+
+        self._write(_REG_TEST_DAGC, _TEST_DAGC_IMPROVED_LOWBETA0)
+
+        #   PA1 alone on the high power modules up to 13 dBm, PA1 and PA2 up to 17.
+        #       The 20 dBm boost mode is not supported.
+        if self.highPower:
+            power = max(-2, min(17, self.txPower))
+
+            if power <= 13:
+                self._write(_REG_PA_LEVEL, _PA1_ON | (power + 18))
+            else:
+                self._write(_REG_PA_LEVEL, _PA1_ON | _PA2_ON | (power + 14))
+        else:
+            power = max(-18, min(13, self.txPower))
+            self._write(_REG_PA_LEVEL, _PA0_ON | (power + 18))
+
+    def _interrupt(self, channel):
+        #   On RPi.GPIO's thread, hand over to the event loop
+        self._loop.call_soon_threadsafe(self._dio0.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._dio0 = asyncio.Event()
+        self._frames = asyncio.Queue()
+        self._lock = asyncio.Lock()
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.resetPin, GPIO.OUT)
+        GPIO.setup(self.dio0Pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+
+        self._spi = spidev.SpiDev()
+        self._spi.open(self.bus, self.device)
+        self._spi.max_speed_hz = self.spiSpeed
+        self._spi.mode = 0
+
+        self._reset()
+        self._configure()
+
+        GPIO.add_event_detect(self.dio0Pin, GPIO.RISING, callback=self._interrupt)
+
+        self._listen()
+        self._service = asyncio.ensure_future(self._serviceInterrupts())
+
+    async def _serviceInterrupts(self):
+        while True:
+            await self._dio0.wait()
+            self._dio0.clear()
+
+            flags = self._read(_REG_IRQ_FLAGS2)
+
+            if self._sent is not None:
+                if flags & _IRQ2_PACKET_SENT and not self._sent.done():
+                    self._sent.set_result(True)
+
+                continue
+
+            #   The flag rather than the edge, so nothing is missed if two come close
+            while flags & _IRQ2_PAYLOAD_READY:
+                self._readFrame()
+                flags = self._read(_REG_IRQ_FLAGS2)
+
+    def _readFrame(self):
+        receivedAt = ticksMs()
+        rssi = -self._read(_REG_RSSI_VALUE) / 2
+
+        self._setMode(_MODE_STANDBY)
+        length = self._read(_REG_FIFO)
+
+        if 0 < length < FIFO_SIZE:
+            data = self._readBurst(_REG_FIFO, length)
+        else:
+            data = b""
+
+        self._listen()
+
+        if len(data) <= RADIOHEAD_HEADER_SIZE:
+            self.errorCount += 1
+            return
+
+        self.receivedCount += 1
+        self._frames.put_nowait((data[RADIOHEAD_HEADER_SIZE:], rssi, receivedAt))
+
+    async def receive(self):
+        return await self._frames.get()
+
+    async def send(self, frame):
+        if len(frame) + RADIOHEAD_HEADER_SIZE >= FIFO_SIZE:
+            raise ValueError("Frame of {0} bytes does not fit in the FIFO".format(len(frame)))
+
+        async with self._lock:
+            self._setMode(_MODE_STANDBY)
+
+            #   Length, then the RadioHead header: broadcast, from the gateway
+            self._writeBurst(_REG_FIFO, bytes((len(frame) + RADIOHEAD_HEADER_SIZE, RADIOHEAD_BROADCAST, RADIOHEAD_BROADCAST, 0, 0)) + bytes(frame))
+
+            self._sent = self._loop.create_future()
+            self._write(_REG_DIO_MAPPING1, _DIO0_PACKET_SENT)
+            self._setMode(_MODE_TX)
+
+            try:
+                await asyncio.wait_for(self._sent, TRANSMIT_TIMEOUT_S)
+                self.sentCount += 1
+            except asyncio.TimeoutError:
+                self.timeoutCount += 1
+            finally:
+                self._sent = None
+                self._setMode(_MODE_STANDBY)
+                self._listen()
+
+    def close(self):
+        if self._service is not None:
+            self._service.cancel()
+
+        if self._spi is not None:
+            self._setMode(_MODE_SLEEP)
+            self._spi.close()
+            self._spi = None
+
+        GPIO.remove_event_detect(self.dio0Pin)
+        GPIO.cleanup((self.resetPin, self.dio0Pin))
+
+#   Preamble, sync word, length byte, RadioHead header and CRC around every frame
+AIR_OVERHEAD_BYTES = _PREAMBLE_LENGTH + len(_SYNC_WORD) + 1 + RADIOHEAD_HEADER_SIZE + 2
+
+def airtime(length, bitrate=_BITRATE):
+    #   Seconds on air for a frame of length bytes
+    return (AIR_OVERHEAD_BYTES + length) * 8 / bitrate
+
+class SimulatedChannel:
+    def __init__(self, lossRate=0.0, bitrate=_BITRATE, timeScale=1.0, seed=None):
+        #   timeScale multiplies every airtime, 0 runs as fast as the CPU allows
+        self.lossRate = lossRate
+        self.bitrate = bitrate
+        self.timeScale = timeScale
+        self.radios = []
+
+        self._random = random.Random(seed)
+        self._busy = None
+
+        self.frameCount = 0
+        self.lostCount = 0
+        self.busySeconds = 0.0
+
+    def attach(self, radio):
+        self.radios.append(radio)
+
+    async def transmit(self, sender, frame):
+        #   One frame on the air at a time, so there are no collisions, only waiting
+        if self._busy is None:
+            self._busy = asyncio.Lock()
+
+        async with self._busy:
+            seconds = airtime(len(frame), self.bitrate)
+            self.busySeconds += seconds
+
+            if self.timeScale > 0:
+                await asyncio.sleep(seconds * self.timeScale)
+            else:
+                await asyncio.sleep(0)
+
+            self.frameCount += 1
+
+            for radio in self.radios:
+                if radio is sender:
+                    continue
+
+                if self.lossRate > 0 and self._random.random() < self.lossRate:
+                    self.lostCount += 1
+                    continue
+
+                radio.deliver(frame)
+
+class SimulatedRadio:
+    def __init__(self, channel, rssi=-60):
+        self.channel = channel
+        self.rssi = rssi
+
+        #   None until start(), the radio hears nothing while it is off
+        self._frames = None
+
+        self.receivedCount = 0
+        self.sentCount = 0
+
+        channel.attach(self)
+
+    async def start(self):
+        self._frames = asyncio.Queue()
+
+    def deliver(self, frame):
+        if self._frames is None:
+            return
+
+        self.receivedCount += 1
+        self._frames.put_nowait((frame, self.rssi, ticksMs()))
+
+    async def receive(self):
+        return await self._frames.get()
+
+    async def send(self, frame):
+        await self.channel.transmit(self, bytes(frame))
+        self.sentCount += 1
+
+    def close(self):
+        pass
@@ -0,0 +1,284 @@
+#
+#   Offline replay of frames through the gateway, as fast as it can take them
+#
+#   A Replayer runs a whole Gateway, with its sinks, on a ReplayRadio that
+#       receives nothing and sends nowhere, and feeds it frames straight into
+#       Gateway.handleFrame(): the same validation, routing, time sync, duplicate
+#       filter, ARQ, reassembly, decoding and sinks as live traffic, minus the
+#       radio. Each frame keeps the Unix time it arrived at, so records come out
+#       with the times they had when they were captured. The frames come from a
+#       gateway_capture file, or from SyntheticTraffic, which makes up the
+#       traffic of simulated nodes with some duplicates and corrupted frames in
+#       it. A synthetic replay also checks that every record it made up came
+#       out of the gateway.
+#
+#   It gives a repeatable benchmark of the receive path, frames and records per
+#       second and the time handleFrame() takes per frame, and lets a change to
+#       a record format be tried on real traffic. The sinks are never allowed to
+#       fall behind far enough to drop records, the replay waits for them.
+#
+#       python3 gateway_replay.py capture.bin
+#       python3 gateway_replay.py --synthetic 200000 --nodes 30 --sqlite replay.db
+#
+import argparse
+import asyncio
+import random
+import time
+
+import gateway_path
+import mesh_arq
+import mesh_clock
+import mesh_header
+import mesh_sensor
+import mesh_timesync
+
+import gateway
+import gateway_capture
+import gateway_sim
+import gateway_sink
+
+#   Frames handed to the gateway between two chances for everything else to run
+DEFAULT_YIELD_EVERY = 256
+
+DEFAULT_NODES = 30
+DEFAULT_DUPLICATE_RATE = 0.01
+DEFAULT_CORRUPT_RATE = 0.001
+
+class ReplayRadio:
+    def __init__(self):
+        self.receiving = False
+        self.sentCount = 0
+
+    async def start(self):
+        pass
+
+    async def receive(self):
+        #   Nothing ever comes in over the air
+        self.receiving = True
+        await asyncio.Future()
+
+    async def send(self, frame):
+        self.sentCount += 1
+
+    def close(self):
+        pass
+
+class CountingSink:
+    #   Takes records and does nothing with them, to time the gateway alone
+    def __init__(self):
+        self.recordCount = 0
+
+    def write(self, records):
+        self.recordCount += len(records)
+
+    def close(self):
+        pass
+
+class SyntheticTraffic:
+    #   Made up traffic of nodeCount SimulatedNodes sampling every sampleInterval
+    #       ms into timed delta batches, each full batch sent as one frame. A
+    #       frame is sent twice, its ACK lost, at duplicateRate, and gets a byte
+    #       flipped at corruptRate, then is sent again the way ARQ would. The
+    #       same seed and startTime make the same frames. recordCount is
+    #       the number of records in the frames made so far, what the gateway
+    #       has to decode from them.
+    def __init__(self, nodeCount=DEFAULT_NODES, gatewayAddress=gateway.DEFAULT_ADDRESS, sampleInterval=gateway_sim.DEFAULT_SAMPLE_INTERVAL_MS, duplicateRate=DEFAULT_DUPLICATE_RATE, corruptRate=DEFAULT_CORRUPT_RATE, startTime=None, seed=None):
+        self.gatewayAddress = gatewayAddress
+        self.sampleInterval = sampleInterval
+        self.duplicateRate = duplicateRate
+        self.corruptRate = corruptRate
+        self.startTime = gateway.unixMs() if startTime is None else startTime
+        self.seed = seed
+
+        #   Only their batchers and readings are used, they need no radio
+        self.nodes = [gateway_sim.SimulatedNode(gateway_sim.FIRST_NODE_ADDRESS + index, gatewayAddress, None, sampleInterval, seed=None if seed is None else seed + index) for index in range(nodeCount)]
+
+        self.recordCount = 0
+
+    def frames(self, count):
+        #   Yields count (time, receivedAt, rssi, frame) like CaptureReader.records()
+        generator = random.Random(self.seed)
+        startTime = self.startTime
+        gatewayAddress = self.gatewayAddress
+        #   ARQ senders start at sequence 1
+        sequences = [1] * len(self.nodes)
+        packet = mesh_header.newPacketBuffer()
+        sent = 0
+        step = 0
+
+        while True:
+            now = startTime + step * self.sampleInterval
+            step += 1
+
+            for index, node in enumerate(self.nodes):
+                node.batcher.add(now % mesh_timesync.NETWORK_TIME_MODULO, *mesh_sensor.encodeImu(*node.reading(now - startTime)))
+
+                if not node.batcher.isFull():
+                    continue
+
+                records = node.batcher.count
+                length = mesh_header.packPacket(packet, sequences[index], node.address, gatewayAddress, mesh_header.PACKET_TYPE_DATA, node.batcher.flush(), route=(node.address, gatewayAddress, 1))
+                sequences[index] = mesh_arq.nextSequence(sequences[index])
+                frame = bytearray(packet[:length])
+                copies = [frame] * (2 if generator.random() < self.duplicateRate else 1)
+
+                if generator.random() < self.corruptRate:
+                    corrupt = bytearray(frame)
+                    corrupt[generator.randrange(length)] ^= 0xFF
+                    copies.insert(0, corrupt)
+
+                for copy in copies:
+                    if copy is frame and records:
+                        self.recordCount += records
+                        records = 0
+
+                    yield now, now & mesh_clock.TICKS_MAX, generator.randint(-90, -40), copy
+                    sent += 1
+
+                    if sent == count:
+                        return
+
+def captureFrames(reader):
+    #   The frames of a CaptureReader, each copied out of the mapping the way
+    #       a radio hands over a fresh frame
+    for time, receivedAt, rssi, view in reader.records():
+        frame = bytearray(view)
+        view.release()
+        yield time, receivedAt, rssi, frame
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
+
+class Replayer:
+    def __init__(self, sinks=(), address=gateway.DEFAULT_ADDRESS, yieldEvery=DEFAULT_YIELD_EVERY):
+        self.radio = ReplayRadio()
+        self.gateway = gateway.Gateway(self.radio, address, sinks)
+        self.yieldEvery = yieldEvery
+
+        self.frameCount = 0
+        self.waitCount = 0
+
+    async def _catchUp(self):
+        #   Lets the ACK timers and sinks run, and waits while a sink is half full
+        await asyncio.sleep(0)
+
+        while any(runner.backlog() > runner.queueSize // 2 for runner in self.gateway.sinks):
+            self.waitCount += 1
+            await asyncio.sleep(0.001)
+
+    async def run(self, frames):
+        #   Replays frames, then returns the results
+        gatewayTask = asyncio.ensure_future(self.gateway.run())
+
+        while not self.radio.receiving:
+            await asyncio.sleep(0)
+
+        await asyncio.sleep(0)
+
+        handleFrame = self.gateway.handleFrame
+        clock = time.perf_counter_ns
+        latencies = []
+        startedAt = time.perf_counter()
+
+        for arrivedAt, receivedAt, rssi, frame in frames:
+            before = clock()
+            handleFrame(frame, rssi, receivedAt, arrivedAt)
+            latencies.append(clock() - before)
+
+            self.frameCount += 1
+
+            if self.frameCount % self.yieldEvery == 0:
+                await self._catchUp()
+
+        handledAt = time.perf_counter()
+
+        while any(runner.backlog() for runner in self.gateway.sinks):
+            await asyncio.sleep(0.001)
+
+        #   close() has the sinks write out what they still hold
+        await self.gateway.close()
+        await asyncio.gather(gatewayTask, return_exceptions=True)
+
+        stats = self.gateway.stats()
+
+        finishedAt = time.perf_counter()
+        latencies.sort()
+
+        handleSeconds = handledAt - startedAt
+        totalSeconds = finishedAt - startedAt
+
+        return {
+            "frames": self.frameCount,
+            "rejected": stats["rejected"],
+            "records": stats["records"],
+            "untimed": stats["untimed"],
+            "sinkDropped": stats["sinkDropped"],
+            "handleSeconds": round(handleSeconds, 3),
+            "totalSeconds": round(totalSeconds, 3),
+            "framesPerSecond": round(self.frameCount / totalSeconds, 1) if totalSeconds > 0 else 0.0,
+            "recordsPerSecond": round(stats["records"] / totalSeconds, 1) if totalSeconds > 0 else 0.0,
+            "handleUs50": round(_percentile(latencies, 0.5) / 1000, 1),
+            "handleUs99": round(_percentile(latencies, 0.99) / 1000, 1),
+            "handleUsMax": round(latencies[-1] / 1000, 1) if latencies else 0.0,
+            "sinkWaits": self.waitCount,
+            "sinks": stats["sinks"],
+        }
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Replay frames through the gateway as fast as it takes them")
+    parser.add_argument("capture", nargs="?", help="gateway_capture file to replay")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="FRAMES", help="replay this many made up frames instead")
+    parser.add_argument("--nodes", type=int, default=DEFAULT_NODES, help="simulated nodes in the synthetic traffic")
+    parser.add_argument("--duplicates", type=float, default=DEFAULT_DUPLICATE_RATE, help="rate of repeated frames in the synthetic traffic")
+    parser.add_argument("--corrupt", type=float, default=DEFAULT_CORRUPT_RATE, help="rate of corrupted frames in the synthetic traffic")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--address", type=int, default=gateway.DEFAULT_ADDRESS, help="address of the gateway the frames were sent to")
+    parser.add_argument("--jsonl", help="append records to this JSON lines file")
+    parser.add_argument("--sqlite", help="write records to this SQLite database")
+
+    arguments = parser.parse_args(argv)
+
+    if (arguments.capture is None) == (arguments.synthetic == 0):
+        parser.error("give either a capture file or --synthetic")
+
+    return arguments
+
+async def main(argv=None):
+    arguments = parseArguments(argv)
+    sinks = [CountingSink()]
+
+    if arguments.jsonl:
+        sinks.append(gateway_sink.JsonLinesSink(arguments.jsonl))
+
+    if arguments.sqlite:
+        sinks.append(gateway_sink.SqliteSink(arguments.sqlite))
+
+    replayer = Replayer(sinks, arguments.address)
+    reader = None
+    traffic = None
+
+    if arguments.capture:
+        reader = gateway_capture.CaptureReader(arguments.capture)
+        frames = captureFrames(reader)
+    else:
+        #   Made before the clock starts, making them takes longer than replaying them
+        traffic = SyntheticTraffic(arguments.nodes, arguments.address, duplicateRate=arguments.duplicates, corruptRate=arguments.corrupt, seed=arguments.seed)
+        frames = list(traffic.frames(arguments.synthetic))
+
+    try:
+        results = await replayer.run(frames)
+    finally:
+        if reader is not None:
+            reader.close()
+
+    if traffic is not None:
+        results["generated"] = traffic.recordCount
+
+    for name, value in results.items():
+        print("{0}: {1}".format(name, value))
+
+    if traffic is not None and results["records"] != traffic.recordCount:
+        raise SystemExit("The gateway decoded {0} of the {1} records made up".format(results["records"], traffic.recordCount))
+
+if __name__ == "__main__":
+    asyncio.run(main())
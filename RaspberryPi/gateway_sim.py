@@ -0,0 +1,143 @@
+#
+#   Simulated sensor nodes, to run the gateway without any hardware
+#
+#   A SimulatedNode does what RFM69_Bluetooth_LSM303_NXP_Sequenced_ACK_Node_102
+#       does with its radio, with made up IMU readings: it samples every
+#       sampleInterval ms into a timed delta compressed batch, stamped with the
+#       network time it gets from the gateway's time sync rounds, sends each
+#       batch to the gateway through a selective repeat ARQ window, and takes
+#       the gateway's cumulative ACKs. It sends whenever it has something, there
+#       is no listen before talk or TDMA on a SimulatedChannel.
+#
+import asyncio
+import math
+import random
+
+import gateway_path
+import mesh_arq
+import mesh_batch
+import mesh_clock
+import mesh_compress
+import mesh_header
+import mesh_rtt
+import mesh_sensor
+import mesh_timesync
+
+import gateway_radio
+
+#   Node addresses start here
+FIRST_NODE_ADDRESS = 100
+
+DEFAULT_SAMPLE_INTERVAL_MS = 200
+DEFAULT_MAX_LATENCY_MS = 2000
+
+ARQ_WINDOW_SIZE = 8
+
+class SimulatedNode:
+    def __init__(self, address, gateway, radio, sampleInterval=DEFAULT_SAMPLE_INTERVAL_MS, maxLatency=DEFAULT_MAX_LATENCY_MS, seed=None):
+        self.address = address
+        self.gateway = gateway
+        self.radio = radio
+        self.sampleInterval = sampleInterval
+
+        self.arqSender = mesh_arq.ArqSender(ARQ_WINDOW_SIZE, rttEstimator=mesh_rtt.RttEstimator())
+        self.batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, len(mesh_sensor.IMU_V1_CHANNELS), maxLatency=maxLatency, timed=True, interval=sampleInterval)
+        self.timeSync = mesh_timesync.TimeSync(address, self._queueFrame)
+
+        self._random = random.Random(seed)
+        self._phase = self._random.random() * 2 * math.pi
+        self._outPacket = mesh_header.newPacketBuffer()
+
+        #   Made by run()
+        self._frames = None
+        self._wake = None
+
+        self.sampleCount = 0
+
+    def _queueFrame(self, frame):
+        self._frames.put_nowait(bytearray(frame))
+
+    def reading(self, now):
+        #   Slowly turning, a little noisy
+        angle = self._phase + now / 5000
+        noise = self._random.gauss
+
+        return (
+            9.81 * math.cos(angle) + noise(0, 0.02), 9.81 * math.sin(angle) + noise(0, 0.02), noise(0, 0.02),
+            40 * math.cos(angle) + noise(0, 0.3), 40 * math.sin(angle) + noise(0, 0.3), -20 + noise(0, 0.3),
+            noise(0, 0.005), noise(0, 0.005), 0.2 + noise(0, 0.005),
+        )
+
+    async def run(self):
+        self._frames = asyncio.Queue()
+        self._wake = asyncio.Event()
+
+        await self.radio.start()
+        await asyncio.gather(self._sampleLoop(), self._sendLoop(), self._transmitLoop(), self._receiveLoop())
+
+    async def _sampleLoop(self):
+        #   Start at a random point in the interval, so the nodes do not all sample together
+        await asyncio.sleep(self._random.random() * self.sampleInterval / 1000)
+
+        while True:
+            self.batcher.add(self.timeSync.now(), *mesh_sensor.encodeImu(*self.reading(mesh_clock.ticksMs())))
+            self.sampleCount += 1
+
+            if self.batcher.isFull():
+                self._wake.set()
+
+            await asyncio.sleep(self.sampleInterval / 1000)
+
+    async def _sendLoop(self):
+        while True:
+            now = mesh_clock.ticksMs()
+
+            if self.batcher.isDue(now) and self.arqSender.canQueue():
+                self.arqSender.queue(self.batcher.flush())
+
+            for sequence in self.arqSender.due(now):
+                totalPackets, subPacketNumber = self.arqSender.fragmentOf(sequence)
+                length = mesh_header.packPacket(self._outPacket, sequence, self.address, self.gateway, mesh_header.PACKET_TYPE_DATA, self.arqSender.payloadOf(sequence), totalPackets, subPacketNumber, route=(self.address, self.gateway, 1))
+                self._queueFrame(memoryview(self._outPacket)[:length])
+                self.arqSender.sent(sequence, now)
+
+            wait = self.arqSender.timeUntilDue(now)
+            batchWait = self.batcher.timeUntilDue(now)
+
+            if batchWait is not None:
+                wait = min(wait, batchWait)
+
+            self._wake.clear()
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(wait, 1) / 1000)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _transmitLoop(self):
+        while True:
+            frame = await self._frames.get()
+            self.timeSync.stamp(frame)
+            await self.radio.send(frame)
+
+    async def _receiveLoop(self):
+        while True:
+            packet, rssi, receivedAt = await self.radio.receive()
+
+            if not mesh_header.isValidPacket(packet):
+                continue
+
+            if self.timeSync.handle(packet, receivedAt):
+                continue
+
+            if mesh_header.toNodeOf(packet) != self.address or mesh_header.fromNodeOf(packet) != self.gateway:
+                continue
+
+            ack = mesh_header.unpackAck(packet)
+
+            if ack is not None and self.arqSender.acknowledgeRange(ack[0], ack[1], mesh_clock.ticksMs()):
+                self._wake.set()
+
+def makeNodes(channel, count, gateway, sampleInterval=DEFAULT_SAMPLE_INTERVAL_MS, seed=None):
+    #   count SimulatedNodes on channel, each with its own radio
+    return [SimulatedNode(FIRST_NODE_ADDRESS + index, gateway, gateway_radio.SimulatedRadio(channel), sampleInterval, seed=None if seed is None else seed + index) for index in range(count)]
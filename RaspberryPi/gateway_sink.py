@@ -0,0 +1,305 @@
+#
+#   Where the gateway's decoded records go
+#
+#   A sink is any object with write(records), taking a list of Records, and
+#       close(). Writes may block, on a disk or a database, so each sink runs on
+#       a thread of its own behind a SinkRunner. The radio loop only ever puts
+#       records into the runner's bounded queue, never waits for a sink, and a
+#       sink that falls behind loses records (counted in droppedCount) instead
+#       of holding up the radio.
+#
+#   A sink that buffers may also have pollInterval (s) and poll(): the runner
+#       calls poll() whenever no records have come for pollInterval, so the
+#       buffer still gets written out when traffic stops. A sink with stats()
+#       has its counters included in the gateway's.
+#
+#   A Record is one reading:
+#
+#       time        Unix time in ms, the network time the node sampled it at if
+#                   the record carries one, when it arrived otherwise
+#       node        address of the node that sent it
+#       sequence    sequence number of the packet it came in
+#       format      its mesh_batch record format, None for a payload that is
+#                   not a batch
+#       values      the readings in their units, or (payload bytes,)
+#
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sqlite3
+import sys
+import time
+
+Record = namedtuple("Record", ("time", "node", "sequence", "format", "values"))
+
+DEFAULT_QUEUE_SIZE = 4096
+
+#   Records handed to a sink's write() at once, at most
+DEFAULT_WRITE_BATCH = 256
+
+#   SqliteSink flushes at this many buffered rows, or when the oldest has waited
+#       this long (s)
+DEFAULT_SQLITE_ROWS = 5000
+DEFAULT_SQLITE_DELAY_S = 1.0
+
+#   Value columns of the samples table, enough for a 9 axis IMU record
+DEFAULT_SQLITE_CHANNELS = 9
+
+def recordValues(record):
+    #   The values of a record, with bytes as text, for sinks that want plain types
+    return [value.decode("utf-8", "replace") if isinstance(value, (bytes, bytearray)) else value for value in record.values]
+
+class PrintSink:
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def write(self, records):
+        for record in records:
+            self.stream.write("{0} node {1} #{2} format {3}: {4}\n".format(record.time, record.node, record.sequence, record.format, recordValues(record)))
+
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+class JsonLinesSink:
+    #   One JSON object per record, appended to a file
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps({"time": record.time, "node": record.node, "sequence": record.sequence, "format": record.format, "values": recordValues(record)}))
+            self._file.write("\n")
+
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class SqliteSink:
+    #   Records into an SQLite database, in WAL mode, buffered and written
+    #       maxRows at a time with one executemany() and one transaction, or
+    #       when the oldest buffered record has waited maxDelay seconds. Batch
+    #       samples go in samples, one row each with up to channels values,
+    #       other payloads in messages. Both are indexed on (node, time).
+    #
+    #   The connection is opened by the first write, on the runner's thread,
+    #       which is the only one that may use it.
+    def __init__(self, path, maxRows=DEFAULT_SQLITE_ROWS, maxDelay=DEFAULT_SQLITE_DELAY_S, channels=DEFAULT_SQLITE_CHANNELS):
+        self.path = path
+        self.maxRows = maxRows
+        self.maxDelay = maxDelay
+        self.pollInterval = maxDelay
+        self.channels = channels
+
+        self._connection = None
+        self._insertSample = "INSERT INTO samples VALUES ({0})".format(", ".join("?" * (4 + channels)))
+        self._insertMessage = "INSERT INTO messages VALUES (?, ?, ?, ?)"
+
+        #   Never more than maxRows of each, so memory stays bounded
+        self._samples = []
+        self._messages = []
+        self._oldest = None
+
+        self.rowCount = 0
+        self.flushCount = 0
+        self.truncatedCount = 0
+        self.lastFlushMs = 0.0
+        self.maxFlushMs = 0.0
+        self.flushSeconds = 0.0
+        self._startedAt = time.monotonic()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        #   Safe with WAL, a power cut can lose the last transactions but not corrupt the file
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        channelColumns = "".join(", c{0} REAL".format(channel) for channel in range(self.channels))
+        connection.execute("CREATE TABLE IF NOT EXISTS samples (node INTEGER NOT NULL, time INTEGER NOT NULL, sequence INTEGER, format INTEGER{0})".format(channelColumns))
+        connection.execute("CREATE INDEX IF NOT EXISTS samples_node_time ON samples (node, time)")
+        connection.execute("CREATE TABLE IF NOT EXISTS messages (node INTEGER NOT NULL, time INTEGER NOT NULL, sequence INTEGER, payload BLOB)")
+        connection.execute("CREATE INDEX IF NOT EXISTS messages_node_time ON messages (node, time)")
+
+        self._connection = connection
+
+    def _row(self, record):
+        values = record.values
+
+        if len(values) > self.channels:
+            self.truncatedCount += 1
+            values = values[:self.channels]
+
+        return (record.node, record.time, record.sequence, record.format) + tuple(values) + (None,) * (self.channels - len(values))
+
+    def write(self, records):
+        for record in records:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+            if record.format is None:
+                self._messages.append((record.node, record.time, record.sequence, bytes(record.values[0])))
+            else:
+                self._samples.append(self._row(record))
+
+            if len(self._samples) >= self.maxRows or len(self._messages) >= self.maxRows:
+                self.flush()
+
+        self.poll()
+
+    def poll(self):
+        #   Flushes once the oldest buffered record has waited maxDelay
+        if self._oldest is not None and time.monotonic() - self._oldest >= self.maxDelay:
+            self.flush()
+
+    def flush(self):
+        if not self._samples and not self._messages:
+            return
+
+        if self._connection is None:
+            self._connect()
+
+        startedAt = time.monotonic()
+        rows = len(self._samples) + len(self._messages)
+
+        #   The buffers are emptied whatever happens, a batch that fails is lost
+        #       rather than retried forever
+        samples, self._samples = self._samples, []
+        messages, self._messages = self._messages, []
+        self._oldest = None
+
+        connection = self._connection
+        connection.execute("BEGIN")
+
+        try:
+            if samples:
+                connection.executemany(self._insertSample, samples)
+
+            if messages:
+                connection.executemany(self._insertMessage, messages)
+
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        elapsed = time.monotonic() - startedAt
+
+        self.rowCount += rows
+        self.flushCount += 1
+        self.flushSeconds += elapsed
+        self.lastFlushMs = elapsed * 1000
+        self.maxFlushMs = max(self.maxFlushMs, self.lastFlushMs)
+
+    def stats(self):
+        elapsed = time.monotonic() - self._startedAt
+
+        return {
+            "rows": self.rowCount,
+            "rowsPerSecond": round(self.rowCount / elapsed, 1) if elapsed > 0 else 0.0,
+            "insertRowsPerSecond": round(self.rowCount / self.flushSeconds, 1) if self.flushSeconds > 0 else 0.0,
+            "flushes": self.flushCount,
+            "lastFlushMs": round(self.lastFlushMs, 2),
+            "maxFlushMs": round(self.maxFlushMs, 2),
+            "meanFlushMs": round(1000 * self.flushSeconds / self.flushCount, 2) if self.flushCount else 0.0,
+            "buffered": len(self._samples) + len(self._messages),
+            "truncated": self.truncatedCount,
+        }
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+class SinkRunner:
+    def __init__(self, sink, queueSize=DEFAULT_QUEUE_SIZE, writeBatch=DEFAULT_WRITE_BATCH):
+        self.sink = sink
+        self.queueSize = queueSize
+        self.writeBatch = writeBatch
+
+        #   Made by run(), on the loop that feeds it
+        self._queue = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.writtenCount = 0
+        self.droppedCount = 0
+        self.errorCount = 0
+
+    def put(self, record):
+        #   Never blocks. Returns False, and drops the record, if the sink is behind.
+        if self._queue is None:
+            self.droppedCount += 1
+            return False
+
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.droppedCount += 1
+            return False
+
+        return True
+
+    def backlog(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    def _take(self, first):
+        batch = [first]
+
+        while len(batch) < self.writeBatch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        return batch
+
+    async def _write(self, batch):
+        loop = asyncio.get_running_loop()
+
+        try:
+            await loop.run_in_executor(self._executor, self.sink.write, batch)
+            self.writtenCount += len(batch)
+        except Exception as error:
+            #   A bad sink loses its records, it does not stop the gateway
+            self.errorCount += 1
+            print("Sink {0} failed to write {1} records: {2}".format(type(self.sink).__name__, len(batch), error), file=sys.stderr)
+
+    async def run(self):
+        self._queue = asyncio.Queue(self.queueSize)
+        pollInterval = getattr(self.sink, "pollInterval", None)
+
+        while True:
+            if pollInterval is None:
+                first = await self._queue.get()
+            else:
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), pollInterval)
+                except asyncio.TimeoutError:
+                    await self._poll()
+                    continue
+
+            await self._write(self._take(first))
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            await loop.run_in_executor(self._executor, self.sink.poll)
+        except Exception as error:
+            self.errorCount += 1
+            print("Sink {0} failed to flush: {1}".format(type(self.sink).__name__, error), file=sys.stderr)
+
+    async def close(self):
+        #   Writes what is still queued, then closes the sink
+        while self._queue is not None and not self._queue.empty():
+            await self._write(self._take(self._queue.get_nowait()))
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.sink.close)
+        self._executor.shutdown()
@@ -0,0 +1,14 @@
+#
+#   The mesh_* modules and the gateway run here as they do on the Pi, from
+#       their own directories
+#
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for directory in ("Circuitpython", "RaspberryPi"):
+    path = os.path.join(ROOT, directory)
+
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,63 @@
+import asyncio
+
+import gateway
+import gateway_radio
+import gateway_sim
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+async def untilTrue(condition, seconds=5):
+    for _ in range(int(seconds * 100)):
+        if condition():
+            return True
+
+        await asyncio.sleep(0.01)
+
+    return False
+
+async def simulate(samples):
+    #   A node sends samples samples through the gateway, then falls silent
+    channel = gateway_radio.SimulatedChannel(timeScale=0, seed=1)
+    sink = ListSink()
+    theGateway = gateway.Gateway(gateway_radio.SimulatedRadio(channel), sinks=[sink])
+    node = gateway_sim.SimulatedNode(gateway_sim.FIRST_NODE_ADDRESS, gateway.DEFAULT_ADDRESS, gateway_radio.SimulatedRadio(channel), sampleInterval=5, maxLatency=100, seed=1)
+
+    gatewayTask = asyncio.ensure_future(theGateway.run())
+    nodeTask = asyncio.ensure_future(node.run())
+
+    assert await untilTrue(lambda: node.sampleCount >= samples)
+    node.sampleInterval = 3600000
+
+    assert await untilTrue(lambda: node.batcher.count == 0 and node.arqSender.outstanding() == 0 and len(sink.records) == node.sampleCount)
+
+    nodeTask.cancel()
+    await theGateway.close()
+    await asyncio.gather(gatewayTask, nodeTask, return_exceptions=True)
+
+    return theGateway, node, sink
+
+def test_node_batches_are_acknowledged_and_delivered():
+    theGateway, node, sink = asyncio.run(simulate(100))
+
+    assert theGateway.packetRejectedCount == 0
+    assert theGateway.ackPacketsSent > 0
+    assert node.arqSender.base > 1
+
+    sequences = [record.sequence for record in sink.records]
+    assert sequences == sorted(sequences)
+    assert {record.node for record in sink.records} == {node.address}
+
+    for record in sink.records:
+        #   The simulated node turns slowly in 1 g
+        accelerationX, accelerationY, accelerationZ = record.values[:3]
+        assert abs((accelerationX ** 2 + accelerationY ** 2 + accelerationZ ** 2) ** 0.5 - 9.81) < 0.2
+
+    assert theGateway.recordCount == node.sampleCount
@@ -0,0 +1,126 @@
+import random
+import struct
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+import gateway_bulk
+import gateway_capture
+import mesh_batch
+import mesh_compress
+import mesh_header
+import mesh_sensor
+import mesh_timesync
+
+def imuFrame(sequence, fromNode, records):
+    payload = bytes((mesh_batch.RECORD_IMU_V1, len(records))) + b"".join(struct.pack(">9h", *record) for record in records)
+    packet = mesh_header.newPacketBuffer()
+    length = mesh_header.packPacket(packet, sequence, fromNode, 1, mesh_header.PACKET_TYPE_DATA, payload, route=(fromNode, 1, 1))
+
+    return packet[:length]
+
+def test_capture_fields(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    ring = gateway_capture.CaptureRing(path, 4)
+    ring.append(1234, 7, -60.5, imuFrame(3, 100, [tuple(range(9))]))
+    ring.close()
+
+    frames = gateway_bulk.loadCapture(path)
+
+    assert frames["time"][0] == 1234
+    assert frames["rssiHalfDbm"][0] == -121
+    assert frames["sequence"][0] == 3
+    assert frames["fromNode"][0] == 100
+
+def test_wrapped_capture_keeps_its_layout(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    ring = gateway_capture.CaptureRing(path, 4)
+
+    for sequence in range(1, 7):
+        ring.append(sequence, 0, -50, imuFrame(sequence, 100, [tuple(range(9))]))
+
+    ring.close()
+
+    frames = gateway_bulk.loadCapture(path)
+
+    assert frames.dtype == gateway_bulk.captureDtype()
+    assert list(frames["sequence"]) == [3, 4, 5, 6]
+    assert gateway_bulk.validFrames(frames).all()
+
+def deltaFrames(recordFormat, timed, nodeCount=3, samples=120, seed=1):
+    #   Frames of DeltaBatcher blocks from a few nodes, and the raw samples in
+    #       them, in the order the frames go out
+    generator = random.Random(seed)
+    channels = len(mesh_sensor.IMU_V1_CHANNELS)
+    batchers = [mesh_compress.DeltaBatcher(recordFormat, channels, timed=timed, interval=200) for _ in range(nodeCount)]
+    sequences = [1] * nodeCount
+    packet = mesh_header.newPacketBuffer()
+    frames = []
+    expected = []
+
+    for step in range(samples):
+        for node, batcher in enumerate(batchers):
+            values = [generator.randint(-300, 300) * (node + 1) for _ in range(channels)]
+
+            if timed:
+                values.insert(0, (0xFFFFF000 + step * 200 + generator.randint(-3, 3)) & 0xFFFFFFFF)
+
+            batcher.add(*values)
+
+            if batcher.isFull() or step == samples - 1:
+                block = bytes(batcher.flush())
+                length = mesh_header.packPacket(packet, sequences[node], 100 + node, 1, mesh_header.PACKET_TYPE_DATA, block, route=(100 + node, 1, 1) if node else None)
+                frames.append(bytes(packet[:length]))
+                expected.extend((100 + node, sequences[node], sample) for sample in mesh_compress.unpackBlock(block, channels, timed))
+                sequences[node] += 1
+
+    return frames, expected
+
+def slots(frames):
+    buffer = bytearray(len(frames) * gateway_capture.MAX_FRAME_SIZE)
+
+    for index, frame in enumerate(frames):
+        buffer[index * gateway_capture.MAX_FRAME_SIZE:index * gateway_capture.MAX_FRAME_SIZE + len(frame)] = frame
+
+    return gateway_bulk.viewFrames(buffer)
+
+@pytest.mark.parametrize("recordFormat, timed", [(mesh_batch.RECORD_IMU_V1_DELTA, False), (mesh_batch.RECORD_IMU_V1_TIMED_DELTA, True)])
+def test_delta_blocks_match_unpack_block(recordFormat, timed):
+    frames, expected = deltaFrames(recordFormat, timed)
+    corrupt = bytearray(frames[3])
+    corrupt[-3] ^= 0x10
+
+    #   A repeat, a corrupt copy and a fixed size batch go along
+    samples, counts = gateway_bulk.decodeSamples(slots(frames + [frames[0], bytes(corrupt), imuFrame(1, 200, [tuple(range(9))])]), recordFormat)
+
+    assert counts["decoded"] == len(frames)
+    assert counts["repeated"] == 1
+    assert counts["valid"] == len(frames) + 2
+    assert counts["formats"] == {recordFormat: len(frames) + 1, mesh_batch.RECORD_IMU_V1: 1}
+
+    assert list(samples["node"]) == [node for node, sequence, sample in expected]
+    assert list(samples["sequence"]) == [sequence for node, sequence, sample in expected]
+
+    first = 1 if timed else 0
+
+    for column, (name, unit, scale) in enumerate(mesh_sensor.IMU_V1_CHANNELS):
+        assert list(samples[name]) == [sample[first + column] / scale for node, sequence, sample in expected]
+
+    if timed:
+        assert list(samples["networkTime"]) == [sample[0] for node, sequence, sample in expected]
+
+def test_sample_time_is_the_gateways(tmp_path):
+    frames, expected = deltaFrames(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, True, nodeCount=1, samples=40)
+    arrivedAt = (1 << 40) + 0xFFFFF000 + 40 * 200
+    path = str(tmp_path / "capture.bin")
+    ring = gateway_capture.CaptureRing(path, 32)
+
+    for frame in frames:
+        ring.append(arrivedAt, 0, -50, frame)
+
+    ring.close()
+
+    samples, counts = gateway_bulk.decodeSamples(gateway_bulk.loadCapture(path))
+
+    assert list(samples["sampleTime"]) == [arrivedAt + mesh_timesync.networkDiff(sample[0], arrivedAt % mesh_timesync.NETWORK_TIME_MODULO) for node, sequence, sample in expected]
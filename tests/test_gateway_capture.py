@@ -0,0 +1,48 @@
+import gateway_capture
+
+def frames(reader):
+    result = []
+
+    for time, receivedAt, rssi, frame in reader.records():
+        result.append((time, receivedAt, rssi, bytes(frame)))
+        frame.release()
+
+    return result
+
+def test_round_trip_with_float_rssi(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    ring = gateway_capture.CaptureRing(path, 8)
+    ring.append(1000, 5, -60.5, b"\x01\x02\x03")
+    ring.append(1001, 6, -91.0, bytearray(b"\x04"))
+    ring.close()
+
+    reader = gateway_capture.CaptureReader(path)
+    assert frames(reader) == [(1000, 5, -60.5, b"\x01\x02\x03"), (1001, 6, -91.0, b"\x04")]
+    reader.close()
+
+def test_wraps_around_and_survives_a_restart(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    ring = gateway_capture.CaptureRing(path, 4)
+
+    for number in range(3):
+        ring.append(number, number, -50, bytes((number,)))
+
+    ring.close()
+
+    ring = gateway_capture.CaptureRing(path, 4)
+
+    for number in range(3, 6):
+        ring.append(number, number, -50, bytes((number,)))
+
+    ring.close()
+
+    reader = gateway_capture.CaptureReader(path)
+    assert [time for time, receivedAt, rssi, frame in frames(reader)] == [2, 3, 4, 5]
+    reader.close()
+
+def test_long_frames_are_truncated(tmp_path):
+    ring = gateway_capture.CaptureRing(str(tmp_path / "capture.bin"), 2)
+    ring.append(0, 0, -50, bytes(100))
+
+    assert ring.truncatedCount == 1
+    ring.close()
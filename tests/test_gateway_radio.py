@@ -0,0 +1,45 @@
+import pytest
+
+import gateway_radio
+
+class FakeSpi:
+    #   RFM69 registers behind spidev's xfer2(), bursts auto increment
+    def __init__(self):
+        self.registers = bytearray(0x80)
+        self.registers[0x10] = 0x24
+        self.registers[0x27] = 0x80
+
+    def xfer2(self, data):
+        register = data[0] & 0x7F
+        write = data[0] & 0x80
+
+        for index, value in enumerate(data[1:]):
+            if write:
+                self.registers[register + index] = value
+
+        return [0] + [self.registers[register + index] for index in range(len(data) - 1)]
+
+def configured(monkeypatch, **options):
+    monkeypatch.setattr(gateway_radio, "spidev", object())
+    monkeypatch.setattr(gateway_radio, "GPIO", object())
+
+    radio = gateway_radio.Rfm69Radio(**options)
+    radio._spi = FakeSpi()
+    radio._configure()
+
+    return radio._spi.registers
+
+def test_encryption_uses_the_nodes_key_by_default(monkeypatch):
+    registers = configured(monkeypatch)
+
+    assert bytes(registers[0x3E:0x4E]) == gateway_radio.DEFAULT_ENCRYPTION_KEY
+    assert registers[0x3D] & 0x01
+
+def test_encryption_off(monkeypatch):
+    registers = configured(monkeypatch, encryptionKey=None)
+
+    assert registers[0x3D] & 0x01 == 0
+
+def test_key_must_be_16_bytes(monkeypatch):
+    with pytest.raises(ValueError):
+        configured(monkeypatch, encryptionKey=b"short")
@@ -0,0 +1,29 @@
+import asyncio
+
+import gateway_replay
+
+def replay(frames):
+    sink = gateway_replay.CountingSink()
+    results = asyncio.run(gateway_replay.Replayer([sink]).run(frames))
+
+    return results, sink
+
+def test_every_synthetic_record_is_decoded():
+    traffic = gateway_replay.SyntheticTraffic(5, duplicateRate=0.1, corruptRate=0.05, startTime=1700000000000, seed=3)
+    frames = list(traffic.frames(2000))
+    results, sink = replay(frames)
+
+    assert results["frames"] == 2000
+    assert results["rejected"] > 0
+    assert results["records"] == traffic.recordCount
+    assert sink.recordCount == traffic.recordCount
+
+def test_same_seed_same_frames():
+    first = gateway_replay.SyntheticTraffic(3, startTime=0, seed=9)
+    second = gateway_replay.SyntheticTraffic(3, startTime=0, seed=9)
+    other = gateway_replay.SyntheticTraffic(3, startTime=0, seed=10)
+
+    frames = list(first.frames(50))
+
+    assert frames == list(second.frames(50))
+    assert frames != list(other.frames(50))
@@ -0,0 +1,54 @@
+import sqlite3
+
+import gateway_sink
+
+def records(count, node=100):
+    for index in range(count):
+        yield gateway_sink.Record(1000 + index, node, index // 4, 4, tuple(float(index + channel) for channel in range(9)))
+
+def test_sqlite_sink_commits_every_max_rows(tmp_path):
+    path = str(tmp_path / "records.db")
+    sink = gateway_sink.SqliteSink(path, maxRows=10, maxDelay=3600)
+
+    sink.write(list(records(25)))
+
+    #   Two full batches written, the rest still buffered
+    assert sink.flushCount == 2
+    assert sink.stats()["buffered"] == 5
+
+    reader = sqlite3.connect(path)
+
+    assert reader.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert reader.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 20
+
+    sink.close()
+
+    rows = reader.execute("SELECT node, time, sequence, format, c0, c8 FROM samples ORDER BY time").fetchall()
+    reader.close()
+
+    assert len(rows) == 25
+    assert rows[0] == (100, 1000, 0, 4, 0.0, 8.0)
+    assert rows[-1] == (100, 1024, 6, 4, 24.0, 32.0)
+
+def test_sqlite_sink_keeps_other_payloads_as_messages(tmp_path):
+    path = str(tmp_path / "records.db")
+    sink = gateway_sink.SqliteSink(path, channels=3)
+
+    sink.write([gateway_sink.Record(1000, 101, 7, None, (b"hello",)), next(records(1))])
+    sink.close()
+
+    reader = sqlite3.connect(path)
+
+    assert reader.execute("SELECT node, time, sequence, payload FROM messages").fetchall() == [(101, 1000, 7, b"hello")]
+    assert reader.execute("SELECT c0, c1, c2 FROM samples").fetchall() == [(0.0, 1.0, 2.0)]
+    assert sink.truncatedCount == 1
+
+    reader.close()
+
+def test_sqlite_sink_writes_after_max_delay(tmp_path):
+    sink = gateway_sink.SqliteSink(str(tmp_path / "records.db"), maxDelay=0)
+
+    sink.write(list(records(3)))
+
+    assert sink.rowCount == 3
+    sink.close()
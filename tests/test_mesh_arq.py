@@ -0,0 +1,131 @@
+import mesh_arq
+
+def delivered(receiver):
+    return [(sequence, bytes(payload)) for sequence, payload in receiver.deliver()]
+
+def payloadFor(sequence):
+    return "p{0}".format(sequence).encode()
+
+def test_out_of_order_packets_are_delivered_in_order():
+    receiver = mesh_arq.ArqReceiver(4)
+
+    assert receiver.receive(2, b"b")
+    assert delivered(receiver) == []
+    assert receiver.ackState() == (1, 0b1)
+
+    assert receiver.receive(1, b"a")
+    assert delivered(receiver) == [(1, b"a"), (2, b"b")]
+    assert receiver.ackState() == (3, 0)
+
+    #   A repeat of one already delivered is ACKed again
+    assert receiver.receive(1, b"a")
+    assert receiver.duplicateCount == 1
+    assert delivered(receiver) == []
+
+def test_fragment_numbers_come_with_the_payload():
+    receiver = mesh_arq.ArqReceiver(4)
+    receiver.receive(1, b"a", 3, 2)
+
+    assert delivered(receiver) == [(1, b"a")]
+    assert receiver.fragmentOf(1) == (3, 2)
+
+def test_hole_given_up_on_keeps_what_was_buffered():
+    receiver = mesh_arq.ArqReceiver(8, firstSequence=5)
+
+    #   5 never arrives, 6 to 12 wait for it
+    for sequence in range(6, 13):
+        receiver.receive(sequence, payloadFor(sequence))
+
+    assert delivered(receiver) == []
+
+    #   13 is beyond the window, the sender has given up on 5
+    assert receiver.receive(13, payloadFor(13))
+    assert delivered(receiver) == [(sequence, payloadFor(sequence)) for sequence in range(6, 14)]
+    assert receiver.skippedCount == 1
+    assert receiver.ackState() == (14, 0)
+
+def test_skips_only_as_far_as_the_senders_window():
+    receiver = mesh_arq.ArqReceiver(4)
+    receiver.receive(3, payloadFor(3))
+
+    #   1 and 2 were given up on, 4 to 6 may still come. 7 needs the slot 3
+    #       is in, so it is not ACKed until its retransmission.
+    assert not receiver.receive(7, payloadFor(7))
+    assert delivered(receiver) == [(3, payloadFor(3))]
+    assert receiver.expected == 4
+
+    for sequence in (5, 4, 6, 7):
+        receiver.receive(sequence, payloadFor(sequence))
+
+    assert [sequence for sequence, payload in delivered(receiver)] == [4, 5, 6, 7]
+    assert receiver.skippedCount == 2
+
+def test_restart_delivers_what_was_buffered_first():
+    receiver = mesh_arq.ArqReceiver(4, firstSequence=100)
+    receiver.receive(101, payloadFor(101))
+
+    assert receiver.receive(7, payloadFor(7))
+    assert delivered(receiver) == [(101, payloadFor(101)), (7, payloadFor(7))]
+    assert receiver.resyncCount == 1
+
+    receiver.receive(8, payloadFor(8))
+    assert delivered(receiver) == [(8, payloadFor(8))]
+
+def test_restart_far_ahead_does_not_wait_for_the_sequences_before_it():
+    receiver = mesh_arq.ArqReceiver(4)
+    first = 1 + mesh_arq.MAX_SKIP + 10
+
+    receiver.receive(first, payloadFor(first))
+    assert delivered(receiver) == [(first, payloadFor(first))]
+    assert receiver.skippedCount == 0
+
+def test_wrap_around():
+    last = mesh_arq.SEQUENCE_MODULO - 1
+    receiver = mesh_arq.ArqReceiver(4, firstSequence=last)
+    receiver.receive(0, b"b")
+    receiver.receive(last, b"a")
+
+    assert delivered(receiver) == [(last, b"a"), (0, b"b")]
+    assert receiver.expected == 1
+
+def test_sender_retransmits_only_what_is_unacknowledged():
+    sender = mesh_arq.ArqSender(4, retransmitTimeout=100)
+
+    for sequence in range(3):
+        assert sender.queue(payloadFor(sequence)) == sequence + 1
+
+    for sequence in sender.due(0):
+        sender.sent(sequence, 0)
+
+    assert list(sender.due(50)) == []
+
+    #   2 got lost
+    assert sender.acknowledgeRange(2, 0b1, 60) == 2
+    assert list(sender.due(100)) == [2]
+    assert sender.base == 2
+    assert bytes(sender.payloadOf(2)) == payloadFor(1)
+
+def test_lossy_link_delivers_everything_not_given_up_on():
+    sender = mesh_arq.ArqSender(4, retransmitTimeout=10, maxRetries=3)
+    receiver = mesh_arq.ArqReceiver(4)
+    queued = []
+    received = []
+    now = 0
+
+    while len(queued) < 40 or sender.outstanding():
+        while len(queued) < 40 and sender.canQueue():
+            queued.append(sender.queue(payloadFor(len(queued))))
+
+        for sequence in list(sender.due(now)):
+            sender.sent(sequence, now)
+
+            #   Every copy of sequence 5 is lost, and every third other packet
+            if sequence != 5 and (sequence + now) % 3:
+                receiver.receive(sequence, sender.payloadOf(sequence))
+                received.extend(sequence for sequence, payload in receiver.deliver())
+
+        sender.acknowledgeRange(*receiver.ackState(), now)
+        now += 10
+
+    assert sender.droppedCount == 1
+    assert received == [sequence for sequence in queued if sequence != 5]
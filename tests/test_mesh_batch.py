@@ -0,0 +1,68 @@
+import pytest
+
+import mesh_batch
+import mesh_header
+import mesh_sensor
+
+def batcher(monkeypatch, clock, **options):
+    monkeypatch.setattr(mesh_batch, "ticksMs", lambda: clock[0])
+
+    return mesh_batch.SampleBatcher(mesh_batch.RECORD_IMU_V1, **options)
+
+def test_capacity_follows_max_payload(monkeypatch):
+    recordSize = len(mesh_sensor.IMU_V1_CHANNELS) * 2
+
+    assert batcher(monkeypatch, [0]).capacity == (mesh_header.MAX_ROUTED_PAYLOAD_SIZE - mesh_batch.BATCH_HEADER_SIZE) // recordSize
+    assert batcher(monkeypatch, [0], maxPayload=2 + 3 * recordSize).capacity == 3
+
+    with pytest.raises(ValueError):
+        batcher(monkeypatch, [0], maxPayload=recordSize)
+
+def test_full_batch_is_due_at_once(monkeypatch):
+    clock = [0]
+    records = batcher(monkeypatch, clock, maxPayload=2 + 3 * 18)
+
+    assert records.timeUntilDue(0) is None
+    assert not records.isDue(0)
+
+    for value in range(3):
+        assert not records.isFull()
+        assert records.add(*[value] * 9)
+
+    assert records.isFull()
+    assert records.timeUntilDue(0) == 0
+    assert records.isDue(0)
+
+    #   Nothing more fits
+    assert not records.add(*[3] * 9)
+    assert records.droppedCount == 1
+
+    payload = bytes(records.flush())
+
+    assert len(payload) == 2 + 3 * 18
+    assert mesh_batch.isBatch(payload)
+    assert list(mesh_batch.unpackBatch(payload)) == [(value,) * 9 for value in range(3)]
+    assert records.count == 0
+    assert records.batchCount == 1
+
+def test_batch_is_due_when_its_oldest_record_is_max_latency_old(monkeypatch):
+    clock = [1000]
+    records = batcher(monkeypatch, clock, maxPayload=2 + 3 * 18, maxLatency=500)
+
+    records.add(*[1] * 9)
+    clock[0] = 1300
+    records.add(*[2] * 9)
+
+    assert records.timeUntilDue(1300) == 200
+    assert not records.isDue(1499)
+    assert records.isDue(1500)
+
+    #   The next batch counts from its own first record
+    records.flush()
+    records.add(*[3] * 9)
+    assert records.timeUntilDue(1300) == 500
+
+def test_not_a_batch():
+    assert not mesh_batch.isBatch(b"\x02")
+    assert not mesh_batch.isBatch(b"\x02\x01" + bytes(17))
+    assert not mesh_batch.isBatch(b"\x63\x00")
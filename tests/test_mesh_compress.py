@@ -0,0 +1,140 @@
+import random
+
+import mesh_batch
+import mesh_compress
+import mesh_header
+import mesh_sensor
+
+CHANNELS = len(mesh_sensor.IMU_V1_CHANNELS)
+
+def fillBlock(batcher, samples):
+    #   Adds samples until a block is full, returns the block and, for the first
+    #       block of batcher, the samples that went into it
+    added = []
+
+    for sample in samples:
+        batcher.add(*sample)
+        added.append(sample)
+
+        if batcher.isFull():
+            #   The last sample may have been kept for the next block
+            count = batcher.count
+            return bytes(batcher.flush()), added[:count]
+
+    return bytes(batcher.flush()), added
+
+def timedSamples(noise, jitter=0, seed=1, start=1000, interval=200):
+    generator = random.Random(seed)
+    base = [generator.randint(-2000, 2000) for _ in range(CHANNELS)]
+    time = start
+
+    while True:
+        yield (time,) + tuple(value + generator.randint(-noise, noise) for value in base)
+        time += interval + generator.randint(-jitter, jitter)
+
+def test_steady_timestamps_cost_no_bits():
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, CHANNELS, timed=True, interval=200)
+    block, added = fillBlock(batcher, timedSamples(0))
+
+    assert block[1] == mesh_compress.MAX_BLOCK_SAMPLES
+    assert list(mesh_compress.unpackBlock(block, CHANNELS, True)) == added
+
+def test_later_blocks_keep_the_time_channel_narrow():
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, CHANNELS, timed=True, interval=200)
+    samples = timedSamples(1)
+
+    for _ in range(5):
+        block, added = fillBlock(batcher, samples)
+        widths = mesh_compress._blockWidths(block, CHANNELS + 1, True)
+
+        assert widths[0] == 0
+        assert block[1] >= 4
+
+def test_timed_round_trip_with_jitter_and_wrap_around():
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, CHANNELS, timed=True, interval=200)
+    samples = timedSamples(3, jitter=5, start=0xFFFFFFFF - 1000)
+    decoded = []
+    expected = []
+
+    for sample in (next(samples) for _ in range(200)):
+        sample = ((sample[0] & 0xFFFFFFFF),) + sample[1:]
+        expected.append(sample)
+        batcher.add(*sample)
+
+        if batcher.isFull():
+            decoded.extend(mesh_compress.unpackBlock(bytes(batcher.flush()), CHANNELS, True))
+
+    decoded.extend(mesh_compress.unpackBlock(bytes(batcher.flush()), CHANNELS, True))
+
+    assert decoded == expected
+
+def test_zigzag_round_trip():
+    for value in (0, -1, 1, -2, 2, 32767, -32768):
+        assert mesh_compress.unzigzag(mesh_compress.zigzag(value)) == value
+
+    assert [mesh_compress.zigzag(value) for value in (0, -1, 1, -2, 2)] == [0, 1, 2, 3, 4]
+
+def test_untimed_round_trip_with_extreme_differences():
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_DELTA, CHANNELS)
+    samples = [tuple(32767 if (index + channel) % 2 else -32768 for channel in range(CHANNELS)) for index in range(3)]
+    samples += [tuple(index for _ in range(CHANNELS)) for index in range(5)]
+    decoded = []
+
+    for sample in samples:
+        batcher.add(*sample)
+
+        if batcher.isFull():
+            decoded.extend(mesh_compress.unpackBlock(bytes(batcher.flush()), CHANNELS))
+
+    block = bytes(batcher.flush())
+    assert mesh_compress.isBlock(block, CHANNELS)
+    decoded.extend(mesh_compress.unpackBlock(block, CHANNELS))
+
+    assert decoded == samples
+
+def test_still_channels_cost_nothing():
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_DELTA, CHANNELS)
+    block, added = fillBlock(batcher, (tuple(range(CHANNELS)) for _ in range(100)))
+
+    assert block[1] == mesh_compress.MAX_BLOCK_SAMPLES
+    assert len(block) == mesh_compress.blockSize(CHANNELS, mesh_compress.MAX_BLOCK_SAMPLES, 0)
+    assert list(mesh_compress.unpackBlock(block, CHANNELS)) == added
+
+def test_every_block_fits_its_payload():
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, CHANNELS, timed=True, interval=200)
+    samples = timedSamples(300, jitter=50)
+    added = []
+    decoded = []
+
+    while len(added) < 200:
+        added.append(next(samples))
+        batcher.add(*added[-1])
+
+        if batcher.isFull():
+            block = bytes(batcher.flush())
+
+            assert len(block) <= batcher.maxPayload
+            assert mesh_batch.isBatch(block)
+            decoded.extend(mesh_compress.unpackBlock(block, CHANNELS, True))
+
+    decoded.extend(mesh_compress.unpackBlock(bytes(batcher.flush()), CHANNELS, True))
+
+    assert decoded == added
+
+def test_full_block_carries_an_ack():
+    #   The way node 102 batches its records
+    batcher = mesh_compress.DeltaBatcher(mesh_batch.RECORD_IMU_V1_TIMED_DELTA, CHANNELS, maxPayload=mesh_header.MAX_ACKED_PAYLOAD_SIZE, timed=True, interval=200)
+    samples = timedSamples(3, jitter=5)
+    packet = mesh_header.newPacketBuffer()
+
+    for _ in range(5):
+        block, _ = fillBlock(batcher, samples)
+        length = mesh_header.packPacket(packet, 1, 102, 1, mesh_header.PACKET_TYPE_DATA, block, route=(102, 103, 4), ack=(9, 0b101))
+
+        assert length <= mesh_header.MAX_PACKET_SIZE
+        assert mesh_header.unpackAck(packet) == (9, 0b101)
+        assert bytes(mesh_header.payloadOf(packet)) == block
+
+def test_not_a_block():
+    assert not mesh_compress.isBlock(b"\x03", CHANNELS)
+    assert not mesh_compress.isBlock(b"\x03\x02" + bytes(10), CHANNELS)
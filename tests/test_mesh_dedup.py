@@ -0,0 +1,140 @@
+import asyncio
+
+import mesh_arq
+import mesh_dedup
+import mesh_header
+
+import gateway
+import gateway_replay
+
+def test_new_old_and_repeated_sequences():
+    duplicates = mesh_dedup.DuplicateFilter()
+
+    assert not duplicates.isDuplicate(7, 10)
+    assert not duplicates.isDuplicate(7, 12)
+    assert duplicates.isDuplicate(7, 10)
+    assert not duplicates.isDuplicate(7, 11)
+    assert duplicates.isDuplicate(7, 12)
+
+    #   Another source has its own window
+    assert not duplicates.isDuplicate(8, 10)
+    assert duplicates.duplicateCount == 2
+
+def test_window_moves_across_wrap_around():
+    duplicates = mesh_dedup.DuplicateFilter()
+    last = mesh_arq.SEQUENCE_MODULO - 1
+
+    assert not duplicates.isDuplicate(7, last)
+    assert not duplicates.isDuplicate(7, 0)
+    assert not duplicates.isDuplicate(7, 1)
+    assert duplicates.isDuplicate(7, last)
+
+def test_reboot_starts_the_source_afresh():
+    duplicates = mesh_dedup.DuplicateFilter()
+
+    for sequence in range(1, 301):
+        assert not duplicates.isDuplicate(7, sequence)
+
+    #   Back to 1 after a reboot, which is no duplicate of the 1 before it
+    for sequence in range(1, 6):
+        assert not duplicates.isDuplicate(7, sequence)
+
+    assert duplicates.restartCount == 1
+    assert duplicates.isDuplicate(7, 3)
+
+def test_checking_without_marking():
+    duplicates = mesh_dedup.DuplicateFilter()
+
+    assert not duplicates.isDuplicate(7, 10, False)
+    assert not duplicates.isDuplicate(7, 10, False)
+
+    duplicates.mark(7, 10)
+
+    assert duplicates.isDuplicate(7, 10, False)
+    assert duplicates.duplicateCount == 1
+
+def test_packet_turned_away_is_taken_when_it_comes_again():
+    #   The way a node or the gateway uses the filter and the ARQ receiver
+    duplicates = mesh_dedup.DuplicateFilter()
+    receiver = mesh_arq.ArqReceiver(8)
+    acked = []
+    delivered = []
+
+    def handle(sequence):
+        if duplicates.isDuplicate(7, sequence, False):
+            return
+
+        if receiver.receive(sequence, bytes([sequence])):
+            duplicates.mark(7, sequence)
+            acked.append(sequence)
+
+        delivered.extend(sequenceIn for sequenceIn, _ in receiver.deliver())
+
+    handle(3)
+
+    #   Ahead of the window, onto the slot 3 still holds
+    handle(11)
+    assert acked == [3]
+    assert delivered == [3]
+
+    handle(11)
+    assert acked == [3, 11]
+
+    for sequence in range(4, 11):
+        handle(sequence)
+
+    assert delivered == list(range(3, 12))
+
+def test_least_recently_heard_source_is_replaced():
+    duplicates = mesh_dedup.DuplicateFilter(2)
+
+    duplicates.isDuplicate(1, 5)
+    duplicates.isDuplicate(2, 5)
+    duplicates.isDuplicate(1, 6)
+    duplicates.isDuplicate(3, 5)
+
+    assert duplicates.isDuplicate(1, 5)
+    assert not duplicates.isDuplicate(2, 5)
+
+def test_sender_ignores_an_ack_from_before_it_restarted():
+    sender = mesh_arq.ArqSender(4)
+
+    for _ in range(3):
+        sender.queue(b"x")
+
+    assert sender.acknowledgeRange(301, 0) == 0
+    assert sender.staleAckCount == 1
+    assert sender.base == 1
+    assert sender.acknowledgeRange(3, 0) == 2
+    assert sender.base == 3
+
+def test_initial_sequence_is_a_valid_sequence():
+    for _ in range(100):
+        assert 0 < mesh_arq.initialSequence() < mesh_arq.SEQUENCE_MODULO
+
+def replay(node, sequences):
+    packet = mesh_header.newPacketBuffer()
+    frames = []
+
+    for sequence in sequences:
+        payload = "{0:03d} {1}".format(sequence, len(frames)).encode()
+        length = mesh_header.packPacket(packet, sequence, node, gateway.DEFAULT_ADDRESS, mesh_header.PACKET_TYPE_DATA, payload)
+        frames.append((1000 + len(frames), len(frames), -50, bytearray(packet[:length])))
+
+    sink = gateway_replay.CountingSink()
+    asyncio.run(gateway_replay.Replayer([sink]).run(frames))
+
+    return sink
+
+def test_gateway_takes_the_retransmission_of_a_packet_it_turned_away():
+    node = gateway.DEFAULT_ADDRESS + 1
+    sink = replay(node, [3, 11, 11] + list(range(4, 11)))
+
+    assert sink.recordCount == 9
+
+def test_gateway_delivers_what_a_rebooted_node_sends():
+    node = gateway.DEFAULT_ADDRESS + 1
+    sequences = list(range(1, 301)) + list(range(1, 11))
+    sink = replay(node, sequences)
+
+    assert sink.recordCount == len(sequences)
@@ -0,0 +1,85 @@
+import mesh_arq
+import mesh_fragment
+
+SIZE = mesh_fragment.FRAGMENT_SIZE
+
+def messageOf(length):
+    return bytes(index % 251 for index in range(length))
+
+def fragmentsOf(message, firstSequence=1):
+    #   (sequence, totalPackets, subPacketNumber, fragment) as an ArqSender sends them
+    fragmenter = mesh_fragment.Fragmenter()
+    sender = mesh_arq.ArqSender(mesh_fragment.MAX_FRAGMENTS, firstSequence=firstSequence)
+    fragments = []
+
+    assert fragmenter.start(message)
+    fragmenter.pump(sender)
+
+    for sequence in range(firstSequence, sender.next):
+        fragments.append((sequence,) + sender.fragmentOf(sequence) + (bytes(sender.payloadOf(sequence)),))
+
+    return fragments
+
+def test_fragment_count():
+    assert mesh_fragment.fragmentCount(0) == 1
+    assert mesh_fragment.fragmentCount(SIZE) == 1
+    assert mesh_fragment.fragmentCount(SIZE + 1) == 2
+
+def test_message_comes_back_whole_in_any_order():
+    message = messageOf(3 * SIZE + 5)
+    fragments = fragmentsOf(message, firstSequence=10)
+    reassembler = mesh_fragment.Reassembler()
+
+    assert [fragment[1:3] for fragment in fragments] == [(4, 0), (4, 1), (4, 2), (4, 3)]
+
+    for sequence, total, sub, fragment in [fragments[2], fragments[0], fragments[3]]:
+        assert reassembler.add(7, sequence, total, sub, fragment, 0) is None
+
+    #   A repeated fragment changes nothing
+    assert reassembler.add(7, *fragments[0] + (0,)) is None
+
+    assert bytes(reassembler.add(7, *fragments[1] + (0,))) == message
+    assert reassembler.completedCount == 1
+
+def test_messages_of_two_nodes_are_kept_apart():
+    first = messageOf(2 * SIZE)
+    second = messageOf(SIZE + 1)[::-1]
+    reassembler = mesh_fragment.Reassembler()
+
+    firstFragments = fragmentsOf(first)
+    secondFragments = fragmentsOf(second)
+
+    assert reassembler.add(7, *firstFragments[0] + (0,)) is None
+    assert reassembler.add(8, *secondFragments[0] + (0,)) is None
+    assert bytes(reassembler.add(8, *secondFragments[1] + (0,))) == second
+    assert bytes(reassembler.add(7, *firstFragments[1] + (0,))) == first
+
+def test_message_that_stops_is_dropped_after_the_timeout():
+    fragments = fragmentsOf(messageOf(2 * SIZE))
+    reassembler = mesh_fragment.Reassembler(timeout=1000)
+
+    assert reassembler.add(7, *fragments[0] + (0,)) is None
+    assert reassembler.add(7, *fragments[1] + (1000,)) is None
+    assert reassembler.expiredCount == 1
+
+def test_malformed_fragments_are_dropped():
+    reassembler = mesh_fragment.Reassembler()
+
+    #   Sub packet number past the total, and a short fragment that is not the last
+    assert reassembler.add(7, 1, 2, 2, b"x", 0) is None
+    assert reassembler.add(7, 1, 2, 0, b"x", 0) is None
+    assert reassembler.droppedCount == 2
+
+def test_fragmenter_waits_for_the_window():
+    message = messageOf(5 * SIZE)
+    fragmenter = mesh_fragment.Fragmenter()
+    sender = mesh_arq.ArqSender(2)
+
+    assert fragmenter.start(message)
+    assert not fragmenter.start(message)
+    assert fragmenter.pump(sender) == 2
+
+    sender.acknowledgeRange(3, 0)
+
+    assert fragmenter.pump(sender) == 2
+    assert fragmenter.busy()
@@ -0,0 +1,64 @@
+import pytest
+
+import mesh_header
+
+def packed(*arguments, **options):
+    buffer = mesh_header.newPacketBuffer()
+    length = mesh_header.packPacket(buffer, *arguments, **options)
+
+    return bytearray(buffer[:length])
+
+def test_crc_is_ccitt_false():
+    assert mesh_header.crc16(b"123456789") == 0x29B1
+    assert mesh_header.crc16(b"") == mesh_header.CRC_INITIAL
+
+def test_round_trip_with_every_extension():
+    packet = packed(0xFFFFFFFE, 102, 1, mesh_header.PACKET_TYPE_DATA, b"hello", 3, 2, route=(102, 103, 4), ack=(77, 0b101))
+
+    assert mesh_header.isValidPacket(packet)
+    assert len(packet) == mesh_header.packetSize(5, True, True)
+    assert mesh_header.unpackHeader(packet) == (0xFFFFFFFE, 102, 1, mesh_header.PACKET_TYPE_DATA, len(packet), 3, 2)
+    assert mesh_header.unpackRoute(packet) == (102, 103, 4)
+    assert mesh_header.unpackAck(packet) == (77, 0b101)
+    assert bytes(mesh_header.payloadOf(packet)) == b"hello"
+    assert mesh_header.sequenceOf(packet) == 0xFFFFFFFE
+    assert mesh_header.transmitterOf(packet) == 102
+    assert mesh_header.nextHopOf(packet) == 103
+
+def test_plain_packet_has_no_extensions():
+    packet = packed(5, 102, 1, mesh_header.PACKET_TYPE_ACK)
+
+    assert mesh_header.isValidPacket(packet)
+    assert mesh_header.unpackRoute(packet) is None
+    assert mesh_header.unpackAck(packet) is None
+    assert bytes(mesh_header.payloadOf(packet)) == b""
+
+def test_every_single_bit_error_is_caught():
+    packet = packed(9, 102, 1, mesh_header.PACKET_TYPE_DATA, bytes(range(20)), route=(102, 1, 3))
+
+    for index in range(len(packet)):
+        for bit in range(8):
+            corrupt = bytearray(packet)
+            corrupt[index] ^= 1 << bit
+
+            assert not mesh_header.isValidPacket(corrupt)
+
+def test_length_must_match_the_frame():
+    packet = packed(9, 102, 1, mesh_header.PACKET_TYPE_DATA, b"abc")
+
+    assert not mesh_header.isValidPacket(packet[:-1])
+    assert not mesh_header.isValidPacket(packet + b"\x00")
+    assert not mesh_header.isValidPacket(packet[:mesh_header.HEADER_SIZE])
+
+def test_forwarding_rewrites_the_route_and_the_crc():
+    packet = packed(9, 102, 1, mesh_header.PACKET_TYPE_DATA, b"abc", route=(102, 103, 4))
+    mesh_header.packRoute(packet, 103, 1, 3)
+
+    assert mesh_header.isValidPacket(packet)
+    assert mesh_header.unpackRoute(packet) == (103, 1, 3)
+
+def test_payload_too_big():
+    with pytest.raises(ValueError):
+        packed(1, 102, 1, mesh_header.PACKET_TYPE_DATA, bytes(mesh_header.MAX_PAYLOAD_SIZE + 1))
+
+    assert len(packed(1, 102, 1, mesh_header.PACKET_TYPE_DATA, bytes(mesh_header.MAX_PAYLOAD_SIZE))) == mesh_header.MAX_PACKET_SIZE
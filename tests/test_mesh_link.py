@@ -0,0 +1,99 @@
+import random
+
+import mesh_link
+
+def test_weak_link_that_delivers_is_usable():
+    links = mesh_link.LinkEstimator()
+
+    for _ in range(50):
+        links.heard(5, -92)
+        links.delivered(5)
+
+    assert links.etx(5) <= mesh_link.ETX_SCALE + mesh_link.WEAK_PENALTY
+    assert links.isUsable(5)
+
+def test_weak_penalty_breaks_a_tie():
+    links = mesh_link.LinkEstimator()
+    links.heard(5, -92)
+    links.heard(6, -60)
+
+    assert links.etx(5) > links.etx(6)
+    assert links.isUsable(5)
+
+def test_losses_make_a_link_unusable_for_a_while():
+    links = mesh_link.LinkEstimator()
+    links.heard(5, -60)
+
+    for _ in range(3):
+        links.lost(5)
+
+    assert not links.isUsable(5)
+
+    #   Still heard from, but hearing it says nothing of what it delivers
+    for _ in range(20):
+        links.heard(5, -60)
+
+    assert not links.isUsable(5)
+
+    #   The first age() only notes that something went through it since the last
+    links.age()
+    assert not links.isUsable(5)
+
+    for _ in range(15):
+        links.age()
+
+    assert links.isUsable(5)
+
+def test_link_losing_40_percent_is_unusable():
+    links = mesh_link.LinkEstimator()
+    generator = random.Random(1)
+    etx = []
+
+    #   A packet a second, aged every 10 s the way the nodes do
+    for second in range(600):
+        links.heard(5, -60)
+
+        if generator.random() < 0.4:
+            links.lost(5)
+        else:
+            links.delivered(5)
+
+        if second % 10 == 9:
+            links.age()
+
+        etx.append(links.etx(5))
+
+    assert max(etx[:60]) > links.maxUsableEtx
+
+    #   About 1 / 0.6, ageing does not pull it back towards the limit
+    assert sum(etx[60:]) / len(etx[60:]) > links.maxUsableEtx + mesh_link.ETX_SCALE // 8
+
+def test_age_recovers_a_link_that_is_not_heard():
+    links = mesh_link.LinkEstimator()
+    links.heard(5, -60)
+
+    for _ in range(6):
+        links.lost(5)
+
+    assert not links.isUsable(5)
+
+    for _ in range(40):
+        links.age()
+
+    assert links.isUsable(5)
+
+    for _ in range(200):
+        links.age()
+
+    assert links.etx(5) == mesh_link.UNKNOWN_ETX
+
+def test_age_leaves_a_good_link_alone():
+    links = mesh_link.LinkEstimator()
+
+    for _ in range(30):
+        links.delivered(5)
+
+    ratio = links.deliveryRatio(5)
+    links.age()
+
+    assert links.deliveryRatio(5) == ratio
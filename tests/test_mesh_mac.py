@@ -0,0 +1,96 @@
+import mesh_mac
+
+class FakeRfm69:
+    #   The RSSI registers, the measurement done as soon as it is started
+    def __init__(self):
+        self.rssi = -100
+
+    def _write_u8(self, register, value):
+        pass
+
+    def _read_u8(self, register):
+        if register == mesh_mac._REG_RSSI_CONFIG:
+            return mesh_mac._RSSI_DONE
+
+        return int(-self.rssi * 2)
+
+class Mac:
+    def __init__(self, monkeypatch, **options):
+        self.now = 0
+        self.sent = []
+        self.radio = FakeRfm69()
+        monkeypatch.setattr(mesh_mac, "ticksMs", lambda: self.now)
+
+        #   The longest backoff every time
+        monkeypatch.setattr(mesh_mac, "getrandbits", lambda bits: (1 << bits) - 1)
+
+        self.mac = mesh_mac.ListenBeforeTalk(self.radio, lambda frame: self.sent.append(bytes(frame)), **options)
+
+    def run(self):
+        return self.mac.run(self.now)
+
+def test_frame_goes_out_after_its_first_backoff(monkeypatch):
+    mac = Mac(monkeypatch, slot=4, minExponent=2)
+
+    assert mac.mac.queue(b"frame")
+    assert mac.run() == 12
+
+    mac.now = 12
+    assert mac.run() == mesh_mac.IDLE_MS
+    assert mac.sent == [b"frame"]
+
+def test_busy_channel_backs_off_longer_each_time(monkeypatch):
+    mac = Mac(monkeypatch, slot=4, minExponent=2, maxExponent=4, maxAttempts=10)
+    mac.mac.queue(b"frame")
+    mac.radio.rssi = -60
+    waits = []
+
+    for _ in range(4):
+        mac.now += mac.run()
+        waits.append(mac.run())
+
+    assert waits == [28, 60, 60, 60]
+    assert mac.mac.busyCount == 4
+    assert mac.sent == []
+
+    mac.radio.rssi = -100
+    mac.now += mac.run()
+    mac.run()
+    assert mac.sent == [b"frame"]
+
+def test_frame_is_dropped_after_max_attempts(monkeypatch):
+    mac = Mac(monkeypatch, maxAttempts=3)
+    mac.mac.queue(b"first")
+    mac.mac.queue(b"second")
+    mac.radio.rssi = -60
+
+    for _ in range(3):
+        mac.now += mac.run()
+        mac.run()
+
+    assert mac.mac.droppedCount == 1
+    assert mac.mac.count == 1
+
+    mac.radio.rssi = -100
+    mac.now += mac.run()
+    mac.run()
+    assert mac.sent == [b"second"]
+
+def test_queued_frame_is_a_copy(monkeypatch):
+    mac = Mac(monkeypatch)
+    frame = bytearray(b"frame")
+
+    mac.mac.queue(frame)
+    frame[0:5] = b"later"
+
+    mac.now += mac.run()
+    mac.run()
+    assert mac.sent == [b"frame"]
+
+def test_full_queue_drops_the_new_frame(monkeypatch):
+    mac = Mac(monkeypatch, queueSize=2)
+
+    assert mac.mac.queue(b"a")
+    assert mac.mac.queue(b"b")
+    assert not mac.mac.queue(b"c")
+    assert mac.mac.overflowCount == 1
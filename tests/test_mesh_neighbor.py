@@ -0,0 +1,111 @@
+import struct
+
+import mesh_header
+import mesh_neighbor
+
+def hello(fromNode, count=0, digest=0):
+    packet = mesh_header.newPacketBuffer()
+    length = mesh_header.packPacket(packet, 1, fromNode, mesh_header.BROADCAST_ADDRESS, mesh_header.PACKET_TYPE_HELLO, struct.pack(mesh_neighbor.HELLO_FORMAT, count, digest))
+
+    return packet[:length]
+
+def discovery(monkeypatch, **options):
+    #   Beacons at the very middle of each interval
+    monkeypatch.setattr(mesh_neighbor, "ticksMs", lambda: 0)
+    monkeypatch.setattr(mesh_neighbor, "randint", lambda low, high: low)
+    sent = []
+
+    return mesh_neighbor.NeighborDiscovery(102, sent.append, **options), sent
+
+def runUntil(neighbors, end, now=0):
+    #   Runs the timer the way the scheduler would, returns when the interval grew
+    starts = [now]
+    interval = neighbors.interval
+
+    while now < end:
+        wait = neighbors.run(now)
+
+        if neighbors.interval != interval:
+            interval = neighbors.interval
+            starts.append(now)
+
+        now += wait
+
+    return starts
+
+def test_interval_doubles_up_to_the_maximum(monkeypatch):
+    neighbors, sent = discovery(monkeypatch, minInterval=1000, maxInterval=8000)
+
+    assert runUntil(neighbors, 30000) == [0, 1000, 3000, 7000]
+    assert neighbors.interval == 8000
+    assert len(sent) == 6
+    assert mesh_header.typeOf(sent[0]) == mesh_header.PACKET_TYPE_HELLO
+
+def test_inconsistency_goes_back_to_the_minimum(monkeypatch):
+    neighbors, sent = discovery(monkeypatch, minInterval=1000, maxInterval=8000)
+    runUntil(neighbors, 15000)
+
+    assert neighbors.interval == 8000
+
+    #   A new neighbor
+    assert neighbors.handle(hello(103), 16000)
+    assert neighbors.interval == 1000
+    assert neighbors.resetCount == 1
+    assert neighbors.run(16000) == 500
+
+    #   Its HELLO again, nothing new
+    neighbors.handle(hello(103), 16100)
+    assert neighbors.resetCount == 1
+
+    #   Its neighborhood changed
+    neighbors.handle(hello(103, 1, 0x1234), 16200)
+    assert neighbors.resetCount == 2
+
+def test_beacon_is_suppressed_by_consistent_neighbors(monkeypatch):
+    neighbors, sent = discovery(monkeypatch, minInterval=1000, maxInterval=1000, redundancy=2)
+
+    for node in (103, 104):
+        neighbors.handle(hello(node), 0)
+
+    #   Heard twice that nothing changed, ours is not needed
+    neighbors.handle(hello(103), 100)
+    neighbors.handle(hello(104), 100)
+    neighbors.run(500)
+
+    assert neighbors.suppressedCount == 1
+    assert sent == []
+
+    #   Never twice in a row
+    neighbors.run(1000)
+    neighbors.handle(hello(103), 1100)
+    neighbors.handle(hello(104), 1100)
+    neighbors.run(1500)
+
+    assert neighbors.suppressedCount == 1
+    assert len(sent) == 1
+
+def test_silent_neighbor_is_dropped(monkeypatch):
+    neighbors, sent = discovery(monkeypatch, table=mesh_neighbor.NeighborTable(lifetime=5000))
+    empty = neighbors.table.digest
+
+    assert neighbors.heard(103, 0)
+    assert neighbors.isNeighbor(103)
+    assert neighbors.table.digest != empty
+
+    neighbors.run(5000)
+
+    assert not neighbors.isNeighbor(103)
+    assert neighbors.table.digest == empty
+    assert neighbors.resetCount == 2
+
+def test_digest_does_not_depend_on_the_order_heard():
+    first = mesh_neighbor.NeighborTable()
+    second = mesh_neighbor.NeighborTable()
+
+    for node in (103, 104, 105):
+        first.heard(node, 0)
+
+    for node in (105, 103, 104):
+        second.heard(node, 0)
+
+    assert first.digest == second.digest
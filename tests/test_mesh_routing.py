@@ -0,0 +1,144 @@
+import pytest
+
+import mesh_header
+import mesh_routing
+
+def test_known_route_is_replaced_by_a_shorter_or_fresher_one():
+    cache = mesh_routing.RouteCache()
+
+    assert cache.addRoute(1, 103, 3)
+    assert not cache.addRoute(1, 104, 4)
+    assert cache.nextHopFor(1) == 103
+
+    #   No more hops, through another neighbor
+    assert cache.addRoute(1, 104, 3)
+    assert cache.nextHopFor(1) == 104
+
+    #   The same next hop reporting a longer path is still the news
+    assert cache.addRoute(1, 104, 5)
+    assert cache.metricFor(1) == 5
+
+def test_expired_route_is_replaced_by_any_route(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(mesh_routing, "ticksMs", lambda: now[0])
+    cache = mesh_routing.RouteCache(lifetime=100)
+
+    assert cache.addRoute(1, 103, 1)
+    now[0] += 100
+    assert cache.addRoute(1, 104, 4)
+    assert cache.nextHopFor(1) == 104
+    assert cache.expiredCount == 1
+
+def packetOf(fromNode, toNode, route=None, sequence=1):
+    packet = mesh_header.newPacketBuffer()
+    length = mesh_header.packPacket(packet, sequence, fromNode, toNode, mesh_header.PACKET_TYPE_DATA, b"data", route=route)
+
+    return packet[:length]
+
+def test_neighbor_without_a_route_is_sent_to_straight():
+    router = mesh_routing.Router(102)
+
+    assert router.routeTo(1) is None
+
+    router.table.addRoute(1, 103, 2)
+
+    assert router.routeTo(1) == (102, 103, mesh_routing.DEFAULT_TTL)
+
+def test_single_hop_packet_is_delivered_only_to_its_destination():
+    router = mesh_routing.Router(1)
+
+    assert router.inspect(packetOf(102, 1)) == mesh_routing.ACTION_DELIVER
+    assert router.inspect(packetOf(102, 103)) == mesh_routing.ACTION_DROP
+    assert router.droppedCount == 1
+
+def test_routed_packet_is_delivered_forwarded_or_ignored():
+    router = mesh_routing.Router(103)
+
+    assert router.inspect(packetOf(102, 103, (102, 103, 4))) == mesh_routing.ACTION_DELIVER
+    assert router.inspect(packetOf(102, 1, (102, 103, 4))) == mesh_routing.ACTION_FORWARD
+
+    #   Meant for another hop
+    assert router.inspect(packetOf(102, 1, (102, 104, 4))) == mesh_routing.ACTION_DROP
+    assert router.droppedCount == 0
+
+def test_forward_rewrites_the_routing_extension():
+    router = mesh_routing.Router(103)
+    router.table.addRoute(1, 104, 2)
+    packet = packetOf(102, 1, (102, 103, 4))
+
+    assert router.forward(packet) == 104
+    assert mesh_header.hopFromOf(packet) == 103
+    assert mesh_header.nextHopOf(packet) == 104
+    assert packet[mesh_header.OFFSET_TTL] == 3
+    assert mesh_header.isValidPacket(packet)
+    assert router.forwardedCount == 1
+
+    #   Without a route the destination is taken to be in range
+    packet = packetOf(102, 5, (102, 103, 4))
+    assert router.forward(packet) == 5
+
+def test_packet_out_of_hops_or_looped_back_is_dropped():
+    router = mesh_routing.Router(103)
+
+    assert router.inspect(packetOf(102, 1, (102, 103, 1))) == mesh_routing.ACTION_DROP
+    assert router.inspect(packetOf(103, 1, (104, 103, 4))) == mesh_routing.ACTION_DROP
+    assert router.droppedCount == 2
+
+GROUP = mesh_header.MULTICAST_FIRST + 1
+FLOOD = (102, mesh_header.BROADCAST_ADDRESS, 4)
+
+def test_group_packet_is_delivered_only_to_members():
+    router = mesh_routing.Router(103)
+
+    assert router.inspect(packetOf(102, GROUP)) == mesh_routing.ACTION_DROP
+    assert router.filteredCount == 1
+
+    router.join(GROUP)
+    assert router.inspect(packetOf(102, GROUP, sequence=2)) == mesh_routing.ACTION_DELIVER
+
+    router.leave(GROUP)
+    assert router.inspect(packetOf(102, GROUP, sequence=3)) == mesh_routing.ACTION_DROP
+
+    #   Everyone is a member of broadcast
+    assert router.inspect(packetOf(102, mesh_header.BROADCAST_ADDRESS)) == mesh_routing.ACTION_DELIVER
+
+def test_only_multicast_groups_can_be_joined():
+    router = mesh_routing.Router(103)
+
+    with pytest.raises(ValueError):
+        router.join(104)
+
+def test_flooded_packet_is_passed_on_once():
+    member = mesh_routing.Router(103)
+    member.join(GROUP)
+    other = mesh_routing.Router(104)
+
+    assert member.inspect(packetOf(102, GROUP, FLOOD)) == mesh_routing.ACTION_DELIVER_AND_FORWARD
+    assert other.inspect(packetOf(102, GROUP, FLOOD)) == mesh_routing.ACTION_FORWARD
+
+    #   The same packet again, through another neighbor
+    assert member.inspect(packetOf(102, GROUP, (105, mesh_header.BROADCAST_ADDRESS, 3))) == mesh_routing.ACTION_DROP
+    assert member.inspect(packetOf(102, GROUP, FLOOD, sequence=2)) == mesh_routing.ACTION_DELIVER_AND_FORWARD
+
+def test_flood_stops_at_the_end_of_its_ttl():
+    router = mesh_routing.Router(103)
+    router.join(GROUP)
+
+    assert router.inspect(packetOf(102, GROUP, (102, mesh_header.BROADCAST_ADDRESS, 1))) == mesh_routing.ACTION_DELIVER
+
+def test_own_flooded_packet_coming_back_is_dropped():
+    router = mesh_routing.Router(102)
+    router.join(GROUP)
+
+    assert router.inspect(packetOf(102, GROUP, (104, mesh_header.BROADCAST_ADDRESS, 3))) == mesh_routing.ACTION_DROP
+
+def test_flood_goes_out_with_a_routing_extension():
+    router = mesh_routing.Router(102)
+
+    assert router.routeTo(GROUP) == FLOOD[:2] + (mesh_routing.DEFAULT_TTL,)
+
+def test_routed_group_packet_not_flooded_is_dropped():
+    router = mesh_routing.Router(103)
+    router.join(GROUP)
+
+    assert router.inspect(packetOf(102, GROUP, (102, 103, 4))) == mesh_routing.ACTION_DROP
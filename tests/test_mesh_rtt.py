@@ -0,0 +1,87 @@
+import mesh_arq
+import mesh_rtt
+
+def test_first_sample_sets_srtt_and_half_of_it_as_variance():
+    estimator = mesh_rtt.RttEstimator()
+
+    assert estimator.timeout == mesh_rtt.DEFAULT_INITIAL_TIMEOUT_MS
+
+    estimator.sample(100)
+
+    assert estimator.smoothedRtt() == 100
+    assert estimator.rttVariance() == 50
+    assert estimator.timeout == 300
+
+def test_later_samples_are_smoothed():
+    estimator = mesh_rtt.RttEstimator()
+    estimator.sample(100)
+    estimator.sample(180)
+
+    #   srtt 100 + 80 / 8, rttvar 3/4 50 + 1/4 80
+    assert estimator.smoothedRtt() == 110
+    assert estimator.rttVariance() == 57
+    assert estimator.timeout == 110 + 230
+
+    for _ in range(50):
+        estimator.sample(100)
+
+    assert estimator.smoothedRtt() == 100
+    assert estimator.timeout < 110
+
+def test_timeout_is_clamped():
+    estimator = mesh_rtt.RttEstimator(minTimeout=30, maxTimeout=8000)
+
+    estimator.sample(1)
+    assert estimator.timeout == 30
+
+    estimator = mesh_rtt.RttEstimator(minTimeout=30, maxTimeout=8000)
+    estimator.sample(5000)
+    assert estimator.timeout == 8000
+
+def test_backoff_doubles_until_a_fresh_sample():
+    estimator = mesh_rtt.RttEstimator()
+
+    #   Before any sample the initial timeout doubles
+    estimator.backoff()
+    assert estimator.timeout == 2 * mesh_rtt.DEFAULT_INITIAL_TIMEOUT_MS
+
+    estimator.sample(100)
+    estimator.backoff()
+    assert estimator.timeout == 600
+    estimator.backoff()
+    assert estimator.timeout == 1200
+
+    for _ in range(20):
+        estimator.backoff()
+
+    assert estimator.timeout == mesh_rtt.DEFAULT_MAX_TIMEOUT_MS
+
+    estimator.sample(100)
+    assert estimator.timeout == 100 + 150
+
+def test_retransmitted_packet_gives_no_sample():
+    estimator = mesh_rtt.RttEstimator()
+    sender = mesh_arq.ArqSender(4, rttEstimator=estimator)
+
+    first = sender.queue(b"a")
+    second = sender.queue(b"b")
+    sender.sent(first, 0)
+    sender.sent(second, 0)
+
+    #   first timed out and went again, its ACK may be of either copy
+    sender.sent(first, 1000)
+    assert sender.acknowledge(first, 1100)
+    assert estimator.sampleCount == 0
+
+    assert sender.acknowledge(second, 1100)
+    assert estimator.sampleCount == 1
+    assert estimator.smoothedRtt() == 1100
+
+def test_table_keeps_an_estimator_per_neighbor():
+    table = mesh_rtt.RttTable(initialTimeout=500)
+
+    table.estimatorFor(102).sample(100)
+
+    assert table.timeoutFor(102) == 300
+    assert table.timeoutFor(103) == 500
+    assert table.estimatorFor(102) is table.estimatorFor(102)
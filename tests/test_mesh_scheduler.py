@@ -0,0 +1,83 @@
+import mesh_clock
+import mesh_scheduler
+
+class Clock:
+    def __init__(self, monkeypatch, now=0):
+        self.now = now
+        monkeypatch.setattr(mesh_scheduler, "ticksMs", lambda: self.now)
+
+    def advance(self, milliseconds):
+        self.now = mesh_clock.ticksAdd(self.now, milliseconds)
+
+def test_due_tasks_run_in_order(monkeypatch):
+    clock = Clock(monkeypatch)
+    scheduler = mesh_scheduler.Scheduler()
+    ran = []
+
+    scheduler.every(100, lambda: ran.append("slow"), "slow", delay=50)
+    scheduler.every(10, lambda: ran.append("fast"), "fast")
+    scheduler.after(30, lambda: ran.append("once"), "once")
+
+    assert scheduler.runOnce() == 10
+    assert ran == ["fast"]
+
+    clock.advance(50)
+    assert scheduler.runOnce() == 10
+    assert ran == ["fast", "slow", "fast", "once"]
+    assert [task.name for task in scheduler.tasks] == ["slow", "fast"]
+
+def test_returned_delay_rearms_the_task(monkeypatch):
+    clock = Clock(monkeypatch)
+    scheduler = mesh_scheduler.Scheduler(maxIdle=1000)
+    delays = [300, None]
+
+    task = scheduler.every(50, lambda: delays.pop(0))
+
+    assert scheduler.runOnce() == 300
+    assert task.deadline == 300
+
+    #   None keeps the fixed interval, counted from the deadline
+    clock.advance(305)
+    assert scheduler.runOnce() == 45
+    assert task.deadline == 350
+
+def test_wake_only_moves_a_deadline_forward(monkeypatch):
+    Clock(monkeypatch)
+    scheduler = mesh_scheduler.Scheduler(maxIdle=1000)
+    task = scheduler.every(500, lambda: None, delay=500)
+
+    scheduler.wake(task, 600)
+    assert task.deadline == 500
+
+    scheduler.wake(task, 20)
+    assert scheduler.runOnce() == 20
+
+def test_late_task_does_not_catch_up(monkeypatch):
+    clock = Clock(monkeypatch)
+    scheduler = mesh_scheduler.Scheduler(maxIdle=1000)
+    task = scheduler.every(100, lambda: None)
+
+    scheduler.runOnce()
+    clock.advance(350)
+    scheduler.runOnce()
+
+    assert task.overrunCount == 1
+    assert scheduler.runOnce() == 100
+    assert task.runCount == 2
+
+def test_deadlines_across_ticks_wrap_around(monkeypatch):
+    clock = Clock(monkeypatch, mesh_clock.TICKS_MAX - 20)
+    scheduler = mesh_scheduler.Scheduler(maxIdle=1000)
+    ran = []
+
+    scheduler.every(50, lambda: ran.append(clock.now), delay=40)
+
+    assert scheduler.runOnce() == 40
+    assert ran == []
+
+    clock.advance(39)
+    assert scheduler.runOnce() == 1
+
+    clock.advance(1)
+    assert scheduler.runOnce() == 50
+    assert ran == [19]
@@ -0,0 +1,42 @@
+import struct
+
+import mesh_batch
+import mesh_sensor
+
+READINGS = (9.81, -0.02, 0.5, 40.3, -21.7, 3276.7, 0.001, -0.2, 32.767)
+
+def test_imu_record_round_trip():
+    values = mesh_sensor.encodeImu(*READINGS)
+    record = struct.pack(mesh_sensor.IMU_V1_FORMAT, *values)
+
+    assert len(record) == 18
+    assert mesh_sensor.decodeImu(struct.unpack(mesh_sensor.IMU_V1_FORMAT, record)) == READINGS
+
+def test_readings_are_rounded_to_the_resolution():
+    values = mesh_sensor.encodeImu(9.806, 0, 0, 40.04, 0, 0, 0.0004, 0, 0)
+
+    assert values[0] == 981
+    assert values[3] == 400
+    assert values[6] == 0
+
+def test_readings_out_of_range_are_clamped():
+    values = mesh_sensor.encodeImu(400, -400, 0, 5000, -5000, 0, 40, -40, 0)
+
+    assert values == (32767, -32768, 0, 32767, -32768, 0, 32767, -32768, 0)
+
+def test_timed_record_keeps_its_time():
+    values = mesh_sensor.encodeImu(*READINGS)
+
+    assert mesh_sensor.decodeTimedImu((123456,) + values) == (123456,) + READINGS
+
+def test_batch_of_imu_records_decodes_to_the_readings():
+    batcher = mesh_batch.SampleBatcher(mesh_batch.RECORD_IMU_V1)
+    batcher.add(*mesh_sensor.encodeImu(*READINGS))
+
+    assert list(mesh_batch.decodeBatch(bytes(batcher.flush()))) == [READINGS]
+
+def test_description_lists_every_channel():
+    description = mesh_sensor.describe("IMU_V1", mesh_sensor.IMU_V1_CHANNELS)
+
+    assert description.startswith(b"IMU_V1 acc_x:m/s^2/100 ")
+    assert description.count(b":") == 9
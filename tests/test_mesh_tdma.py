@@ -0,0 +1,40 @@
+import mesh_header
+import mesh_tdma
+
+def beacon(table):
+    packet = mesh_header.newPacketBuffer()
+    length = table.packBeacon(packet, 1)
+
+    return bytes(packet[:length])
+
+def test_slot_is_timed_from_when_the_beacon_arrived():
+    table = mesh_tdma.SlotTable()
+    slot = table.join(103, 0)
+    node = mesh_tdma.TdmaSchedule(103, None)
+
+    #   Received at 1000, handled a while later
+    assert node.handle(beacon(table), 1000)
+    assert node.slot == slot
+    assert node.timeUntilTransmit(1000) == slot * mesh_tdma.DEFAULT_SLOT_MS
+    assert node.timeUntilTransmit(1000 + slot * mesh_tdma.DEFAULT_SLOT_MS) == 0
+    assert node.isActive(1000 + mesh_tdma.DEFAULT_LOSS_LIMIT * mesh_tdma.DEFAULT_SUPERFRAME_MS - 1)
+    assert not node.isActive(1000 + mesh_tdma.DEFAULT_LOSS_LIMIT * mesh_tdma.DEFAULT_SUPERFRAME_MS)
+
+def test_join_until_a_slot_is_given():
+    table = mesh_tdma.SlotTable()
+    sent = []
+    node = mesh_tdma.TdmaSchedule(103, lambda frame: sent.append(bytes(frame)))
+
+    assert not node.join(0)
+    node.handle(beacon(table), 0)
+    assert node.join(10)
+    assert not node.join(20)
+
+    assert table.handle(sent[0], 30)
+
+    #   The table goes out a page at a time, the first beacon held the first page
+    for superframe in (1, 2):
+        node.handle(beacon(table), superframe * mesh_tdma.DEFAULT_SUPERFRAME_MS)
+
+    assert node.slot == table.slotOf(103)
+    assert not node.join(3 * mesh_tdma.DEFAULT_SUPERFRAME_MS)
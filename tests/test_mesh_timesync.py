@@ -0,0 +1,78 @@
+import mesh_timesync
+
+ROOT = 1
+NODE = 102
+
+class Network:
+    #   A root and a node one hop away, the node's ticks running OFFSET_MS behind
+    #       network time
+    OFFSET_MS = 123456
+
+    def __init__(self, monkeypatch):
+        self.time = 5000000
+        self.frames = []
+        monkeypatch.setattr(mesh_timesync, "ticksMs", self.ticks)
+
+        self.node = mesh_timesync.TimeSync(NODE, lambda frame: None)
+        self.restartRoot()
+
+    def ticks(self):
+        return self.time - self.OFFSET_MS
+
+    def restartRoot(self):
+        self.root = mesh_timesync.TimeSync(ROOT, self.frames.append, isRoot=True, rootTime=lambda: self.time)
+
+    def rounds(self, count):
+        #   Returns how many of the rounds the node took
+        before = self.node.roundCount
+
+        for _ in range(count):
+            self.time += mesh_timesync.SYNC_INTERVAL_MS
+            self.root.startRound()
+
+            frame = bytearray(self.frames.pop())
+            self.root.stamp(frame)
+            self.node.handle(frame, self.ticks())
+
+        return self.node.roundCount - before
+
+def test_node_follows_network_time(monkeypatch):
+    network = Network(monkeypatch)
+
+    assert not network.node.isSynchronized()
+    assert network.rounds(3) == 3
+    assert network.node.isSynchronized()
+    assert network.node.level == 1
+    assert abs(mesh_timesync.networkDiff(network.node.now(), network.time)) <= 1
+
+def test_old_round_from_a_neighbor_is_ignored(monkeypatch):
+    network = Network(monkeypatch)
+    network.rounds(3)
+
+    network.root.round -= 2
+    assert network.rounds(1) == 0
+    assert network.node.restartCount == 0
+
+def test_node_follows_a_root_that_restarted(monkeypatch):
+    network = Network(monkeypatch)
+
+    assert network.rounds(50) == 50
+
+    network.restartRoot()
+
+    assert network.rounds(20) == 20
+    assert network.node.restartCount == 1
+    assert network.node.round == 20
+    assert network.node.isSynchronized()
+
+def test_root_lost_for_a_while_comes_back_with_a_low_round(monkeypatch):
+    network = Network(monkeypatch)
+    network.rounds(3)
+
+    #   Silent past the loss limit, back counting from 1, close to where it was
+    network.time += mesh_timesync.LOSS_LIMIT * mesh_timesync.SYNC_INTERVAL_MS
+    network.restartRoot()
+
+    assert not network.node.isSynchronized()
+    assert network.rounds(2) == 2
+    assert network.node.isSynchronized()